@@ -1,12 +1,17 @@
 # coding: utf-8
 import numpy as np
 # import scipy.sparse as sp
-import scipy.stats as stats
+from scipy.special import logsumexp
 
 from ..utils import findLowerUpper
 from ..utils import _check_sample_weight
 from ..utils import flush_progress_bar
 from ..utils import handleRandomState
+from ..utils import handleKeyError
+from ..utils import log_mask_zero
+from ..utils import log_multivariate_normal_density
+from ..utils import decompress_based_on_covariance_type
+from ..utils import compress_based_on_covariance_type_from_tied_shape
 from ..utils import paired_euclidean_distances
 from ..utils import silhouette_plot
 from ..clib import c_kmeans
@@ -140,50 +145,188 @@ class ElkanKMeans(KMeans):
         self.centroids, self.inertia_, self.labels_, self.iterations_ = c_kmeans.k_means_elkan(X, sample_weight, self.n_clusters, init_centroids, tol=tol, max_iter=max_iter, verbose=verbose)
 
 class MixedGaussian(BaseEMmodel):
-    def __init__(self, n_clusters=8, init="k++", random_state=None, metrics="euclid"):
+    """ Gaussian Mixture Model trained by the EM algorithm.
+    All computations in the E-step are done in the log space to avoid underflow,
+    and the M-step updates all components at once with matrix operations.
+    ~~~
+    @params covariance_type : (str) 'spherical', 'diag', 'tied', or 'full'.
+    @params min_covariances : (float) Added to the diagonal of covariances to keep them positive-definite.
+    """
+    def __init__(self, n_clusters=8, init="k++", random_state=None, metrics="euclid",
+                 covariance_type="full", min_covariances=1e-3):
         super().__init__(n_clusters=n_clusters, init=init, random_state=random_state, metrics=metrics)
+        handleKeyError(["spherical", "diag", "tied", "full"], covariance_type=covariance_type)
+        self.covariance_type = covariance_type
+        self.min_covariances = min_covariances
         self.centroids=None
-        self.S=None
+        self._covariances=None
         self.pi=None
+        self._statistics=None
 
-    def fit(self, X, sample_weight=None, max_iter=300, memorize=False, tol=1e-4, verbose=1):
+    @property
+    def S(self):
+        """ Covariance matrices. shape=(n_clusters, n_features, n_features) """
+        if self._covariances is None:
+            return None
+        return decompress_based_on_covariance_type(
+            self._covariances, self.covariance_type, self.n_clusters, self.centroids.shape[1]
+        )
+
+    def _init_params(self, X):
+        _,D = X.shape
         self.centroids = self._find_initial_centroids(X, n_clusters=self.n_clusters, init=self.init, random_state=self.rnd) # Initialize the mean value `self.centroids` within data space.
-        self.S  = [1*np.eye(2) for k in range(self.n_clusters)] # Initialize with Diagonal matrix
+        cv = np.cov(X.T).reshape(D,D) + self.min_covariances*np.eye(D)
+        self._covariances = compress_based_on_covariance_type_from_tied_shape(cv, covariance_type=self.covariance_type, n_gaussian=self.n_clusters)
         self.pi = np.ones(self.n_clusters)/self.n_clusters # Initialize with Uniform.
+
+    def fit(self, X, sample_weight=None, max_iter=300, memorize=False, tol=1e-4, verbose=1):
+        X = np.asarray(X, dtype=float)
+        self._init_params(X)
+        self._statistics = None
         sample_weight = _check_sample_weight(sample_weight, X)
         # EM algorithm.
         for it in range(max_iter):
-            gamma = self.Estep(X)
+            log_prob_norm, log_gamma = self._estimate_log_prob_resp(X)
+            gamma = np.exp(log_gamma)
             if memorize: self._memorize_param(np.argmax(gamma, axis=1), self.centroids, self.S, self.pi)
-            self.Mstep(X, gamma)
-            ll = self.loglikelihood(X)
+            statistics = self.Mstep(X, gamma, sample_weight=sample_weight)
+            # Log likelihood of the parameters used in this E-step (by-product.)
+            ll = np.sum(sample_weight*log_prob_norm)
             flush_progress_bar(it, max_iter, metrics={"Log Likelihood": ll}, verbose=verbose)
             mus = np.copy(self.centroids.ravel())
             if it>0 and np.mean(np.linalg.norm(mus-pmus)) < tol: break
             pmus = mus
+        self.iterations_ = it+1
+        # Keep the statistics (per unit weight) of the last M-step so that `partial_fit` can continue from them.
+        self._statistics = self._normalize_statistics(statistics, sample_weight.sum())
+        self.n_batches_ = 1
         if memorize: self._memorize_param(gamma)
         if verbose>0: print()
 
     def predict(self, X):
-        gamma = self.Estep(X, normalized=False)
-        labels = np.argmax(gamma, axis=1)
+        log_prob = self._estimate_weighted_log_prob(X)
+        labels = np.argmax(log_prob, axis=1)
         return labels
 
+    def _estimate_weighted_log_prob(self, X):
+        """ log(pi_k) + log N(x_n|mu_k,S_k). shape=(n_samples, n_clusters) """
+        return log_multivariate_normal_density(X, self.centroids, self._covariances, self.covariance_type) + log_mask_zero(self.pi)
+
+    def _estimate_log_prob_resp(self, X):
+        """
+        @return log_prob_norm : log p(x_n) = log sum_k pi_k N(x_n|mu_k,S_k). shape=(n_samples,)
+        @return log_gamma     : log responsibilities.                        shape=(n_samples, n_clusters)
+        """
+        weighted_log_prob = self._estimate_weighted_log_prob(X)
+        log_prob_norm = logsumexp(weighted_log_prob, axis=1)
+        with np.errstate(under="ignore"):
+            log_gamma = weighted_log_prob - log_prob_norm[:, np.newaxis]
+        return log_prob_norm, log_gamma
+
     def Estep(self, X, normalized=True):
-        N,_ = X.shape
-        gamma = np.zeros(shape=(N, self.n_clusters))
-        for k in range(self.n_clusters):
-            gamma[:,k] = self.pi[k] * stats.multivariate_normal(self.centroids[k], self.S[k]).pdf(X)
-        if normalized: gamma /= np.sum(gamma, axis=1)[:,None]
-        return gamma
-
-    def Mstep(self, X, gamma):
-        N,_ = X.shape
-        for k in range(self.n_clusters):
-            Nk = np.sum(gamma[:, k])
-            self.centroids[k] = gamma[:,k].dot(X)/Nk
-            self.S[k]  = (np.expand_dims(gamma[:,k], axis=1)*(X-self.centroids[k])).T.dot(X-self.centroids[k]) / Nk
-            self.pi[k] = Nk/N
+        if normalized:
+            _, log_gamma = self._estimate_log_prob_resp(X)
+        else:
+            log_gamma = self._estimate_weighted_log_prob(X)
+        return np.exp(log_gamma)
+
+    def Mstep(self, X, gamma, sample_weight=None):
+        if sample_weight is not None:
+            gamma = gamma * sample_weight[:, np.newaxis]
+        statistics = self._compute_statistics(X, gamma)
+        self._Mstep(statistics)
+        return statistics
+
+    def _compute_statistics(self, X, gamma):
+        """ Sufficient statistics of the mixture for the (weighted) responsibilities `gamma`.
+        The scatter is centred at the mean of each component, Σ_n gamma_nk (x_n-mu_k)(x_n-mu_k)^T,
+        so that no precision is lost even if the data have a large offset.
+        """
+        Nk = gamma.sum(axis=0)
+        means = gamma.T.dot(X) / (Nk + 10*np.finfo(float).eps)[:, np.newaxis]
+        diff = X[:, np.newaxis, :] - means[np.newaxis, :, :] # shape=(n_samples, n_clusters, n_features)
+        if self.covariance_type in ('spherical', 'diag'):
+            scatter = np.einsum('nk,nkd->kd', gamma, diff**2)
+        else:
+            scatter = np.einsum('nk,nkd,nke->kde', gamma, diff, diff)
+        return {'posterior': Nk, 'mean': means, 'scatter': scatter}
+
+    def _merge_statistics(self, statistics_a, statistics_b, weight_a, weight_b):
+        """ Weighted sum of two statistics. The centred scatters are merged by the parallel algorithm.
+        (T.F. Chan, G.H. Golub, R.J. LeVeque. Updating Formulae and a Pairwise Algorithm for Computing Sample Variances. 1979)
+        """
+        Nk_a = weight_a*statistics_a['posterior']
+        Nk_b = weight_b*statistics_b['posterior']
+        Nk = Nk_a + Nk_b
+        means = (Nk_a[:, np.newaxis]*statistics_a['mean'] + Nk_b[:, np.newaxis]*statistics_b['mean']) / \
+                (Nk + 10*np.finfo(float).eps)[:, np.newaxis]
+        scatter = weight_a*statistics_a['scatter'] + weight_b*statistics_b['scatter']
+        for Nk_, means_ in zip([Nk_a, Nk_b], [statistics_a['mean'], statistics_b['mean']]):
+            delta = means_ - means
+            if self.covariance_type in ('spherical', 'diag'):
+                scatter += Nk_[:, np.newaxis] * delta**2
+            else:
+                scatter += np.einsum('k,kd,ke->kde', Nk_, delta, delta)
+        return {'posterior': Nk, 'mean': means, 'scatter': scatter}
+
+    def _Mstep(self, statistics):
+        Nk = statistics['posterior'] + 10*np.finfo(float).eps # shape=(n_clusters,)
+        D = statistics['mean'].shape[1]
+
+        if self.covariance_type in ('spherical', 'diag'):
+            covariances = statistics['scatter'] / Nk[:, np.newaxis] + self.min_covariances
+            if self.covariance_type == 'spherical':
+                covariances = covariances.mean(axis=1)
+        elif self.covariance_type == 'tied':
+            covariances = statistics['scatter'].sum(axis=0) / Nk.sum()
+            covariances.flat[::D+1] += self.min_covariances
+        elif self.covariance_type == 'full':
+            covariances = statistics['scatter'] / Nk[:, np.newaxis, np.newaxis]
+            covariances[:, np.arange(D), np.arange(D)] += self.min_covariances
+
+        self.centroids = statistics['mean']
+        self._covariances = covariances
+        self.pi = Nk/Nk.sum()
+
+    def partial_fit(self, X, sample_weight=None, decay=0.6, offset=2.0):
+        """ Online (stepwise) EM for one mini-batch.
+        Sufficient statistics are kept as an exponentially-weighted average over
+        mini-batches, so the memory does not depend on the number of samples seen.
+        If the model has been trained by `fit`, it continues from the fitted statistics.
+        ~~~
+        s_{t} = (1-eta_t)*s_{t-1} + eta_t*E[s|X_t],  eta_t = (t+offset)^{-decay}
+        ~~~
+        @params X             : Mini-batch. shape=(n_samples, n_features)
+        @params sample_weight : shape=(n_samples,)
+        @params decay         : (float) Step size decay. It should be in (0.5, 1] to converge.
+        @params offset        : (float) Step size offset. Larger values make early updates smaller.
+        """
+        X = np.asarray(X, dtype=float)
+        sample_weight = _check_sample_weight(sample_weight, X)
+        if getattr(self, "_statistics", None) is None:
+            if X.shape[0] < self.n_clusters:
+                raise ValueError(f"The first `partial_fit` batch needs at least n_clusters ({self.n_clusters}) samples, but got {X.shape[0]}.")
+            self._init_params(X)
+            self.n_batches_ = 0
+
+        log_prob_norm, log_gamma = self._estimate_log_prob_resp(X)
+        gamma = np.exp(log_gamma) * sample_weight[:, np.newaxis]
+        # Normalize by the batch weight so that batches with different sizes are comparable.
+        statistics = self._normalize_statistics(self._compute_statistics(X, gamma), sample_weight.sum())
+
+        if self._statistics is None:
+            self._statistics = statistics
+        else:
+            eta = (self.n_batches_ + offset)**(-decay)
+            self._statistics = self._merge_statistics(self._statistics, statistics, 1-eta, eta)
+        self._Mstep(self._statistics)
+        self.n_batches_ += 1
+        return np.sum(sample_weight*log_prob_norm)
+
+    @staticmethod
+    def _normalize_statistics(statistics, total_weight):
+        """ Statistics per unit weight. (The means are invariant.) """
+        return {k: v if k=='mean' else v/total_weight for k,v in statistics.items()}
 
     def loglikelihood(self, X):
-        return np.sum(np.log(np.sum([self.pi[k]*stats.multivariate_normal(self.centroids[k], self.S[k]).pdf(X) for k in range(self.n_clusters)], axis=0)))
+        return np.sum(logsumexp(self._estimate_weighted_log_prob(X), axis=1))
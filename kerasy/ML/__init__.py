@@ -1,24 +1,27 @@
 # coding: utf-8
 
-from .boosting import L2Boosting, AdaBoost, LogitBoost
+from .boosting import L2Boosting, AdaBoost, LogitBoost, HistGradientBoostingRegressor, HistGradientBoostingClassifier
 from .cluster import DBSCAN
-from .decomposition import PCA, LDA, KernelPCA, tSNE, UMAP
+from .decomposition import PCA, IncrementalPCA, LDA, KernelPCA, tSNE, UMAP
 from .EM import KMeans, HamerlyKMeans, ElkanKMeans, MixedGaussian
 from .HMM import (MultinomialHMM, BernoulliHMM, BinomialHMM,
                   GaussianHMM, GaussianMixtureHMM, MSSHMM)
-from .linear import (LinearRegression, LinearRegressionLASSO,
+from .linear import (LinearRegression, LinearRegressionLASSO, LinearRegressionElasticNet,
                      LinearRegressionRidge, BayesianLinearRegression,
                      EvidenceApproxBayesianRegression, KernelRegression)
 from .sampling import RejectionSampler, MHSampler, GibbsMsphereSampler
 from .svm import SVC, hardSVC, MultipleSVM, RVM
-from .tree import TreeAnalysis, DecisionTreeClassifier
+from .tree import TreeAnalysis, DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier
 
 __all__ = [
     'L2Boosting',
     'AdaBoost',
     'LogitBoost',
+    'HistGradientBoostingRegressor',
+    'HistGradientBoostingClassifier',
     'DBSCAN',
     'PCA',
+    'IncrementalPCA',
     'LDA',
     'KernelPCA',
     'tSNE',
@@ -35,6 +38,7 @@ __all__ = [
     'MSSHMM',
     'LinearRegression',
     'LinearRegressionLASSO',
+    'LinearRegressionElasticNet',
     'LinearRegressionRidge',
     'BayesianLinearRegression',
     'EvidenceApproxBayesianRegression',
@@ -47,5 +51,7 @@ __all__ = [
     'MultipleSVM',
     'RVM',
     'TreeAnalysis',
-    'DecisionTreeClassifier'
+    'DecisionTreeClassifier',
+    'RandomForestClassifier',
+    'ExtraTreesClassifier'
 ]
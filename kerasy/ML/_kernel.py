@@ -1,12 +1,38 @@
 # coding: utf-8
 import re
+import hashlib
 import numpy as np
 from scipy import stats
+from scipy.spatial.distance import cdist
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABCMeta, abstractmethod
 
 from ..utils import mk_class_get
+from ..utils import make_batches
+from ..utils import handleNJobs
+from ..utils import handleKeyError
+from ..utils import handleRandomState
+
+# The default number of elements in each block of the gram matrix. (32MB in float64)
+GRAM_BLOCK_ELEMENTS = 1 << 22
+
+def _squared_euclidean(X, Y):
+    """ ||x-y||^2 = ||x||^2 + ||y||^2 - 2<x,y> """
+    distances = np.sum(np.square(X), axis=1)[:,None] + np.sum(np.square(Y), axis=1)[None,:] - 2*X.dot(Y.T)
+    return np.maximum(distances, 0, out=distances)
+
+def _cityblock(X, Y):
+    """ Σ|x-y| """
+    return cdist(X, Y, metric="cityblock")
+
+def _row_dot(X):
+    """ <x,x> for each row. """
+    return np.einsum("ij,ij->i", X, X)
 
 class KerasyAbstKernel(metaclass=ABCMeta):
+    # Whether k(x,x') depends only on x-x'. (Then k(x,x) is constant.)
+    stationary = False
+
     def __init__(self):
         self.name = re.sub(r"([a-z])([A-Z])", r"\1_\2", self.__class__.__name__).lower()
 
@@ -14,6 +40,63 @@ class KerasyAbstKernel(metaclass=ABCMeta):
     def __call__(self, x, x_prime):
         raise NotImplementedError
 
+    def gram(self, X, Y=None, block_size=None, dtype=np.float64, n_jobs=1):
+        """ Compute the gram matrix K[i,j] = k(X[i], Y[j]) block by block with the vectorized operations.
+        @params X          : shape=(N, D)
+        @params Y          : shape=(M, D) If None, Y = X.
+        @params block_size : (int) The number of rows computed at once. (Defaults to GRAM_BLOCK_ELEMENTS//M)
+        @params dtype      : The dtype of the computation. (np.float32 halves the memory.)
+        @params n_jobs     : (int) The number of threads to compute the blocks.
+        @return K          : shape=(N, M)
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=dtype))
+        Y = X if Y is None else np.atleast_2d(np.asarray(Y, dtype=dtype))
+        n_X, n_Y = X.shape[0], Y.shape[0]
+        if block_size is None:
+            block_size = max(1, GRAM_BLOCK_ELEMENTS//max(1, n_Y))
+        K = np.empty(shape=(n_X, n_Y), dtype=dtype)
+        def fill_block(batch):
+            start, end = batch
+            K[start:end] = self._gram_block(X[start:end], Y)
+
+        batches = make_batches(n_X, block_size)
+        n_jobs = min(handleNJobs(n_jobs), len(batches))
+        if n_jobs == 1:
+            for batch in batches:
+                fill_block(batch)
+        else:
+            # numpy releases the GIL, so threads are enough.
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(fill_block, batches))
+        return K
+
+    def _gram_block(self, X, Y):
+        """ Gram matrix of the block. (Kernels should override this by the vectorized version.) """
+        return np.asarray([[self(x, y) for y in Y] for x in X])
+
+    def get_params(self):
+        """ The name and the parameters of the kernel, which identify the gram matrix.
+        (Nested kernels are expanded, and arrays are represented by their hash values.)
+        """
+        params = []
+        for k,v in sorted(vars(self).items()):
+            if isinstance(v, KerasyAbstKernel):
+                v = v.get_params()
+            elif isinstance(v, np.ndarray):
+                v = (v.shape, hashlib.sha1(np.ascontiguousarray(v).view(np.uint8)).hexdigest())
+            params.append((k, v))
+        return (self.__class__.__name__, tuple(params))
+
+    def diag(self, X):
+        """ Diagonal elements of the gram matrix k(X[i], X[i]) without computing the whole matrix.
+        @params X : shape=(N, D)
+        @return   : shape=(N,)
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if self.stationary:
+            return np.full(X.shape[0], self._gram_block(X[:1], X[:1])[0,0])
+        return np.asarray([self._gram_block(x[None], x[None])[0,0] for x in X])
+
 class Linear(KerasyAbstKernel):
     def __init__(self, c=0):
         self.c = c
@@ -22,6 +105,13 @@ class Linear(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return x.T.dot(x_prime) + self.c
 
+    def _gram_block(self, X, Y):
+        return X.dot(Y.T) + self.c
+
+    def diag(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return _row_dot(X) + self.c
+
 class Polynomial(KerasyAbstKernel):
     def __init__(self, alpha=1, c=0, d=3):
         self.alpha = alpha
@@ -32,7 +122,16 @@ class Polynomial(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return (self.alpha*x.T.dot(x_prime) + self.c)**self.d
 
+    def _gram_block(self, X, Y):
+        return (self.alpha*X.dot(Y.T) + self.c)**self.d
+
+    def diag(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return (self.alpha*_row_dot(X) + self.c)**self.d
+
 class Gaussian(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, sigma=1):
         self.sigma = sigma
         super().__init__()
@@ -40,7 +139,12 @@ class Gaussian(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return np.exp(-sum((x-x_prime)**2)/(2*self.sigma**2))
 
+    def _gram_block(self, X, Y):
+        return np.exp(-_squared_euclidean(X, Y)/(2*self.sigma**2))
+
 class Exponential(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, sigma=0.1):
         self.sigma = sigma
         super().__init__()
@@ -48,7 +152,12 @@ class Exponential(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return np.exp(-sum(abs(x-x_prime))/(2*self.sigma**2))
 
+    def _gram_block(self, X, Y):
+        return np.exp(-_cityblock(X, Y)/(2*self.sigma**2))
+
 class Laplacian(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, sigma=0.1):
         self.sigma = sigma
         super().__init__()
@@ -56,6 +165,9 @@ class Laplacian(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return np.exp(-sum(abs(x-x_prime))/self.sigma)
 
+    def _gram_block(self, X, Y):
+        return np.exp(-_cityblock(X, Y)/self.sigma)
+
 class HyperbolicTangent(KerasyAbstKernel):
     def __init__(self, alpha=1, c=0):
         self.alpha = alpha
@@ -65,7 +177,16 @@ class HyperbolicTangent(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return np.tanh(self.alpha*x.T.dot(x_prime) + self.c)
 
+    def _gram_block(self, X, Y):
+        return np.tanh(self.alpha*X.dot(Y.T) + self.c)
+
+    def diag(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return np.tanh(self.alpha*_row_dot(X) + self.c)
+
 class RationalQuadratic(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, c=1):
         self.c = c
         super().__init__()
@@ -73,27 +194,46 @@ class RationalQuadratic(KerasyAbstKernel):
     def __call__(self, x, x_prime):
         return 1 - sum((x-x_prime)**2)/(sum((x-x_prime)**2)+self.c)
 
+    def _gram_block(self, X, Y):
+        distances = _squared_euclidean(X, Y)
+        return 1 - distances/(distances+self.c)
+
 class Multiquadric(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, c=1):
         self.c = c
 
     def __call__(self, x, x_prime):
         return np.sqrt(sum((x-x_prime)**2) + self.c)
 
+    def _gram_block(self, X, Y):
+        return np.sqrt(_squared_euclidean(X, Y) + self.c)
+
 class InverseMultiquadric(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, c=1):
         self.multiquadric = Multiquadric(c=c)
 
     def __call__(self, x, x_prime):
         return 1/self.multiquadric(x,x_prime)
 
+    def _gram_block(self, X, Y):
+        return 1/self.multiquadric._gram_block(X, Y)
+
 class Log(KerasyAbstKernel):
+    stationary = True
+
     def __init__(self, d=3):
         self.d = d
 
     def __call__(self, x, x_prime):
         return -np.log(sum(abs(x-x_prime)**self.d) + 1)
 
+    def _gram_block(self, X, Y):
+        return -np.log(cdist(X, Y, metric="minkowski", p=self.d)**self.d + 1)
+
 all = KerasyKernelFunctions = {
     "linear"               : Linear,
     "polynomial"           : Polynomial,
@@ -112,3 +252,98 @@ get = mk_class_get(
     kerasy_abst_class=[KerasyAbstKernel],
     genre="kernel"
 )
+
+class KernelApproximation(KerasyAbstKernel):
+    """ Low-rank approximation of the kernel k(x,x') ≈ φ(x)^Tφ(x') with the explicit
+    feature map φ: R^D → R^m, so the estimators can be solved in O(N·m) memory instead of O(N^2).
+    ~~~
+    @params kernel       : (KerasyAbstKernel) The kernel to be approximated.
+    @params n_components : (int) The dimension of the feature space. (m)
+    @params random_state : (int, RandomState)
+    """
+    def __init__(self, kernel, n_components=100, random_state=None):
+        self.kernel = kernel
+        self.n_components = n_components
+        self.random_state = random_state
+        super().__init__()
+
+    @abstractmethod
+    def fit(self, X):
+        raise NotImplementedError
+
+    @abstractmethod
+    def transform(self, X):
+        """ @return Phi : shape=(N, n_components) """
+        raise NotImplementedError
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def __call__(self, x, x_prime):
+        return self.transform(x)[0].dot(self.transform(x_prime)[0])
+
+    def _gram_block(self, X, Y):
+        return self.transform(X).dot(self.transform(Y).T)
+
+    def diag(self, X):
+        return np.sum(np.square(self.transform(X)), axis=1)
+
+class Nystroem(KernelApproximation):
+    """ Nyström method: Use the randomly selected `n_components` samples as the landmarks L.
+    K ≈ K_{NL} K_{LL}^{-1} K_{LN}, so φ(x) = K_{LL}^{-1/2} k(L, x)
+    Ref: C.K.I. Williams, M. Seeger. Using the Nyström Method to Speed Up Kernel Machines. (NIPS 2001)
+    """
+    def fit(self, X):
+        X = np.asarray(X, dtype=float)
+        n_samples = X.shape[0]
+        n_components = min(self.n_components, n_samples)
+        rnd = handleRandomState(self.random_state)
+        self.landmarks_ = X[rnd.permutation(n_samples)[:n_components]]
+        eigenvals, eigenvecs = np.linalg.eigh(self.kernel.gram(self.landmarks_))
+        # Pseudo inverse square root (ignore the tiny eigenvalues for numerical stability.)
+        eigenvals = np.maximum(eigenvals, 1e-12)
+        self.normalization_ = (eigenvecs / np.sqrt(eigenvals)).dot(eigenvecs.T)
+        return self
+
+    def transform(self, X):
+        return self.kernel.gram(X, self.landmarks_).dot(self.normalization_.T)
+
+class RandomFourierFeatures(KernelApproximation):
+    """ Random Fourier features for the shift-invariant kernels k(x,x') = k(x-x').
+    By Bochner's theorem, k(x-x') = E_w[cos(w^T(x-x'))] where w is sampled from the Fourier transform of k.
+    φ(x) = sqrt(2/m) cos(W^T x + b), b ~ U(0, 2π)
+      - gaussian     : w ~ N(0, 1/sigma^2)
+      - laplacian    : w ~ Cauchy(0, 1/sigma) for each dimension
+      - exponential  : w ~ Cauchy(0, 1/(2 sigma^2)) for each dimension
+    Ref: A. Rahimi, B. Recht. Random Features for Large-Scale Kernel Machines. (NIPS 2007)
+    """
+    def fit(self, X):
+        n_features = np.atleast_2d(X).shape[1]
+        rnd = handleRandomState(self.random_state)
+        size = (n_features, self.n_components)
+        if isinstance(self.kernel, Gaussian):
+            self.weights_ = rnd.normal(scale=1/self.kernel.sigma, size=size)
+        elif isinstance(self.kernel, Laplacian):
+            self.weights_ = rnd.standard_cauchy(size=size) / self.kernel.sigma
+        elif isinstance(self.kernel, Exponential):
+            self.weights_ = rnd.standard_cauchy(size=size) / (2*self.kernel.sigma**2)
+        else:
+            raise ValueError(f"Random Fourier features only support the shift-invariant kernels (gaussian, laplacian, exponential), but got {self.kernel.name}.")
+        self.offsets_ = rnd.uniform(low=0, high=2*np.pi, size=self.n_components)
+        return self
+
+    def transform(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return np.sqrt(2/self.n_components) * np.cos(X.dot(self.weights_) + self.offsets_)
+
+KerasyKernelApproximations = {
+    "nystroem" : Nystroem,
+    "fourier"  : RandomFourierFeatures,
+}
+
+def get_approximation(approximation, kernel, n_components=100, random_state=None):
+    """ Get the (not fitted) kernel approximation of `kernel`.
+    @params approximation : 'nystroem' or 'fourier'
+    """
+    handleKeyError(lst=list(KerasyKernelApproximations.keys()), approximation=approximation)
+    return KerasyKernelApproximations[approximation](kernel=kernel, n_components=n_components, random_state=random_state)
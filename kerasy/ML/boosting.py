@@ -1,6 +1,14 @@
 #coding: utf-8
+import os
+import heapq
+import hashlib
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .tree import bin_features
+from .tree import CompactTree
+from ..utils import handleNJobs
 from ..utils import ProgressMonitor
+from ..clib import c_boosting
 
 class BaseBoosting():
     """Boosting is an ensemble method
@@ -25,6 +33,7 @@ class BaseBoosting():
         self.alpha = np.zeros(shape=len(Models))
         self.input_shape = None
         self.output_shape = None
+        self.H_cache = None # (fingerprint of X, H)
 
     def fit(self, train_x, train_y, T):
         """
@@ -34,16 +43,89 @@ class BaseBoosting():
         """
         raise NotImplemented()
 
-    def predict(self, X):
+    def predict_models(self, X, model_indices=None, n_jobs=1, out=None):
+        """ Outputs of the weak learners.
+        The masked inputs X[:, mask] are computed only once for each distinct mask, and the
+        weak learners are evaluated in parallel threads.
+        @param X             : shape=(num_samples, feature_shape)
+        @param model_indices : (list) Indices of the models to be evaluated. (Defaults to all models.)
+        @param n_jobs        : (int) The number of threads.
+        @param out           : (ndarray) The output array. (e.g. np.memmap)
+        @return H            : shape=(len(model_indices), num_samples×prod(output_shape))
+        """
+        if model_indices is None:
+            model_indices = range(self.num_Models)
+        model_indices = list(model_indices)
+        if out is None:
+            out = np.empty(shape=(len(model_indices), len(X)*int(np.prod(self.output_shape))), dtype=float)
+        inputs = {}
+        keys = []
+        for m_idx in model_indices:
+            mask = self.Masks[m_idx]
+            key = "..." if mask is Ellipsis else np.asarray(mask).tobytes()
+            if key not in inputs:
+                inputs[key] = X if mask is Ellipsis else X[:, mask]
+            keys.append(key)
+
+        def fill_row(k):
+            out[k] = np.asarray(self.Models[model_indices[k]].predict(inputs[keys[k]]), dtype=float).reshape(-1)
+
+        n_jobs = min(handleNJobs(n_jobs), max(1, len(model_indices)))
+        if n_jobs == 1:
+            for k in range(len(model_indices)):
+                fill_row(k)
+        else:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(fill_row, range(len(model_indices))))
+        return out
+
+    def compute_H(self, X, n_jobs=1, memmap_path=None, cache=True):
+        """ Weak learners' outputs for all models. It is cached, so it is reused across `fit` calls on the same data.
+        @param memmap_path : (str) If given, H is stored in the memory-mapped `.npy` file, and the fingerprint of
+                             the data is stored in `memmap_path + ".fingerprint"`. If `cache` is True and the file was
+                             computed from the same data, it is reopened read-only instead of being recomputed.
+                             (The file must have been written by the same weak learners.)
+        @param cache       : (bool) Whether to use (and store) the cache.
+        @return H          : shape=(num_models, num_samples×prod(output_shape))
         """
+        fingerprint = None
+        if cache:
+            fingerprint = repr((X.shape, hashlib.sha1(np.ascontiguousarray(X).view(np.uint8)).hexdigest(), self.num_Models))
+            if self.H_cache is not None and self.H_cache[0] == fingerprint \
+                and (memmap_path is None or getattr(self.H_cache[1], "filename", None) == os.path.abspath(memmap_path)):
+                return self.H_cache[1]
+        out = None
+        if memmap_path is not None:
+            fingerprint_path = memmap_path + ".fingerprint"
+            if cache and os.path.exists(memmap_path) and os.path.exists(fingerprint_path):
+                with open(fingerprint_path) as f:
+                    if f.read() == fingerprint:
+                        H = np.lib.format.open_memmap(memmap_path, mode="r")
+                        self.H_cache = (fingerprint, H)
+                        return H
+            if os.path.exists(fingerprint_path):
+                os.remove(fingerprint_path)
+            out = np.lib.format.open_memmap(
+                memmap_path, mode="w+", dtype=float,
+                shape=(self.num_Models, len(X)*int(np.prod(self.output_shape)))
+            )
+        H = self.predict_models(X, n_jobs=n_jobs, out=out)
+        if memmap_path is not None and cache:
+            H.flush()
+            with open(fingerprint_path, "w") as f:
+                f.write(fingerprint)
+        if cache:
+            self.H_cache = (fingerprint, H)
+        return H
+
+    def predict(self, X, n_jobs=1):
+        """ The models with zero alpha are skipped.
         @param X: shape=(num_samples, feature_shape)
         """
         num_samples, *feature_shape = X.shape
-        predictions = self.alpha.dot(
-            np.asarray([
-                model.predict(X[:, mask]) for mask,model in zip(self.Masks,self.Models)]
-            ).reshape(self.num_Models,-1)
-        ).reshape(num_samples,*self.output_shape)
+        model_indices = np.flatnonzero(self.alpha)
+        H = self.predict_models(X, model_indices=model_indices, n_jobs=n_jobs)
+        predictions = self.alpha[model_indices].dot(H).reshape(num_samples,*self.output_shape)
         return predictions
 
 class L2Boosting(BaseBoosting):
@@ -51,11 +133,14 @@ class L2Boosting(BaseBoosting):
     def __init__(self, Models, Masks=None):
         super().__init__(Models, Masks)
 
-    def fit(self, train_x, train_y, max_iter=10, verbose=1):
+    def fit(self, train_x, train_y, max_iter=10, n_jobs=1, memmap_path=None, cache=True, verbose=1):
         """
-        @param train_x: shape=(N,D)
-        @param train_y: shape=(N,M)
-        @param T      : (int) Iteration Counts.
+        @param train_x     : shape=(N,D)
+        @param train_y     : shape=(N,M)
+        @param max_iter    : (int) Iteration Counts.
+        @param n_jobs      : (int) The number of threads to evaluate the weak learners.
+        @param memmap_path : (str) If given, H is stored in the memory-mapped `.npy` file. (Reused if computed from the same data.)
+        @param cache       : (bool) Whether to reuse H computed by the previous `fit` on the same data.
         """
         num_samples, *feature_shape = train_x.shape
         self.input_shape  = feature_shape
@@ -63,9 +148,7 @@ class L2Boosting(BaseBoosting):
         # Weight Initialization.
         self.alpha = np.zeros_like(self.alpha) # shape=(num_Models,)
 
-        H = np.asarray(
-            [model.predict(train_x[:,mask]) for mask,model in zip(self.Masks,self.Models)], dtype=float
-        ).reshape(self.num_Models,-1) # H.shape=(num_models, N×prod(M))
+        H = self.compute_H(train_x, n_jobs=n_jobs, memmap_path=memmap_path, cache=cache) # H.shape=(num_models, N×prod(M))
         HL2norm = np.sqrt(np.sum(np.square(H), axis=1)) # HL2norm.shape=(num_models, )
 
         train_y = train_y.reshape(-1) # shape=(N×prod(M))
@@ -116,3 +199,166 @@ class LogitBoost(BaseBoosting):
     """ Boosting Algorithm for Binary Classification. """
     def __init__(self, Models, Masks=None):
         super().__init__(Models, Masks)
+
+class BaseHistGradientBoosting():
+    """ Histogram-based Gradient Boosting Decision Trees.
+    The features are binned only once into uint8, and each tree is grown leaf-wise (the leaf with the largest
+    gain is split first) with the gradient/hessian histograms. The histogram of the larger child is obtained
+    by subtracting the smaller one from the parent's histogram.
+    Ref: G. Ke, et al. LightGBM: A Highly Efficient Gradient Boosting Decision Tree. (NIPS 2017)
+    ~~~
+    @params learning_rate     : (float) Shrinkage of the leaf values.
+    @params max_iter          : (int) The number of trees.
+    @params max_leaf_nodes    : (int) The maximum number of leaves of each tree.
+    @params max_depth         : (int) The maximum depth of each tree. (None means no limit.)
+    @params min_samples_leaf  : (int) The minimum number of samples in each leaf.
+    @params l2_regularization : (float) λ of the leaf value -G/(H+λ)
+    @params max_bins          : (int) The maximum number of bins. (<=256)
+    @params n_jobs            : (int) The number of OpenMP threads to build the histograms.
+    """
+    def __init__(self, learning_rate=0.1, max_iter=100, max_leaf_nodes=31, max_depth=None,
+                 min_samples_leaf=20, l2_regularization=0., max_bins=255, n_jobs=1):
+        self.learning_rate = learning_rate
+        self.max_iter = max_iter
+        self.max_leaf_nodes = max_leaf_nodes
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.l2_regularization = l2_regularization
+        self.max_bins = max_bins
+        self.n_jobs = n_jobs
+        self.baseline = None
+        self.trees = []
+
+    def baseline_prediction(self, y):
+        raise NotImplementedError()
+
+    def gradients_hessians(self, y, raw_predictions):
+        raise NotImplementedError()
+
+    def loss(self, y, raw_predictions):
+        raise NotImplementedError()
+
+    def fit_raw(self, x_train, y, verbose=1):
+        """
+        @param x_train : shape=(N,D)
+        @param y       : shape=(N,) (Encoded) target values.
+        """
+        x_train = np.asarray(x_train, dtype=float)
+        y = np.asarray(y, dtype=float)
+        x_binned, self.bin_edges = bin_features(x_train, max_bins=self.max_bins)
+        X_binned_T = np.ascontiguousarray(x_binned.T)
+        n_bins_per_feature = np.asarray([len(edges)+1 for edges in self.bin_edges], dtype=np.intp)
+        self.n_jobs_ = handleNJobs(self.n_jobs)
+
+        self.baseline = self.baseline_prediction(y)
+        raw_predictions = np.full(shape=len(y), fill_value=self.baseline, dtype=float)
+        self.trees = []
+        monitor = ProgressMonitor(max_iter=self.max_iter, verbose=verbose)
+        for it in range(self.max_iter):
+            gradients, hessians = self.gradients_hessians(y, raw_predictions)
+            tree = self.grow_tree(X_binned_T, n_bins_per_feature, gradients, hessians, raw_predictions)
+            self.trees.append(tree)
+            monitor.report(it, loss=self.loss(y, raw_predictions), leaves=int(np.sum(tree.left<0)))
+        return self
+
+    def _find_split(self, hist, n_bins_per_feature):
+        gains, bins = c_boosting.find_best_splits(
+            hist, n_bins_per_feature, l2_regularization=self.l2_regularization,
+            min_samples_leaf=self.min_samples_leaf, n_jobs=self.n_jobs_,
+        )
+        f = np.argmax(gains)
+        return gains[f], f, bins[f]
+
+    def grow_tree(self, X_binned_T, n_bins_per_feature, gradients, hessians, raw_predictions):
+        """ Grow a tree leaf-wise, and add its leaf values to `raw_predictions` (inplace).
+        @return tree : (CompactTree) value[i,0] is the leaf value of the ith node.
+        """
+        n_bins = int(np.max(n_bins_per_feature))
+        feature, threshold, left, right, value = [], [], [], [], []
+        def add_node(indices, hist, depth):
+            node_id = len(feature)
+            G = np.sum(gradients[indices]); H = np.sum(hessians[indices])
+            feature.append(-1); threshold.append(np.nan); left.append(-1); right.append(-1)
+            value.append([-self.learning_rate*G/(H+self.l2_regularization)])
+            splittable = len(indices) >= 2*self.min_samples_leaf and (self.max_depth is None or depth < self.max_depth)
+            if splittable:
+                gain, f, b = self._find_split(hist, n_bins_per_feature)
+                if gain > 0:
+                    heapq.heappush(heap, (-gain, node_id, f, b))
+            nodes[node_id] = (indices, hist, depth)
+            return node_id
+
+        heap = []; nodes = {}
+        indices = np.arange(X_binned_T.shape[1])
+        add_node(indices, c_boosting.build_histogram(X_binned_T, gradients, hessians, indices, n_bins, n_jobs=self.n_jobs_), depth=0)
+        n_leaves = 1
+        while len(heap)>0 and n_leaves < self.max_leaf_nodes:
+            _, node_id, f, b = heapq.heappop(heap)
+            indices, hist, depth = nodes.pop(node_id)
+            go_left = X_binned_T[f, indices] <= b
+            indices_l, indices_r = indices[go_left], indices[~go_left]
+            # Histogram subtraction: Build only the smaller child's histogram.
+            small, large = (indices_l, indices_r) if len(indices_l) <= len(indices_r) else (indices_r, indices_l)
+            hist_small = c_boosting.build_histogram(X_binned_T, gradients, hessians, small, n_bins, n_jobs=self.n_jobs_)
+            hist_large = hist - hist_small
+            hist_l, hist_r = (hist_small, hist_large) if small is indices_l else (hist_large, hist_small)
+            feature[node_id] = f
+            threshold[node_id] = self.bin_edges[f][b]
+            left[node_id]  = add_node(indices_l, hist_l, depth+1)
+            right[node_id] = add_node(indices_r, hist_r, depth+1)
+            n_leaves += 1
+
+        value = np.asarray(value)
+        for node_id, (indices, _, _) in nodes.items():
+            raw_predictions[indices] += value[node_id, 0]
+        return CompactTree(feature, threshold, left, right, value)
+
+    def raw_predict(self, X):
+        X = np.asarray(X, dtype=float)
+        raw_predictions = np.full(shape=len(X), fill_value=self.baseline, dtype=float)
+        for tree in self.trees:
+            raw_predictions += tree.value[tree.apply(X), 0]
+        return raw_predictions
+
+class HistGradientBoostingRegressor(BaseHistGradientBoosting):
+    """ Histogram-based Gradient Boosting for Regression. (Squared error) """
+    def baseline_prediction(self, y):
+        return np.mean(y)
+
+    def gradients_hessians(self, y, raw_predictions):
+        return raw_predictions - y, np.ones_like(y)
+
+    def loss(self, y, raw_predictions):
+        return np.mean(np.square(y - raw_predictions))
+
+    def fit(self, x_train, y_train, verbose=1):
+        return self.fit_raw(x_train, np.ravel(y_train), verbose=verbose)
+
+    def predict(self, X):
+        return self.raw_predict(X)
+
+class HistGradientBoostingClassifier(BaseHistGradientBoosting):
+    """ Histogram-based Gradient Boosting for Binary Classification. (Logistic loss) """
+    def baseline_prediction(self, y):
+        p = np.clip(np.mean(y), 1e-15, 1-1e-15)
+        return np.log(p/(1-p))
+
+    def gradients_hessians(self, y, raw_predictions):
+        p = 1/(1+np.exp(-raw_predictions))
+        return p - y, p*(1-p)
+
+    def loss(self, y, raw_predictions):
+        return np.mean(np.logaddexp(0, raw_predictions) - y*raw_predictions)
+
+    def fit(self, x_train, y_train, verbose=1):
+        self.classes, y_encoded = np.unique(np.ravel(y_train), return_inverse=True)
+        if len(self.classes) != 2:
+            raise ValueError(f"HistGradientBoostingClassifier only supports the binary classification, but got {len(self.classes)} classes.")
+        return self.fit_raw(x_train, y_encoded, verbose=verbose)
+
+    def predict_proba(self, X):
+        p = 1/(1+np.exp(-self.raw_predict(X)))
+        return np.c_[1-p, p]
+
+    def predict(self, X):
+        return self.classes[(self.raw_predict(X) > 0).astype(int)]
@@ -2,36 +2,24 @@
 
 import numpy as np
 from ..utils import flush_progress_bar
-from ..utils import paired_euclidean_distances
-from ..utils import pairwise_euclidean_distances
+from ..utils import build_neighbor_tree
+from ..utils import make_batches
+from ..clib import c_cluster
 
-# Ref: https://github.com/scikit-learn/scikit-learn/blob/95d4f0841d57e8b5f6b2a570312e9d832e69debc/sklearn/cluster/_dbscan_inner.pyx#L19
 def dbscan_inner(is_core, neighborhoods, labels, verbose=1):
-    """Algorithms for DBSCAN.
+    """Algorithms for DBSCAN. (Forwards to `c_cluster.dbscan_inner` with the neighborhoods in the CSR format.)
     @params is_core      : shape=(N,) Whether ith data is core or not.
     @params neighborhoods: shape=(N,) ith data's neighbor
     @params labels       : shape=(N,) Cluster labels for each point. Noisy samples are given the label -1.
     """
-    label = 0
-    stack = []
-    num_data = labels.shape[0]
-    for i in range(num_data):
-        flush_progress_bar(i, num_data, metrics={"num cluster": label}, verbose=verbose)
-        if labels[i] != -1 or not is_core[i]:
-            continue
-        # Depth-first search starting from i,
-        # ending at the non-core points.
-        while True:
-            if labels[i] == -1:
-                labels[i] = label
-                if is_core[i]:
-                    for j in neighborhoods[i]:
-                        if labels[j] == -1:
-                            stack.append(j)
-            if len(stack) == 0:
-                break
-            i = stack.pop(-1)
-        label+=1
+    n_neighbors = np.asarray([len(neighbors) for neighbors in neighborhoods], dtype=np.intp)
+    indptr = np.concatenate([np.zeros(1, dtype=np.intp), np.cumsum(n_neighbors)])
+    indices = np.concatenate([np.asarray(neighbors, dtype=np.intp) for neighbors in neighborhoods]) \
+              if len(neighborhoods)>0 else np.empty(0, dtype=np.intp)
+    labels_ = c_cluster.dbscan_inner(
+        np.asarray(is_core, dtype=np.uint8), indptr, indices, np.array(labels, dtype=np.intp)
+    )
+    labels[:] = labels_
     return labels
 
 # Ref: https://github.com/scikit-learn/scikit-learn/blob/95d4f0841d57e8b5f6b2a570312e9d832e69debc/sklearn/cluster/_dbscan.py#L148
@@ -40,23 +28,31 @@ class DBSCAN():
     DBSCAN: Density-Based Spatial Clustering of Applications with Noise.
     Finds core samples of high density and expands clusters from them.
     Good for data which contains clusters of similar density.
+    ~~~
+    @params algorithm : (str) Spatial index to find neighbors. 'kd_tree' or 'ball_tree'
+    @params leaf_size : (int) Leaf size of the spatial index.
+    @params n_jobs    : (int) The number of threads for the neighbor search.
+    @params batch_size: (int) The number of samples whose neighbors are searched at once.
     """
-    def __init__(self, eps=0.5, min_samples=5, metric='euclidean'):
+    def __init__(self, eps=0.5, min_samples=5, metric='euclidean', algorithm='kd_tree', leaf_size=30, n_jobs=1, batch_size=100000):
         self.eps = eps
         self.min_samples = min_samples
         self.metric = metric
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
 
     def fit(self, X, verbose=1):
         if not self.eps > 0.0: raise ValueError("`eps` must be positive.")
         # Initially, all samples are noise.
-        labels = np.full(X.shape[0], -1, dtype=np.int)
-        # Distance Matrix of All-to-All.
-        distances = pairwise_euclidean_distances(X, squared=False)
-        neighborhoods = np.asarray([np.where(neighbors)[0] for neighbors in distances<=self.eps])
-        n_neighbors = np.asarray([len(neighbors) for neighbors in neighborhoods], dtype=np.int)
+        n_samples = X.shape[0]
+        labels = np.full(n_samples, -1, dtype=np.intp)
+        indptr, indices = self.neighborhoods(X, verbose=verbose)
+        n_neighbors = np.diff(indptr)
         # A list of all core samples found.
         core_samples = np.asarray(n_neighbors >= self.min_samples, dtype=np.uint8)
-        labels = dbscan_inner(core_samples, neighborhoods, labels, verbose=verbose)
+        labels = c_cluster.dbscan_inner(core_samples, indptr, indices, labels)
 
         self.core_sample_indices_ = np.where(core_samples)[0]
         self.labels_ = labels
@@ -68,6 +64,25 @@ class DBSCAN():
             # no core samples
             self.components_ = np.empty((0, X.shape[1]))
 
+    def neighborhoods(self, X, verbose=1):
+        """ Find the neighbors within `eps` for all samples with the spatial index.
+        Samples are queried `batch_size` at a time, and neighborhoods are stored in the CSR format.
+        @return indptr  : shape=(N+1,) ith data's neighbors are indices[indptr[i]:indptr[i+1]]
+        @return indices : shape=(n_neighbors_total,)
+        """
+        X = np.ascontiguousarray(X, dtype=float)
+        n_samples = X.shape[0]
+        tree = build_neighbor_tree(X, algorithm=self.algorithm, leaf_size=self.leaf_size)
+        batches = make_batches(n_samples, self.batch_size)
+        indptrs = [np.zeros(1, dtype=np.intp)]; indices = []
+        for it,(start,end) in enumerate(batches):
+            indptr_, indices_ = tree.query_radius(X[start:end], self.eps, n_jobs=self.n_jobs)
+            indptrs.append(indptr_[1:] + indptrs[-1][-1])
+            indices.append(indices_)
+            flush_progress_bar(it, len(batches), barname="Neighbor search", metrics={"num samples": end}, verbose=verbose)
+        if verbose>0: print()
+        return np.concatenate(indptrs), np.concatenate(indices)
+
     def fit_predict(self, X, verbose=1):
         self.fit(X, verbose=verbose)
         return self.labels_
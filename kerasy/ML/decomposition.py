@@ -6,13 +6,35 @@ from ..utils import flush_progress_bar
 from ..utils import pairwise_euclidean_distances
 from ..utils import standardize
 from ..utils import handleRandomState
+from ..utils import handleNJobs
+from ..utils import handleKeyError
+from ..utils import build_neighbor_tree
+from ..utils import nn_descent
+from ..utils import make_batches
+from ..utils import randomized_svd
+from ..utils import svd_flip
 
 from . import _kernel
 from ..clib import c_decomposition
 
 class PCA():
-    def __init__(self, n_components=None):
+    """ Principal Component Analysis
+    ~~~
+    @params n_components  : The number of components to keep.
+    @params svd_solver    : 'full' or 'randomized'
+                            - 'full'       : Eigen decomposition of the D×D covariance matrix. O(ND^2 + D^3)
+                            - 'randomized' : Randomized SVD of the centered data (Halko et al.) O(ND*n_components)
+    @params n_oversamples : Additional random vectors for the 'randomized' solver.
+    @params n_iter        : The number of power iterations for the 'randomized' solver.
+    @params random_state  : Random state for the 'randomized' solver.
+    """
+    def __init__(self, n_components=None, svd_solver="full", n_oversamples=10, n_iter="auto", random_state=None):
+        handleKeyError(["full", "randomized"], svd_solver=svd_solver)
         self.n_components = n_components
+        self.svd_solver = svd_solver
+        self.n_oversamples = n_oversamples
+        self.n_iter = n_iter
+        self.random_state = random_state
         self.components_ = None
         self.mean = None
         self.S = None
@@ -23,15 +45,25 @@ class PCA():
         N,D = X.shape
         X_mean = np.mean(X, axis=0).reshape(1,D) # X_ave.shape=(D,)
         X_centralized = X-X_mean      # X_centralized.shape=(N,D)
-        S = np.cov(X_centralized.T)   # S[i][j] = np.mean(X_centralized[:,i]*X_centralized[:,j])
-        eigenvals, eigenvecs = np.linalg.eig(S)
-        # NOTE: v[:,i] is the eigenvector corresponding to the eigenvalue w[i].
-
-        total_var = eigenvals.sum()
+        if self.svd_solver == "full":
+            S = np.cov(X_centralized.T)   # S[i][j] = np.mean(X_centralized[:,i]*X_centralized[:,j])
+            # The covariance matrix is symmetric, so the eigenvalues are real. (in ascending order.)
+            eigenvals, eigenvecs = np.linalg.eigh(S)
+            # NOTE: v[:,i] is the eigenvector corresponding to the eigenvalue w[i].
+            eigenvals, eigenvecs = eigenvals[::-1], eigenvecs[:,::-1]
+            total_var = eigenvals.sum()
+            components = eigenvecs[:,:self.n_components].T
+        else:
+            _, singular_values, components = randomized_svd(
+                X_centralized, n_components=self.n_components, n_oversamples=self.n_oversamples,
+                n_iter=self.n_iter, random_state=self.random_state
+            )
+            eigenvals = singular_values**2 / (N-1)
+            total_var = np.sum(np.var(X_centralized, axis=0, ddof=1))
         explained_variance_ratio_ = eigenvals / total_var
 
         # Memorization.
-        self.components_ = eigenvecs[:,:self.n_components].T # shape=(n_components,D)
+        self.components_ = components # shape=(n_components,D)
         self.explained_variance_ = eigenvals[:self.n_components]
         self.explained_variance_ratio_ = explained_variance_ratio_[:self.n_components]
         self.mean = X_mean
@@ -41,6 +73,76 @@ class PCA():
         X_transformed = np.dot(X_centralized, self.components_.T) # (N,D)@(M,D).T = (N,M)
         return X_transformed
 
+class IncrementalPCA(PCA):
+    """ Incremental Principal Component Analysis
+    The components are updated by the SVD of the small (n_components+batch_size+1)×D matrix
+    for each mini-batch, so the memory usage does not depend on the number of samples.
+    Ref: D. Ross, J. Lim, R. Lin, M. Yang. Incremental Learning for Robust Visual Tracking. (2008)
+    ~~~
+    @params n_components : The number of components to keep.
+    @params batch_size   : The number of samples to use for each batch in `fit`. (Defaults to 5*n_features)
+    """
+    def __init__(self, n_components=None, batch_size=None):
+        super().__init__(n_components=n_components)
+        self.batch_size = batch_size
+        self.n_samples_seen_ = 0
+
+    def fit(self, X):
+        """ Fit the model with the mini-batches of X. (X can be `np.memmap`) """
+        n_samples, n_features = X.shape
+        batch_size = self.batch_size or 5*n_features
+        self.n_samples_seen_ = 0
+        batches = make_batches(n_samples, batch_size)
+        # Fold a short trailing batch into the previous one. (Each batch needs >= n_components samples.)
+        n_components = self.n_components or min(batch_size, n_features)
+        if len(batches)>1 and batches[-1][1]-batches[-1][0] < n_components:
+            (start, _), (_, end) = batches[-2:]
+            batches = batches[:-2] + [(start, end)]
+        for start, end in batches:
+            self.partial_fit(X[start:end])
+        return self
+
+    def partial_fit(self, X):
+        """ Incrementally update the mean, variance and components with a mini-batch X.
+        @params X : shape=(batch_size, n_features) (batch_size >= n_components)
+        """
+        X = np.asarray(X, dtype=float)
+        n_batch, n_features = X.shape
+        if self.n_samples_seen_ == 0:
+            if self.n_components is None:
+                self.n_components = min(n_batch, n_features)
+            self.mean = np.zeros(shape=(1,n_features))
+            self.var_ = np.zeros(shape=(1,n_features))
+        if n_batch < self.n_components:
+            raise ValueError(f"The number of samples in the batch ({n_batch}) must be >= n_components ({self.n_components}).")
+
+        # Update the mean and variance. (Chan et al.)
+        n_seen = self.n_samples_seen_
+        n_total = n_seen + n_batch
+        batch_mean = np.mean(X, axis=0, keepdims=True)
+        batch_var  = np.var(X, axis=0, keepdims=True)
+        total_mean = (n_seen*self.mean + n_batch*batch_mean) / n_total
+        total_var  = (n_seen*self.var_ + n_batch*batch_var + n_seen*n_batch/n_total*np.square(self.mean-batch_mean)) / n_total
+
+        X_centralized = X - batch_mean
+        if n_seen > 0:
+            # Stack the previous components (scaled by the singular values) and the mean correction.
+            mean_correction = np.sqrt(n_seen*n_batch/n_total) * (self.mean-batch_mean)
+            X_centralized = np.vstack((self.singular_values_[:,None]*self.components_, X_centralized, mean_correction))
+        U, singular_values, components = sp.linalg.svd(X_centralized, full_matrices=False)
+        svd_flip(U, components)
+
+        # Memorization.
+        explained_variance = singular_values**2 / (n_total-1)
+        self.components_ = components[:self.n_components]
+        self.singular_values_ = singular_values[:self.n_components]
+        self.explained_variance_ = explained_variance[:self.n_components]
+        self.explained_variance_ratio_ = singular_values[:self.n_components]**2 / np.sum(total_var*n_total)
+        self.mean = total_mean
+        self.var_ = total_var
+        self.n_samples_seen_ = n_total
+        return self
+
 class LDA():
     """ Linear Discriminant Analysis """
     def __init__(self):
@@ -74,9 +176,22 @@ class LDA():
         return x_transformed
 
 class KernelPCA():
-    def __init__(self, n_components=None, kernel="gaussian", **kernelargs):
+    """ Kernel Principal Component Analysis
+    ~~~
+    @params n_components      : The number of components to keep.
+    @params kernel            : The kernel function.
+    @params approximation     : None, 'nystroem' or 'fourier'. If not None, PCA is performed in the
+                                `approx_components` dimensional feature space φ(x), where k(x,x') ≈ φ(x)^Tφ(x').
+                                (O(N·m) memory instead of O(N^2))
+    @params approx_components : The dimension of the feature space. (m)
+    @params random_state      : Random state for the approximation.
+    """
+    def __init__(self, n_components=None, kernel="gaussian", approximation=None, approx_components=100, random_state=None, **kernelargs):
         self.kernel = _kernel.get(kernel, **kernelargs)
         self.n_components = n_components
+        self.approximation = approximation
+        self.approx_components = approx_components
+        self.random_state = random_state
 
     def fit_transform(self, X):
         """
@@ -85,7 +200,9 @@ class KernelPCA():
         if self.n_components is None:
             self.n_components = min(X.shape)
         N, M = X.shape
-        K = np.array([[self.kernel(xi, xj) for xj in X] for xi in X])
+        if self.approximation is not None:
+            return self._fit_transform_approximation(X)
+        K = self.kernel.gram(X)
         I = 1/N * np.ones(shape=(N,N))
         K_tilde = K - I.dot(K) - K.dot(I) + np.dot(I,np.dot(K,I)) # shape=(N,N)
         eigenvals, eigenvecs = np.linalg.eig(K_tilde) # K@a_i = lambda_i*N*a_i
@@ -101,8 +218,41 @@ class KernelPCA():
         X_transformed = np.dot(K_tilde, self.components_.T) # (N,N)@(N,n_components) = (N,n_components)
         return X_transformed
 
+    def _fit_transform_approximation(self, X):
+        """ K_tilde ≈ Φc@Φc^T, so the eigenvectors of K_tilde are a_i = Φc@v_i/sqrt(λ_i)
+        where v_i is the eigenvector of the m×m matrix Φc^T@Φc, and K_tilde@a_i = sqrt(λ_i)Φc@v_i
+        """
+        N, M = X.shape
+        self.feature_map = _kernel.get_approximation(
+            self.approximation, kernel=self.kernel,
+            n_components=self.approx_components, random_state=self.random_state
+        )
+        Phi = self.feature_map.fit_transform(X)
+        Phi_centralized = Phi - np.mean(Phi, axis=0, keepdims=True) # shape=(N,m)
+        eigenvals, eigenvecs = np.linalg.eigh(Phi_centralized.T.dot(Phi_centralized))
+        eigenvals, eigenvecs = np.maximum(eigenvals[::-1], 1e-12), eigenvecs[:,::-1]
+        n_components = min(self.n_components, eigenvals.shape[0])
+        projected = Phi_centralized.dot(eigenvecs[:,:n_components]) # shape=(N,n_components)
+
+        # Memorization.
+        self.components_ = (projected / np.sqrt(eigenvals[:n_components])).T # shape=(n_components,N)
+        self.explained_variance_ = eigenvals[:n_components]
+        self.explained_variance_ratio_ = eigenvals[:n_components] / eigenvals.sum()
+        self.N,self.M = N,M
+        self.X = X
+        X_transformed = projected * np.sqrt(eigenvals[:n_components])
+        return X_transformed
+
 class tSNE():
     """Stochastic Neighbor Embedding.
+    ~~~
+    @params method : 'exact' or 'barnes_hut'.
+        - 'exact'      : Dense P (calibrated on all pairwise distances) and Q. O(N^2) time and memory per epoch.
+        - 'barnes_hut' : Sparse P over the 3*perplexity nearest neighbors, and the repulsive
+                         forces are approximated by a quadtree/octree. O(N log N) per epoch,
+                         but n_components must be less than or equal to 3.
+    @params angle     : Trade-off between speed and accuracy for Barnes-Hut t-SNE. (0 means exact.)
+    @params leaf_size : Leaf size of the spatial index for the nearest neighbor search.
     """
 
     def __init__(self,
@@ -112,7 +262,12 @@ class tSNE():
                  min_gain = 0.1,
                  tol = 1e-5,
                  prec_max_iter = 50,
-                 random_state = None):
+                 random_state = None,
+                 n_jobs = 1,
+                 method = "exact",
+                 angle = 0.5,
+                 leaf_size = 30):
+        handleKeyError(["exact", "barnes_hut"], method=method)
         self.initial_momentum = initial_momentum
         self.final_momoentum = final_momoentum
         self.eta = eta
@@ -120,67 +275,90 @@ class tSNE():
         self.tol = tol
         self.prec_max_iter = prec_max_iter
         self.random_state = random_state
-
-    @staticmethod
-    def dist2shannon(Di, beta):
-        """Compute Pi and the Shannon Entropy of Pi from Dij.
-        ~~~~~~~~~~~Arguments
-        @param Di      : shape=(n_samples-1,). Dij means the distances between Xi and Xj. (j≠i)
-        @param beta    : 1/2 * precision = 1/(2*sigma^2).
-        @return Pi     : Pi[j] means that the Conditional Propbability of Xj given Xi.
-        @return logPerp: The log scaled perplexity under a given beta.
-        --------------------
-        Perp(Pi)       = 2^H(Pi)
-        H(Pi)          = Shannon Entropy of Pi = -Σj pj|i log_2(pj|i)
-        log(Perp(Pi))  = H(Pi) * log2
-                       = -Σj pj|i log_e(pj|i)
+        self.n_jobs = n_jobs
+        self.method = method
+        self.angle = angle
+        self.leaf_size = leaf_size
+
+    def _binary_search_perplexity(self, D, perplexity):
+        """ Adjust precisions by binary search for all data at once.
+        @params D    : Squared distances to the candidates. shape=(n_samples, n_candidates)
+        @return P    : P[i,k] means that p_{k-th candidate|i}. shape=(n_samples, n_candidates)
         """
-        propto_pji = np.exp(-Di*beta)
-        Pi = propto_pji/np.sum(propto_pji) # Pi[j] = p_j|i
-        logPerp = np.sum(-Pi*np.log(Pi))
-        # propto_pji = np.exp(-Di*beta)
-        # pji_norm = np.sum(propto_pji)
-        # logPerp = np.log(pji_norm) + beta*np.sum(Di*propto_pji)/pji_norm
-        # Pi = propto_pji / pji_norm
-        return Pi, logPerp
+        print(f"Each conditional Gaussian has the same perplexity: {perplexity}")
+        P, beta = c_decomposition.binary_search_perplexity(
+            np.ascontiguousarray(D, dtype=np.float64), perplexity=perplexity,
+            tol=self.tol, max_iter=self.prec_max_iter, n_jobs=handleNJobs(self.n_jobs)
+        )
+        print(f"Mean value of sigma: {np.mean(np.sqrt(1/2*beta)):.3f}")
+        return P
 
     def adjustPrecisions(self, X, perplexity):
         """Performs a binary search to get precisions (beta) so that each
         conditional Gaussian has the same perplexity.
+        All pairwise distances are taken into account. (O(N^2) time and memory)
+        @return P : Pij means that pj|i. shape=(n_samples, n_samples)
         """
-        print(f"Each conditional Gaussian has the same perplexity: {perplexity}")
         n_samples, _ = X.shape
-        D = pairwise_euclidean_distances(X, squared=True)
-        # Initialization.
-        P = np.zeros((n_samples, n_samples)) # Pij means that pj|i
-        beta = np.ones(shape=(n_samples))    # Precisions
-        goallogPrep = np.log(perplexity)     # Log scaled perplexity (AIM)
-
-        for i in range(n_samples):
-            """ Adjust precision by binary search for each data. """
-            betamin, betamax = (-np.inf, np.inf)
-            Di = D[i, np.concatenate((np.r_[0:i], np.r_[i+1:n_samples]))] # Remove D[i,i] from D[i]
-            Pi, logPerp = self.dist2shannon(Di, beta[i])
-            Prep_diff = logPerp - goallogPrep
-            it = 0
-            for it in range(self.prec_max_iter):
-                if np.abs(Prep_diff) < self.tol: break
-
-                # Binary Search
-                if Prep_diff>0:
-                    # Prep_diff>0 → current Perp > goal Prep → decrease the prep → increase the precision
-                    betamin = beta[i]
-                    beta[i] = beta[i]*2 if (betamax == np.inf) or (betamax == -np.inf) else (beta[i] + betamax) / 2.
-                else:
-                    betamax = beta[i]
-                    beta[i] = beta[i]/2 if (betamin == np.inf) or (betamin == -np.inf) else (beta[i] + betamin) / 2.
+        off_diagonal = ~np.eye(n_samples, dtype=bool)
+        D = pairwise_euclidean_distances(X, squared=True)[off_diagonal].reshape(n_samples, n_samples-1)
+        P = np.zeros((n_samples, n_samples))
+        P[off_diagonal] = self._binary_search_perplexity(D, perplexity).ravel()
+        return P
 
-                Pi, logPerp = self.dist2shannon(Di, beta[i])
-                Prep_diff = logPerp - goallogPrep
-            P[i, np.concatenate((np.r_[0:i], np.r_[i+1:n_samples]))] = Pi
-        print(f"Mean value of sigma: {np.mean(np.sqrt(1/2*beta)):.3f}")
+    def adjustPrecisionsNN(self, X, perplexity):
+        """Sparse version of `adjustPrecisions`.
+        Only the `3*perplexity` nearest neighbors (found by the spatial index)
+        are taken into account, because the others have negligible probabilities.
+        @return Pnn       : Pnn[i,k] means that p_{neighbors[i,k]|i}. shape=(n_samples, n_neighbors)
+        @return neighbors : shape=(n_samples, n_neighbors)
+        """
+        n_samples, _ = X.shape
+        n_neighbors = min(n_samples-1, int(3.*perplexity+1))
+        tree = build_neighbor_tree(X, leaf_size=self.leaf_size)
+        # The first neighbor is the data itself.
+        distances, neighbors = tree.query(X, k=n_neighbors+1, n_jobs=self.n_jobs)
+        D = np.square(distances[:, 1:])
+        neighbors = neighbors[:, 1:]
+        Pnn = self._binary_search_perplexity(D, perplexity)
+        return Pnn, neighbors
+
+    def _joint_probabilities(self, X, perplexity):
+        """ Symmetrized joint probabilities pij = (pj|i + pi|j) / 2N """
+        n_samples, _ = X.shape
+        if self.method == "exact":
+            P = self.adjustPrecisions(X, perplexity)
+            P = P + P.T
+            P = P / np.sum(P)
+            P = np.maximum(P, 1e-12)
+        else:
+            Pnn, neighbors = self.adjustPrecisionsNN(X, perplexity)
+            P = sp.sparse.csr_matrix((Pnn.ravel(), neighbors.ravel(), np.arange(0, Pnn.size+1, Pnn.shape[1])), shape=(n_samples, n_samples))
+            P = P + P.T
+            P = P / P.sum()
+            P.sort_indices()
         return P
 
+    def _gradient(self, P, Y):
+        """ Compute the gradient and KL(P||Q)
+        dC/dyi = 4 Σj (pij - qij)(yi - yj)(1 + ||yi-yj||^2)^(-1)    (5)
+        (The constant 4 is absorbed into the learning rate `eta`.)
+        """
+        if self.method == "barnes_hut":
+            # P = (data, indices, indptr) of the CSR matrix.
+            return c_decomposition.bh_tsne_gradient(Y, *P, theta=self.angle, n_jobs=handleNJobs(self.n_jobs))
+        n_samples = Y.shape[0]
+        # equation (4)
+        propto_qij = 1. / (1. + pairwise_euclidean_distances(Y, squared=True))
+        propto_qij[range(n_samples), range(n_samples)] = 0.
+        Q = propto_qij / np.sum(propto_qij)
+        Q = np.maximum(Q, 1e-12)
+        # Σj Wij (yi - yj) = (Σj Wij) yi - (W@Y)i
+        W = (P - Q) * propto_qij
+        dY = np.sum(W, axis=1, keepdims=True) * Y - W.dot(Y)
+        KL = np.sum(P * np.log(P / Q))
+        return dY, KL
+
     def fit_transform(self, X, n_components=2, initial_dims=50, perplexity=30.0, epochs=1000, verbose=1):
         # If the number of initial features are too large, using PCA to reduce the dimentions.
         n_samples, n_ori_features = X.shape
@@ -198,30 +376,18 @@ class tSNE():
         gains = np.ones(shape=Y.shape)
 
         # Compute the p-value.
-        P = self.adjustPrecisions(X, perplexity)
-        P = P + P.T
-        P = P / np.sum(P)
-        P = P * 4.
-        P = np.maximum(P, 1e-12)
+        P = self._joint_probabilities(X, perplexity)
+        if self.method == "barnes_hut":
+            # Cast the indices of the CSR matrix only once.
+            P = (P.data*4., P.indices.astype(np.intp), P.indptr.astype(np.intp))
+            P_values = P[0]
+        else:
+            P = P * 4.
+            P_values = P
 
         max_digit = len(str(epochs))
         for epoch in range(epochs):
-            # equation (4)
-            propto_qij = 1. / (1. + pairwise_euclidean_distances(Y, squared=True))
-            propto_qij[range(n_samples), range(n_samples)] = 0.
-            Q = propto_qij / np.sum(propto_qij)
-            Q = np.maximum(Q, 1e-12)
-
-            # Compute the gradient
-            PQ = P - Q
-            for i in range(n_samples):
-                """
-                dC/dyi = 4 Σj (pij - qij)(yi - yj)(1 + ||yi-yj||^2)^(-1)    (5)
-                PQ[i].shape            = (n_samples, )
-                (Y[i,:] - Y).shape     = (n_samples, n_components)
-                propto_qij[i,: ].shape = (n_samples, )
-                """
-                dY[i, :] = np.dot(PQ[i,:]*propto_qij[i,:], Y[i,]-Y)
+            dY, KL = self._gradient(P, Y)
 
             # Perform the update
             momentum = self.initial_momentum if epoch < 20 else self.final_momoentum
@@ -231,12 +397,10 @@ class tSNE():
             iY = momentum * iY - self.eta * (gains * dY)
             Y += iY
             Y  = Y - np.tile(np.mean(Y, axis=0), (n_samples, 1))
-            # Compute current value of cost function
-            KL = np.sum(P * np.log(P / Q))
             flush_progress_bar(epoch, epochs, metrics={"KL(P||Q)": KL}, verbose=verbose)
             # Stop lying about P-values
             if epoch == 100:
-                P = P / 4.
+                P_values /= 4. # Inplace, so that P is also updated.
         return Y
 
 
@@ -256,8 +420,18 @@ class UMAP():
                           closer together, while larger values will result on a
                           more even dispersal of points.
     @params spread      : The effective scale of embedded points.
+    @params algorithm   : How to find the nearest neighbors. 'auto', 'kd_tree', 'ball_tree' or 'nn_descent'
+                          - 'kd_tree', 'ball_tree' : Exact search with the spatial index.
+                          - 'nn_descent'           : Approximate search. (random projection forest + NN-descent)
+                          - 'auto'                 : 'nn_descent' if n_samples > `approx_threshold` else 'kd_tree'
+    @params leaf_size   : Leaf size of the spatial index.
+    @params approx_threshold : The number of samples above which 'auto' uses the approximate search.
+    @params nn_descent_kwds  : The parameters of `nn_descent` (n_trees, n_iters, max_candidates, delta),
+                               which control the trade-off between the recall and speed.
+    @params n_jobs      : The number of threads for the nearest neighbor search and the layout optimization.
     """
-    def __init__(self, metric="euclidean", metric_kwds=None, min_dist=0.1, spread=1.0, a=None, b=None, random_state=None, sigma_iter=40, sigma_init=1.0, sigma_tol=1e-5, sigma_lower=0, sigma_upper=np.inf):
+    def __init__(self, metric="euclidean", metric_kwds=None, min_dist=0.1, spread=1.0, a=None, b=None, random_state=None, sigma_iter=40, sigma_init=1.0, sigma_tol=1e-5, sigma_lower=0, sigma_upper=np.inf,
+                 algorithm="auto", leaf_size=30, approx_threshold=4096, nn_descent_kwds=None, n_jobs=1):
         self.metric=metric
         self.metric_kwds=metric_kwds
         self.min_dist=min_dist
@@ -271,6 +445,12 @@ class UMAP():
         self.b=b
         self.random_state=random_state
         self.rnd = handleRandomState(random_state)
+        handleKeyError(["auto", "kd_tree", "ball_tree", "nn_descent"], algorithm=algorithm)
+        self.algorithm=algorithm
+        self.leaf_size=leaf_size
+        self.approx_threshold=approx_threshold
+        self.nn_descent_kwds=nn_descent_kwds or {}
+        self.n_jobs=n_jobs
 
     def fit_transform(self, X, n_components=2, n_neighbors=15, init="random", epochs=200, init_lr=1.0, verbose=1):
         self.rnd = handleRandomState(self.random_state)
@@ -278,12 +458,9 @@ class UMAP():
         self.n_components=n_components
         n_samples, n_features = X.shape
 
-        x_distances = pairwise_euclidean_distances(X, squared=False)
         # n_neighbors Nearest Neighbor samples (Including myself.)
-        knn_indices = np.asarray(np.argpartition(x_distances, kth=n_neighbors, axis=1)[:,:n_neighbors], dtype=np.int32, order="c")
-        # knn_dists = np.asarray([[x_distances[i,idx] for idx in row_indices] for i,row_indices in enumerate(knn_indices)])
-        knn_dists = np.asarray(np.partition(x_distances, kth=n_neighbors, axis=1)[:,:n_neighbors], dtype=float, order="c")
-        rhos = np.asarray(np.partition(knn_dists, kth=1, axis=1)[:,1], dtype=float, order="c")
+        knn_dists, knn_indices = self._nearest_neighbors(X, n_neighbors)
+        rhos = np.asarray(knn_dists[:,1], dtype=float, order="c")
         # Binary search to adjust sigmas (normalization factor) value
         sigmas = self._find_sigmas(distances=knn_dists, rhos=rhos)
         graph = self.compute_membership_strengths(knn_indices, knn_dists, sigmas, rhos)
@@ -296,7 +473,58 @@ class UMAP():
             head_embedding=embeddings, tail_embedding=embeddings,
             head=graph.row, tail=graph.col, epochs_per_sample=epochs_per_sample,
             rng_state=rng_state, epochs=epochs, n_vertices=graph.shape[1], a=self.a, b=self.b,
-            gamma=1.0, initial_alpha=init_lr, negative_sample_rate=5.0, verbose=verbose
+            gamma=1.0, initial_alpha=init_lr, negative_sample_rate=5.0, verbose=verbose,
+            n_jobs=handleNJobs(self.n_jobs)
+        )
+        # Memorize for `transform`.
+        self._raw_data = X
+        self._search_tree = None
+        self.embedding_ = embeddings
+        self.epochs = epochs
+        return embeddings
+
+    def transform(self, X, epochs=None, init_lr=0.25, verbose=1):
+        """ Embed the new points into the fitted embedding space without refitting.
+        1. Find the `n_neighbors` nearest neighbors of X in the training data.
+        2. Initialize with the membership strengths weighted average of the neighbors' embeddings.
+        3. Optimize the new embeddings with the training embedding held fixed.
+        ~~~
+        @params X       : New data. shape=(n_new_samples, n_features)
+        @params epochs  : The number of epochs. (Defaults to 1/3 of the ones in `fit_transform`.)
+        @params init_lr : The initial learning rate.
+        @return embeddings : shape=(n_new_samples, n_components)
+        """
+        if not hasattr(self, "embedding_"):
+            raise ValueError("This UMAP instance is not fitted yet. Call `fit_transform` before using this method.")
+        if epochs is None:
+            epochs = max(1, self.epochs // 3)
+        X = np.asarray(X, dtype=float)
+        n_samples = X.shape[0]
+        n_train_samples = self.embedding_.shape[0]
+
+        if self._search_tree is None:
+            algorithm = "ball_tree" if self.algorithm == "ball_tree" else "kd_tree"
+            self._search_tree = build_neighbor_tree(self._raw_data, algorithm=algorithm, leaf_size=self.leaf_size)
+        knn_dists, knn_indices = self._search_tree.query(X, k=self.n_neighbors, n_jobs=self.n_jobs)
+        knn_dists = np.asarray(knn_dists, dtype=float, order="c")
+        # The new points are not in the training data, so the 1st neighbor determines the local connectivity.
+        rhos = np.asarray(knn_dists[:,0], dtype=float, order="c")
+        sigmas = self._find_sigmas(distances=knn_dists, rhos=rhos)
+        vals = np.exp(-np.maximum(knn_dists-rhos[:,None], 0) / np.where(sigmas>0, sigmas, np.inf)[:,None])
+        graph = sp.sparse.coo_matrix(
+            (vals.ravel(), (np.repeat(np.arange(n_samples, dtype=np.int32), self.n_neighbors), knn_indices.ravel().astype(np.int32))),
+            shape=(n_samples, n_train_samples)
+        )
+        embeddings = np.asarray(graph.tocsr().dot(self.embedding_) / vals.sum(axis=1, keepdims=True), dtype=float, order="C")
+
+        graph, epochs_per_sample = self.compress_graph_and_make_epochs_per_sample(graph, epochs)
+        rng_state = self.rnd.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
+        c_decomposition.optimize_layout(
+            head_embedding=embeddings, tail_embedding=self.embedding_,
+            head=graph.row, tail=graph.col, epochs_per_sample=epochs_per_sample,
+            rng_state=rng_state, epochs=epochs, n_vertices=n_train_samples, a=self.a, b=self.b,
+            gamma=1.0, initial_alpha=init_lr, negative_sample_rate=5.0, verbose=verbose,
+            n_jobs=handleNJobs(self.n_jobs), move_other=False
         )
         return embeddings
 
@@ -334,6 +562,26 @@ class UMAP():
         # if verbose: print()
         # return y
 
+    def _nearest_neighbors(self, X, n_neighbors):
+        """ Find the `n_neighbors` nearest neighbors (including the data itself) with the spatial index,
+        or approximately with NN-descent for the large data.
+        @return knn_dists   : shape=(n_samples, n_neighbors) sorted in ascending order.
+        @return knn_indices : shape=(n_samples, n_neighbors)
+        """
+        algorithm = self.algorithm
+        if algorithm == "auto":
+            algorithm = "nn_descent" if len(X) > self.approx_threshold else "kd_tree"
+        if algorithm == "nn_descent":
+            knn_dists, knn_indices = nn_descent(
+                X, n_neighbors=n_neighbors, random_state=self.rnd, n_jobs=self.n_jobs, **self.nn_descent_kwds
+            )
+        else:
+            tree = build_neighbor_tree(X, algorithm=algorithm, leaf_size=self.leaf_size)
+            knn_dists, knn_indices = tree.query(X, k=n_neighbors, n_jobs=self.n_jobs)
+        knn_dists = np.asarray(knn_dists, dtype=float, order="c")
+        knn_indices = np.asarray(knn_indices, dtype=np.int32, order="c")
+        return knn_dists, knn_indices
+
     def _init_embeddings(self, X, init, n_components, graph):
         """ Initialize the embeddings. """
         n_samples = graph.shape[0]
@@ -1,12 +1,21 @@
 # coding: utf-8
+import hashlib
 import numpy as np
+from collections import OrderedDict
+from scipy import linalg
+from concurrent.futures import ThreadPoolExecutor
 from . import _kernel
+from ..utils import make_batches
+from ..utils import handleNJobs
+from ..utils import handleKeyError
 from ..utils import basis_transformer
 from ..utils import flush_progress_bar
+from ..clib import c_linear
 
 class LinearRegression():
     def __init__(self, basis="none", **basisargs):
         self.basis = basis_transformer(basis, **basisargs)
+        self.reset_statistics()
 
     def basis_transform(self, X):
         X   = X.reshape(-1,1) if X.ndim==1 else X
@@ -16,14 +25,57 @@ class LinearRegression():
         X   = X.reshape(N,D)
         return X
 
+    def reset_statistics(self):
+        """ Forget the accumulated sufficient statistics. """
+        self.PhiTPhi = None # Σ_n φ(x_n)φ(x_n)^T
+        self.PhiTy = None   # Σ_n φ(x_n)y_n^T
+        self.n_samples_seen = 0
+
+    def partial_fit(self, X_chunk, y_chunk, batch_size=None):
+        """ Accumulate the sufficient statistics Φ^TΦ and Φ^Ty (in float64) from a chunk of data,
+        so that the data which does not fit in memory can be streamed. Call `solve` to get the weights.
+        @param X_chunk    : shape=(n,?)
+        @param y_chunk    : shape=(n,M)
+        @param batch_size : (int) The number of samples whose basis functions are computed at once.
+        """
+        y_chunk = np.asarray(y_chunk, dtype=np.float64)
+        num_samples = len(X_chunk)
+        if self.n_samples_seen == 0:
+            self.y_shape = y_chunk.shape[1:]
+        for start, end in make_batches(num_samples, batch_size or max(1, num_samples)):
+            Phi = self.basis_transform(X_chunk[start:end]).astype(np.float64)
+            PhiTPhi = Phi.T.dot(Phi)
+            PhiTy = Phi.T.dot(y_chunk[start:end].reshape(end-start, -1))
+            if self.PhiTPhi is None:
+                self.PhiTPhi, self.PhiTy = PhiTPhi, PhiTy
+            else:
+                self.PhiTPhi += PhiTPhi
+                self.PhiTy += PhiTy
+        self.n_samples_seen += num_samples
+        return self
+
+    def solve(self, lamda=0):
+        """ Solve (Φ^TΦ + lamda·I)w = Φ^Ty with the Cholesky decomposition from the accumulated statistics.
+        @param lamda : (float) L2 regularization.
+        """
+        A = self.PhiTPhi + lamda*np.identity(len(self.PhiTPhi))
+        try:
+            w = linalg.cho_solve(linalg.cho_factor(A), self.PhiTy)
+        except linalg.LinAlgError:
+            # Not positive definite. (e.g. rank deficient Φ without regularization)
+            w = np.linalg.lstsq(A, self.PhiTy, rcond=None)[0]
+        self.w = w.reshape((len(w),)+self.y_shape)
+        return self
+
     def fit(self, train_x, train_y):
         """
         @param train_x: shape=(N,?)
         @param train_y: shape=(N,M)
         @val         w: shape=()
         """
-        train_x = self.basis_transform(train_x).astype(float)
-        self.w = np.linalg.solve(train_x.T.dot(train_x), train_x.T.dot(train_y))
+        self.reset_statistics()
+        self.partial_fit(train_x, train_y)
+        return self.solve()
 
     def predict(self, X):
         """
@@ -37,47 +89,109 @@ class LinearRegressionRidge(LinearRegression):
         self.lamda = lamda
         super().__init__(basis=basis, **basisargs)
 
-    def fit(self, train_x, train_y):
+    def solve(self, lamda=None):
+        """ The regularization can be changed without reading the data again.
+        @param lamda : (float) If None, use `self.lamda`.
         """
-        @param train_x: shape=(N,?)
-        @param train_y: shape=(N,M)
-        @val         w: shape=()
-        """
-        train_x = self.basis_transform(train_x)
-        N, M = train_x.shape
-        self.w = np.linalg.solve(self.lamda*np.identity(M) + train_x.T.dot(train_x), train_x.T.dot(train_y))
+        return super().solve(lamda=self.lamda if lamda is None else lamda)
 
 class LinearRegressionLASSO(LinearRegression):
+    """ min_w 1/2||y-Φw||^2 + lamda·(l1_ratio||w||_1 + (1-l1_ratio)/2||w||^2)
+    Solved by the coordinate descent with the precomputed Φ^TΦ and the sequential strong rules,
+    which discard the coordinates which are likely to be zero before the optimization, and
+    re-add them if they violate the KKT conditions.
+    Ref: R. Tibshirani, et al. Strong rules for discarding predictors in lasso-type problems. (JRSS-B 2012)
+    """
     def __init__(self, lamda=1e-3, basis="none", **basisargs):
         self.lamda = lamda
+        self.l1_ratio = 1.0
         super().__init__(basis=basis, **basisargs)
 
-    @staticmethod
-    def prox(w,alpha,rho,lamda):
-        z0 = w + alpha/rho
-        c = lamda/rho
-        return z0-c if c<z0 else z0+c if z0<-c else 0
+    def lamda_max(self, c):
+        """ The smallest lamda such that all coefficients are 0. """
+        return np.max(np.abs(c)) / self.l1_ratio
 
-    def fit(self, train_x, train_y, rho=1e-3, tol=1e-7, max_iter=100, verbose=1):
+    def coordinate_descent(self, G, c, w, lamda, lamda_prev, tol=1e-7, max_iter=10000):
+        """ Solve for each output (column of c) with the warm start `w` (inplace), which is the solution at `lamda_prev`. """
+        l1_reg = lamda*self.l1_ratio
+        l2_reg = lamda*(1-self.l1_ratio)
+        for k in range(c.shape[1]):
+            w_k = np.ascontiguousarray(w[:,k]); c_k = np.ascontiguousarray(c[:,k])
+            Gw = G.dot(w_k)
+            # Sequential strong rule.
+            strong = (np.abs(c_k-Gw) >= self.l1_ratio*(2*lamda-lamda_prev)) | (w_k != 0)
+            while True:
+                c_linear.enet_coordinate_descent_gram(
+                    w_k, G, c_k, Gw, np.flatnonzero(strong).astype(np.intp),
+                    l1_reg=l1_reg, l2_reg=l2_reg, max_iter=max_iter, tol=tol,
+                )
+                # KKT conditions of the discarded coordinates: |c_j - (Gw)_j| <= l1_reg
+                violation = ~strong & (np.abs(c_k-Gw) > l1_reg)
+                if not np.any(violation): break
+                strong |= violation
+            w[:,k] = w_k
+        return w
+
+    def solve(self, lamda=None, tol=1e-7, max_iter=10000):
+        """ Solve from the accumulated statistics. (See `partial_fit`)
+        @param lamda   : (float) If None, use `self.lamda`.
+        @param tol     : (float) Stop when the maximal coordinate update is less than tol.
+        @param max_iter: (int) The maximum number of sweeps.
         """
-        @param train_x: shape=(N,?)
-        @param train_y: shape=(N,M)
-        @val         w: shape=()
+        lamda = self.lamda if lamda is None else lamda
+        G = np.ascontiguousarray(self.PhiTPhi); c = self.PhiTy
+        w = np.zeros_like(c)
+        self.coordinate_descent(G, c, w, lamda=lamda, lamda_prev=max(self.lamda_max(c), lamda), tol=tol, max_iter=max_iter)
+        self.w = w.reshape((len(w),)+self.y_shape)
+        return self
+
+    def fit(self, train_x, train_y, tol=1e-7, max_iter=10000):
         """
-        train_x = self.basis_transform(train_x)
-        N, M = train_x.shape
-        # Initialization.
-        alpha = np.ones(shape=(M))
-        z = np.ones(shape=(M))
-        for it in range(max_iter):
-            w = np.linalg.solve(train_x.T.dot(train_x)+rho*np.identity(M), train_x.T.dot(train_y)-alpha+rho*z)
-            z = np.asarray([self.prox(w_,alpha_,rho,self.lamda) for w_,alpha_ in zip(w,alpha)])
-            alpha += rho*(w-z)
-            diff = np.sqrt(np.sum(np.square(w-z)))
-            if diff < tol: break
-            flush_progress_bar(it, max_iter, metrics={"diff": diff}, verbose=verbose)
-        if verbose: print()
-        self.w = w
+        @param train_x : shape=(N,?)
+        @param train_y : shape=(N,M)
+        @param tol     : (float) Stop when the maximal coordinate update is less than tol.
+        @param max_iter: (int) The maximum number of sweeps.
+        @val         w : shape=(D,M)
+        """
+        self.reset_statistics()
+        self.partial_fit(train_x, train_y)
+        return self.solve(tol=tol, max_iter=max_iter)
+
+    def path(self, train_x, train_y, lamdas=None, n_lamdas=100, eps=1e-3, tol=1e-7, max_iter=10000, verbose=1):
+        """ Regularization path. Each lamda is warm-started from the solution of the previous (larger) one,
+        and Φ^TΦ is computed only once.
+        @param lamdas   : (array) If None, `n_lamdas` values from lamda_max to eps*lamda_max on the log scale.
+        @return lamdas  : Sorted in descending order. shape=(n_lamdas,)
+        @return coefs   : shape=(n_lamdas, D, M)
+        """
+        self.reset_statistics()
+        self.partial_fit(train_x, train_y)
+        G = np.ascontiguousarray(self.PhiTPhi); c = self.PhiTy
+        lamda_max = self.lamda_max(c)
+        if lamdas is None:
+            lamdas = np.logspace(np.log10(lamda_max), np.log10(lamda_max*eps), n_lamdas)
+        lamdas = np.sort(np.asarray(lamdas, dtype=float))[::-1]
+        n_lamdas = len(lamdas)
+
+        w = np.zeros_like(c)
+        coefs = np.empty(shape=(n_lamdas,)+w.shape)
+        lamda_prev = max(lamda_max, lamdas[0])
+        for i,lamda in enumerate(lamdas):
+            self.coordinate_descent(G, c, w, lamda=lamda, lamda_prev=lamda_prev, tol=tol, max_iter=max_iter)
+            coefs[i] = w
+            lamda_prev = lamda
+            flush_progress_bar(i, n_lamdas, metrics={"lamda": lamda, "nonzero": np.count_nonzero(w)}, verbose=verbose)
+        if verbose>0: print()
+        coefs = coefs.reshape((n_lamdas, len(w))+self.y_shape)
+        return lamdas, coefs
+
+class LinearRegressionElasticNet(LinearRegressionLASSO):
+    """ @params l1_ratio : (float) Mixing parameter in (0,1]. (1 means LASSO.) """
+    def __init__(self, lamda=1e-3, l1_ratio=0.5, basis="none", **basisargs):
+        if not 0 < l1_ratio <= 1:
+            raise ValueError(f"l1_ratio should be in (0,1], but got {l1_ratio}")
+        super().__init__(lamda=lamda, basis=basis, **basisargs)
+        self.l1_ratio = l1_ratio
 
 class BayesianLinearRegression(LinearRegression):
     def __init__(self, alpha=1, beta=25, basis="none", **basisargs):
@@ -92,11 +206,38 @@ class BayesianLinearRegression(LinearRegression):
         N,M = train_x.shape
         self.SN = np.linalg.inv(self.alpha*np.eye(M) + self.beta*train_x.T.dot(train_x))
         self.mN = self.beta*self.SN.dot(train_x.T.dot(train_y))
+        return self
+
+    def partial_fit(self, X_chunk, y_chunk):
+        """ Sequential Bayesian update of the posterior with an observation or a mini-batch.
+        (If not fitted, start from the prior N(0, I/alpha).) With the Woodbury identity,
+            S = I/β + ΦSNΦ^T  (n×n),  K = SNΦ^TS^{-1}
+            mN <- mN + K(y - ΦmN),    SN <- SN - KΦSN
+        which costs O(n·M^2 + n^3) instead of O(M^3). (Sherman–Morrison for a single observation.)
+        @param X_chunk : shape=(n,?)
+        @param y_chunk : shape=(n,) or (n,K)
+        """
+        Phi = self.basis_transform(np.asarray(X_chunk)).astype(float)
+        y_chunk = np.asarray(y_chunk, dtype=float)
+        n,M = Phi.shape
+        if self.SN is None:
+            self.SN = np.eye(M)/self.alpha
+            self.mN = np.zeros(shape=(M,)+y_chunk.shape[1:])
+        SNPhiT = self.SN.dot(Phi.T) # shape=(M,n)
+        residual = y_chunk - Phi.dot(self.mN)
+        if n == 1:
+            K = SNPhiT / (1/self.beta + Phi[0].dot(SNPhiT[:,0]))
+        else:
+            S = np.eye(n)/self.beta + Phi.dot(SNPhiT)
+            K = np.linalg.solve(S, SNPhiT.T).T # S is symmetric.
+        self.mN = self.mN + K.dot(residual)
+        self.SN = self.SN - K.dot(SNPhiT.T)
+        return self
 
     def predict(self, X):
         X = self.basis_transform(X)
-        mu = np.array([self.mN.T.dot(x) for x in X])
-        std = np.sqrt(np.array([1/self.beta + x.T.dot(self.SN).dot(x) for x in X]))
+        mu = X.dot(self.mN)
+        std = np.sqrt(1/self.beta + np.einsum("ij,jk,ik->i", X, self.SN, X))
         return (mu, std)
 
 class EvidenceApproxBayesianRegression(BayesianLinearRegression):
@@ -118,7 +259,7 @@ class EvidenceApproxBayesianRegression(BayesianLinearRegression):
             self.beta  = (N-self.gamma) / np.sum( (train_y-train_x_.dot(self.mN))**2 )
             if np.allclose(params, [self.alpha, self.beta]): break
             flush_progress_bar(it, max_iter, barname="Search for Hyper Parameters (alpha, beta)", verbose=verbose)
-        super().fit(train_x, train_y)
+        return super().fit(train_x, train_y)
 
     def evidence(self, train_x, train_y):
         """ loglikelihood of marginalization ln p(y|α,β) PRML(3.86) """
@@ -130,10 +271,51 @@ class EvidenceApproxBayesianRegression(BayesianLinearRegression):
         return logmarg
 
 class KernelRegression():
-    def __init__(self, lamda, kernel="gaussian", **kernelargs):
+    """ Kernel Regression
+    theta = (K^TK+λI)^{-1}K^Ty, and the predictions are k(x,X)theta.
+    ~~~
+    @params lamda             : Regularization parameter.
+    @params kernel            : The kernel function.
+    @params approximation     : None, 'nystroem' or 'fourier'. If not None, solve the problem in the
+                                `approx_components` dimensional feature space φ(x), where k(x,x') ≈ φ(x)^Tφ(x').
+                                (O(N·m) memory instead of O(N^2))
+    @params approx_components : The dimension of the feature space. (m)
+    @params random_state      : Random state for the approximation.
+    @params solver            : 'cholesky' or 'cg'. (Ignored if approximation is not None.)
+                                - cholesky : Factorize K^TK+λI. K, K^TK and the factors of the last `n_cached_factors`
+                                             λ are cached, so refitting with the same x_train and kernel and a new y
+                                             (or a recently used λ) only needs the triangular solves.
+                                - cg       : Jacobi-preconditioned conjugate gradient. K is never stored,
+                                             the products Kv are computed block by block. (O(N·block_size) memory)
+                                             Warm-started from the previous solution.
+    @params tol               : The relative tolerance of the residual of CG.
+    @params max_iter          : The maximum number of CG iterations. (Defaults to N)
+    @params block_size        : The number of rows of the kernel matrix computed at once.
+    @params n_jobs            : The number of threads to compute the blocks.
+    @params n_cached_factors  : The maximum number of the cached Cholesky factors. (Each of them is N×N.)
+    """
+    def __init__(self, lamda, kernel="gaussian", approximation=None, approx_components=100, random_state=None,
+                 solver="cholesky", tol=1e-6, max_iter=None, block_size=None, n_jobs=1, n_cached_factors=3, **kernelargs):
+        handleKeyError(["cholesky", "cg"], solver=solver)
         self.lamda = lamda
         self.kernel = _kernel.get(kernel, **kernelargs)
+        self.approximation = approximation
+        self.approx_components = approx_components
+        self.random_state = random_state
+        self.solver = solver
+        self.tol = tol
+        self.max_iter = max_iter
+        self.block_size = block_size
+        self.n_jobs = n_jobs
+        self.n_cached_factors = n_cached_factors
         self.x_train = None # shape=(N,D)
+        self.theta = None   # Dual coefficients. shape=(N,M)
+        self.n_iter = 0
+        self.clear_cache()
+
+    def clear_cache(self):
+        """ Release the cached kernel matrices and Cholesky factors. """
+        self.cache = {"fingerprint": None, "K": None, "KTK": None, "factors": OrderedDict()}
 
     def fit(self, x_train, y_train):
         """
@@ -141,14 +323,118 @@ class KernelRegression():
         @param y_train: shape=(N, M)
         """
         N = x_train.shape[0]
-        K = np.asarray([[self.kernel(x, x_prime) for x in x_train] for x_prime in x_train])
-        self.theta = np.linalg.solve(K.T.dot(K)+self.lamda*np.identity(N), K.T.dot(y_train))
+        if self.approximation is not None:
+            self.feature_map = _kernel.get_approximation(
+                self.approximation, kernel=self.kernel,
+                n_components=self.approx_components, random_state=self.random_state
+            )
+            Phi = self.feature_map.fit_transform(x_train) # shape=(N,m)
+            # K=ΦΦ^T, so theta = (K^TK+λI)^{-1}K^Ty = Φ(A^2+λI)^{-1}Φ^Ty where A=Φ^TΦ (push-through identity)
+            # and the predictions are φ(x)^TΦ^Ttheta = φ(x)^T A(A^2+λI)^{-1}Φ^Ty
+            A = Phi.T.dot(Phi)
+            m = A.shape[0]
+            self.weights = A.dot(np.linalg.solve(A.dot(A)+self.lamda*np.identity(m), Phi.T.dot(y_train)))
+            return self
+
+        y_train = np.asarray(y_train, dtype=float)
+        fingerprint = (
+            x_train.shape, hashlib.sha1(np.ascontiguousarray(x_train).view(np.uint8)).hexdigest(),
+            self.kernel.get_params(),
+        )
+        if self.cache["fingerprint"] != fingerprint:
+            self.clear_cache()
+            self.cache["fingerprint"] = fingerprint
+            self.theta = None
         self.x_train = x_train
+        if self.solver == "cholesky":
+            if self.cache["K"] is None:
+                K = self.kernel.gram(x_train, block_size=self.block_size, n_jobs=self.n_jobs)
+                self.cache["K"] = K
+                self.cache["KTK"] = K.T.dot(K)
+            factors = self.cache["factors"] # LRU cache keyed by λ.
+            if self.lamda in factors:
+                factors.move_to_end(self.lamda)
+            else:
+                factors[self.lamda] = linalg.cho_factor(self.cache["KTK"]+self.lamda*np.identity(N), lower=True)
+                while len(factors) > max(1, self.n_cached_factors):
+                    factors.popitem(last=False)
+            self.theta = linalg.cho_solve(factors[self.lamda], self.cache["K"].T.dot(y_train))
+        else:
+            self.theta, self.n_iter = self.conjugate_gradient(y_train)
+        return self
+
+    def kernel_dot(self, X, V, return_sq_norms=False):
+        """ k(X,x_train)@V computed block by block. (The whole kernel matrix is never stored.)
+        @param X               : shape=(N', D)
+        @param V               : shape=(N,) or (N, M)
+        @param return_sq_norms : Whether to return the squared norms of the rows of k(X,x_train) as well.
+        @return KV             : shape=(N',) or (N', M)
+        """
+        n_X, n_train = X.shape[0], self.x_train.shape[0]
+        block_size = self.block_size or max(1, _kernel.GRAM_BLOCK_ELEMENTS//max(1, n_train))
+        KV = np.empty(shape=(n_X,)+V.shape[1:], dtype=float)
+        sq_norms = np.empty(shape=n_X, dtype=float) if return_sq_norms else None
+        def dot_block(batch):
+            start, end = batch
+            K_block = self.kernel._gram_block(X[start:end], self.x_train)
+            KV[start:end] = K_block.dot(V)
+            if return_sq_norms:
+                sq_norms[start:end] = np.einsum("ij,ij->i", K_block, K_block)
+
+        batches = make_batches(n_X, block_size)
+        n_jobs = min(handleNJobs(self.n_jobs), len(batches))
+        if n_jobs == 1:
+            for batch in batches:
+                dot_block(batch)
+        else:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(dot_block, batches))
+        return (KV, sq_norms) if return_sq_norms else KV
+
+    def conjugate_gradient(self, y_train):
+        """ Solve (K^TK+λI)theta = K^Ty with the Jacobi-preconditioned conjugate gradient.
+        (K is symmetric, so each iteration needs two blockwise products Kv.)
+        @param y_train : shape=(N,) or (N,M) Each column is solved simultaneously.
+        @return theta  : shape=(N,) or (N,M)
+        @return n_iter : The number of iterations.
+        """
+        N = y_train.shape[0]
+        Y = y_train.reshape(N,-1)
+        matvec = lambda V: self.kernel_dot(self.x_train, self.kernel_dot(self.x_train, V)) + self.lamda*V
+        b, sq_norms = self.kernel_dot(self.x_train, Y, return_sq_norms=True)
+        precond = 1/(sq_norms+self.lamda)[:,None] # diag(K^TK+λI)^{-1}
+        b_norm = np.linalg.norm(b, axis=0)
+        b_norm[b_norm==0] = 1
+
+        if self.theta is not None and self.theta.size == Y.size:
+            theta = self.theta.reshape(N,-1).copy()
+            r = b - matvec(theta)
+        else:
+            theta = np.zeros_like(b)
+            r = b.copy()
+        z = precond*r
+        p = z.copy()
+        rz = np.sum(r*z, axis=0)
+        max_iter = self.max_iter or N
+        n_iter = 0
+        while n_iter < max_iter and np.any(np.linalg.norm(r, axis=0) > self.tol*b_norm):
+            Ap = matvec(p)
+            pAp = np.sum(p*Ap, axis=0)
+            alpha = np.divide(rz, pAp, out=np.zeros_like(rz), where=pAp>0)
+            theta += alpha*p
+            r -= alpha*Ap
+            z = precond*r
+            rz_new = np.sum(r*z, axis=0)
+            beta = np.divide(rz_new, rz, out=np.zeros_like(rz), where=rz>0)
+            p = z + beta*p
+            rz = rz_new
+            n_iter += 1
+        return theta.reshape(y_train.shape), n_iter
 
     def predict(self, X):
         """
         @param X: shape=(N', D)
         """
-        K = np.asarray([[self.kernel(x, x_prime) for x_prime in self.x_train] for x in X])
-        predictions = K.dot(self.theta) # (N',N)@(N,M) = (N',M)
-        return predictions
+        if self.approximation is not None:
+            return self.feature_map.transform(X).dot(self.weights) # (N',m)@(m,M) = (N',M)
+        return self.kernel_dot(X, self.theta) # (N',N)@(N,M) = (N',M)
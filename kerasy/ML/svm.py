@@ -1,28 +1,55 @@
 #coding: utf-8
 import numpy as np
+from itertools import repeat
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
 from . import _kernel
+from ..utils import handleNJobs
+from ..utils import make_batches
 from ..utils import flush_progress_bar
+from ..clib import c_svm
 
 class BaseSVM():
-    def __init__(self, kernel="gaussian", **kernelargs):
+    """
+    @params kernel            : The kernel function.
+    @params approximation     : None, 'nystroem' or 'fourier'. If not None, the kernel is replaced with
+                                its low-rank approximation k(x,x') ≈ φ(x)^Tφ(x') fitted on the training data.
+    @params approx_components : The dimension of the feature space φ(x).
+    @params random_state      : Random state for the approximation.
+    """
+    def __init__(self, kernel="gaussian", approximation=None, approx_components=100, random_state=None, **kernelargs):
         self.kernel = _kernel.get(kernel, **kernelargs)
-        self.isZero = None
+        self.approximation = approximation
+        self.approx_components = approx_components
+        self.random_state = random_state
+        self.C = np.inf
         self.N = None; self.M = None;
-        self.K = None # gram matrix: shape=(N,N)
         self.SVidx = None
         self.b = None # bias parameter
         # Memorize all data while training otherwise only support data.
         self.x_train = None; self.y_train = None
         self.a = None # Lagrange multiplier
 
-    def calcuBias(self):
-        return np.mean([self.y_train[n]-np.sum([self.a[m]*self.y_train[m]*self.K[n,m] for m in self.SVidx]) for n in self.SVidx])
+    @property
+    def dual_coef_(self):
+        """ a_n·t_n of the support vectors. shape=(n_SV,) """
+        return self.a[self.SVidx]*self.y_train[self.SVidx]
 
     def y(self, x):
-        return sum([self.a[i]*self.y_train[i]*self.kernel(self.x_train[i],x) for i in self.SVidx]) + self.b
+        return self.decision_function(x)[0]
 
-    def predict(self, X):
-        return np.array([1 if self.y(x)>0 else -1 for x in X]).astype(int)
+    def decision_function(self, X, batch_size=None):
+        """ y(x) = Σ_n a_n t_n k(x_n, x) + b for all samples at once.
+        @params X          : shape=(N, M)
+        @params batch_size : (int) The number of samples whose kernel block K(X, SV) is computed at once.
+        @return            : shape=(N,)
+        """
+        K = self.kernel.gram(X, self.x_train[self.SVidx], block_size=batch_size)
+        return K.dot(self.dual_coef_) + self.b
+
+    def predict(self, X, batch_size=None):
+        return np.where(self.decision_function(X, batch_size=batch_size)>0, 1, -1).astype(int)
 
     def accuracy(self, x_train, y_train):
         return np.mean(self.predict(x_train) == self.formatting_y(y_train, verbose=0))
@@ -40,27 +67,38 @@ class BaseSVM():
                 if verbose>0: print(f"Convert {t} to {valid_train[i]:>2} to suit for the SVM train data format.")
         return y_train
 
-    def fit(self, x_train, y_train, max_iter=500, zero_eps=1e-2, sparse_memorize=True, verbose=1):
-        """
-        @param x_train : (ndarray) shape=(N,M)
-        @param t_train : (ndarray) shape=(N,)
-        @param kernel  : (function) k(x,x')
-        @param max_iter: (int)
-        @param zero_eps: (float) if |x|<zero_eps, x is considered equal to 0.
+    def fit(self, x_train, y_train, max_iter=500, zero_eps=1e-3, shrinking=True, cache_size=200, sparse_memorize=True, verbose=1):
+        """ Solve the dual problem by SMO with the second order working set selection. (LIBSVM)
+        The kernel rows are computed on demand and kept in the LRU cache, so the N×N gram matrix is never materialized.
+        @param x_train    : (ndarray) shape=(N,M)
+        @param t_train    : (ndarray) shape=(N,)
+        @param max_iter   : (int) The maximum number of sweeps. (Each sweep is N pair updates.)
+        @param zero_eps   : (float) Stop when the maximal violation of the KKT conditions is less than zero_eps.
+        @param shrinking  : (bool) Whether to temporarily remove the bounded multipliers from the working set.
+        @param cache_size : (float) The size of the kernel cache [MB].
         """
-        y_train = self.formatting_y(y_train)
-        self.isZero = lambda x:abs(x)<zero_eps
+        y_train = self.formatting_y(y_train, verbose=verbose).astype(float)
+        x_train = np.asarray(x_train, dtype=float)
         self.N, self.M = x_train.shape
-        self.K = np.array([[self.kernel(x_train[i], x_train[j]) for j in range(self.N)] for i in range(self.N)])
-        self.x_train = x_train; self.y_train = y_train
-
-        # Initialization.
-        self.a = np.random.uniform(low=0, high=1, size=self.N)
-        self.SVidx = self.isSV()
-        self.b = self.calcuBias()
+        if self.approximation is not None:
+            # If already fitted, approximate the original kernel again.
+            kernel = self.kernel.kernel if isinstance(self.kernel, _kernel.KernelApproximation) else self.kernel
+            self.kernel = _kernel.get_approximation(
+                self.approximation, kernel=kernel,
+                n_components=self.approx_components, random_state=self.random_state
+            ).fit(x_train)
+            # Transform the training data only once, and solve with the explicit features φ(x).
+            get_row, K_diag = _dual_problem(np.ascontiguousarray(self.kernel.transform(x_train), dtype=float))
+        else:
+            get_row, K_diag = _dual_problem(x_train, self.kernel)
 
         # Optimization.
-        self.SMO(max_iter=max_iter, verbose=verbose)
+        a, b, n_iter = c_svm.smo(
+            get_row, y_train, K_diag,
+            C=self.C, tol=zero_eps, max_iter=max_iter*self.N,
+            shrinking=shrinking, cache_size=cache_size, verbose=verbose,
+        )
+        self.setDualSolution(x_train, y_train, a, b, n_iter)
 
         # Memorize only support vector data.
         if sparse_memorize:
@@ -68,161 +106,178 @@ class BaseSVM():
 
         return self
 
-    def SMO(self, max_iter, verbose=1):
-        N = self.N
-        idxes = np.arange(N)
-        for it in range(max_iter):
-            changed = False
-            np.random.shuffle(idxes)
-            for i in idxes:
-                # 1. Find an a_i that violates KKT condition.
-                if self.checkKKT(i): continue
-                # 2. Select an a_j that is expected to maximize the step size.
-                j = self.choose_second(i)
-                # Update a_i and a_j & memorize whether updated or not.
-                changed = self.update(i, j) or changed
-                # Update the bias parameter.
-                self.b = self.calcuBias()
-                self.SVidx = self.isSV()
-            if not changed: break
-            flush_progress_bar(it, max_iter, metrics={"Rate of Support Vector": 100*len(self.SVidx)/N}, verbose=verbose)
-        if verbose: print()
+    def setDualSolution(self, x_train, y_train, a, b, n_iter=None):
+        """ Memorize the solution of the dual problem. """
+        self.N, self.M = x_train.shape
+        self.x_train = x_train; self.y_train = y_train
+        self.a = a; self.b = b; self.n_iter_ = n_iter
+        self.SVidx = np.arange(self.N)[self.a>0]
 
     def sparseMemorize(self):
-        self.N = np.count_nonzero(self.SVidx)
+        self.N = len(self.SVidx)
         self.x_train = self.x_train[self.SVidx]
         self.y_train = self.y_train[self.SVidx]
         self.a = self.a[self.SVidx]
         self.SVidx = np.arange(self.N)
 
 class SVC(BaseSVM):
-    def __init__(self, kernel="gaussian", C=10, **kernelargs):
-        super().__init__(kernel=kernel, **kernelargs)
+    def __init__(self, kernel="gaussian", C=10, approximation=None, approx_components=100, random_state=None, **kernelargs):
+        super().__init__(kernel=kernel, approximation=approximation, approx_components=approx_components, random_state=random_state, **kernelargs)
         self.C = C
 
-    def isSV(self):
-        """whether x_train[i] is a support vector or not."""
-        return np.arange(self.N)[np.logical_not(np.logical_or(self.isZero(self.a), self.isZero(self.C-self.a)))]
-
-    def checkKKT(self, i):
-        """whether x_train[i] satisfy the KKT condition or not."""
-        Cs = self.y_train[i]*self.y(self.x_train[i]) # Complementary slackness
-        if self.isZero(self.C-self.a[i]):
-            return Cs>=1 and self.isZero(self.a[i]*(Cs-1))
-        else:
-            return Cs<=1
-
-    def choose_second(self, i):
-        yi = self.y(self.x_train[i])
-        expected_step_size_rank = [abs(self.y(self.x_train[j]) - yi) if not self.isZero(self.a[j]) else 0 for j in range(self.N)]
-        return np.argmax(expected_step_size_rank)
-
-    def update(self, i, j):
-        if i == j: return False
-        ti = self.y_train[i]; yi = self.y(self.x_train[i])
-        tj = self.y_train[j]; yj = self.y(self.x_train[j])
-        c = ti*self.a[i] + tj*self.a[j]
-        # clipping
-        if ti == tj:
-            l = max(0, c/ti-self.C); h = max(self.C, c/ti)
-        else:
-            l = max(0, c/ti); h = min(self.C, self.C+c/ti)
-
-        denominator = self.K[i,i]-2*self.K[i,j]+self.K[j,j]
-        numerator = 1-ti*tj+ti*(yj-yi)
-
-        #=== Dealing with Overflow. ===
-        if denominator==0:
-            ai_next = h if np.sign(numerator)==1 else l
-        else:
-            delta_i  = numerator/denominator
-            if np.inf==abs(delta_i):
-                ai_next = h if np.sign(delta_i)==1 else l
-            else:
-                ai_next = self.a[i] + delta_i
-                ai_next = l if ai_next<l else h if ai_next>h else ai_next
-
-        if self.isZero(ai_next - self.a[i]): return False
-
-        # Update
-        self.a[i] = ai_next
-        self.a[j] = (c-ti*self.a[i])/tj
-        return True
-
 class hardSVC(BaseSVM):
-    def __init__(self, kernel="gaussian", **kernelargs):
-        super().__init__(kernel=kernel, **kernelargs)
-
-    def isSV(self):
-        """whether x_train[i] is a support vector or not."""
-        return np.arange(self.N)[np.logical_not(self.isZero(self.a))]
-
-    def checkKKT(self, i):
-        Cs = self.y_train[i]*self.y(self.x_train[i]) # Complementary slackness
-        return self.isZero(Cs-1) and self.isZero(self.a[i]*(Cs-1))
-
-    def choose_second(self, i):
-        yi = self.y(self.x_train[i])
-        expected_step_size_rank = [abs(self.y(self.x_train[j]) - yi) if not self.isZero(self.a[j]) else 0 for j in range(self.N)]
-        return np.argmax(expected_step_size_rank)
-
-    def update(self, i, j):
-        if i == j: return False
-        ti = self.y_train[i]; yi = self.y(self.x_train[i])
-        tj = self.y_train[j]; yj = self.y(self.x_train[j])
-        c = ti*self.a[i] + tj*self.a[j]
-        # clipping
-        if ti == tj:
-            l = 0; h = c/ti
-        else:
-            l = max(0, c/ti); h = 10*c/ti
-
-        denominator = self.K[i,i]-2*self.K[i,j]+self.K[j,j]
-        numerator = 1-ti*tj+ti*(yj-yi)
-
-        #=== Dealing with Overflow. ===
-        if denominator==0:
-            ai_next = h if np.sign(numerator)==1 else l
+    def __init__(self, kernel="gaussian", approximation=None, approx_components=100, random_state=None, **kernelargs):
+        super().__init__(kernel=kernel, approximation=approximation, approx_components=approx_components, random_state=random_state, **kernelargs)
+        self.C = np.inf
+
+def _dual_problem(X, kernel=None):
+    """ The kernel row function and the diagonal of the gram matrix for `c_svm.smo`.
+    @params X      : Training data, or the explicit features φ(x) if kernel is None. shape=(N, M)
+    @params kernel : The kernel function. If None, k(x,x') = <x,x'>.
+    """
+    if kernel is None:
+        return (lambda i: X.dot(X[i])), np.einsum("ij,ij->i", X, X)
+    return (lambda i: kernel.gram(X[i], X)[0]), np.ascontiguousarray(kernel.diag(X), dtype=float)
+
+def _solve_dual_shared(shm_name, shape, kernel, y_train, C, smo_kwargs, precomputed=False):
+    """ Solve the dual problem in the worker process with the data in the shared memory.
+    @params precomputed : If True, the shared memory has the gram matrix K (shape=(N,N)) computed once for all problems.
+                          Otherwise, it has the training data (or the features), and the worker computes
+                          the kernel rows on demand with its own LRU cache.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        X = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        if precomputed:
+            # The rows are already in memory, so the cache only needs the minimum slots.
+            get_row, K_diag = (lambda i: X[i]), np.diag(X).copy()
+            smo_kwargs = dict(smo_kwargs, cache_size=0)
         else:
-            delta_i  = numerator/denominator
-            if np.inf==abs(delta_i):
-                ai_next = h if np.sign(delta_i)==1 else l
-            else:
-                ai_next = self.a[i] + delta_i
-                ai_next = l if ai_next<l else h if ai_next>h else ai_next
-
-        if self.isZero(ai_next - self.a[i]): return False
-
-        # Update
-        self.a[i] = ai_next
-        self.a[j] = (c-ti*self.a[i])/tj
-        return True
+            get_row, K_diag = _dual_problem(X, kernel)
+        a, b, n_iter = c_svm.smo(get_row, y_train, K_diag, C=C, **smo_kwargs)
+        del X, get_row
+    finally:
+        shm.close()
+    return a, b, n_iter
 
 class MultipleSVM():
-    def __init__(self, kernel="gaussian", C=10, **kernelargs):
+    """
+    @params kernel            : The kernel function.
+    @params C                 : The penalty parameter of the one-vs-rest SVCs.
+    @params approximation     : None, 'nystroem' or 'fourier'. If not None, the kernel is replaced with
+                                its low-rank approximation fitted once on the training data and shared by all SVCs.
+    @params approx_components : The dimension of the feature space φ(x).
+    @params random_state      : Random state for the approximation.
+    """
+    def __init__(self, kernel="gaussian", C=10, approximation=None, approx_components=100, random_state=None, **kernelargs):
         self.weekSVMs = []
         self.kernel = kernel
         self.C = C
+        self.approximation = approximation
+        self.approx_components = approx_components
+        self.random_state = random_state
         self.kernelargs = kernelargs
 
-    def fit(self, x_train, y_train, max_iter=500, zero_eps=1e-2, sparse_memorize=True):
+    def fit(self, x_train, y_train, max_iter=500, zero_eps=1e-3, shrinking=True, cache_size=200, sparse_memorize=True, n_jobs=1, verbose=1):
+        """ Train the one-vs-rest SVCs. The kernel rows do not depend on the labels, so they are computed only once
+        and shared by all binary problems.
+        @param x_train    : (ndarray) shape=(N,M)
+        @param t_train    : (ndarray) shape=(N,)
+        @param max_iter   : (int) The maximum number of sweeps.
+        @param zero_eps   : (float) The tolerance of the KKT conditions.
+        @param shrinking  : (bool) Whether to use the shrinking heuristics.
+        @param cache_size : (float) The size of the kernel cache [MB].
+        @param n_jobs     : (int) The number of processes to solve the binary problems.
+                            - n_jobs=1 : All problems share one LRU kernel-row cache. (If N^2 doubles fit in
+                                         `cache_size`, the gram matrix is effectively computed once.)
+                            - n_jobs>1 : If N^2 doubles fit in `cache_size`, the gram matrix is computed once directly
+                                         into the shared memory. Otherwise, only the training data (or the approximated
+                                         features) are shared, and each worker computes the rows with its own cache.
         """
-        @param x_train : (ndarray) shape=(N,M)
-        @param t_train : (ndarray) shape=(N,)
-        @param max_iter: (int)
-        @param zero_eps: (float) if |x|<zero_eps, x is considered equal to 0.
+        x_train = np.asarray(x_train, dtype=float)
+        N = x_train.shape[0]
+        classes = np.unique(y_train)
+        Y = [np.where(y_train==cls, 1., -1.) for cls in classes]
+        self.weekSVMs = [SVC(kernel=self.kernel, C=self.C, **self.kernelargs) for _ in classes]
+        n_jobs = min(handleNJobs(n_jobs), len(classes))
+
+        kernel = self.weekSVMs[0].kernel
+        if self.approximation is not None:
+            # Fit the approximation once, and solve the problems with the explicit features φ(x).
+            kernel = _kernel.get_approximation(
+                self.approximation, kernel=kernel,
+                n_components=self.approx_components, random_state=self.random_state
+            ).fit(x_train)
+            X, problem_kernel = np.ascontiguousarray(kernel.transform(x_train), dtype=float), None
+        else:
+            X, problem_kernel = x_train, kernel
+        for weekSVM in self.weekSVMs:
+            weekSVM.kernel = kernel
+
+        smo_kwargs = dict(tol=zero_eps, max_iter=max_iter*N, shrinking=shrinking, cache_size=cache_size)
+        if n_jobs == 1:
+            get_row, K_diag = _dual_problem(X, problem_kernel)
+            kernel_cache = c_svm.LRUKernelCache(get_row, N, cache_size=cache_size)
+            results = []
+            for cls,y in zip(classes, Y):
+                if verbose>0: print(f"[{cls} vs others]")
+                results.append(c_svm.smo(get_row, y, K_diag, C=self.C, verbose=verbose, kernel_cache=kernel_cache, **smo_kwargs))
+        else:
+            precomputed = 8.*N*N <= cache_size*(1<<20)
+            shape = (N,N) if precomputed else X.shape
+            shm = shared_memory.SharedMemory(create=True, size=int(8*np.prod(shape)))
+            try:
+                shared = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+                if precomputed:
+                    # Write the gram matrix block by block directly into the shared memory.
+                    for start,end in make_batches(N, max(1, _kernel.GRAM_BLOCK_ELEMENTS//N)):
+                        shared[start:end] = X[start:end].dot(X.T) if problem_kernel is None else problem_kernel.gram(X[start:end], X)
+                else:
+                    shared[:] = X
+                del shared
+                smo_kwargs["verbose"] = -1
+                with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                    results = list(executor.map(
+                        _solve_dual_shared, repeat(shm.name), repeat(shape), repeat(problem_kernel),
+                        Y, repeat(self.C), repeat(smo_kwargs), repeat(precomputed)
+                    ))
+            finally:
+                shm.close()
+                shm.unlink()
+
+        for weekSVM,y,(a,b,n_iter) in zip(self.weekSVMs, Y, results):
+            weekSVM.setDualSolution(x_train, y, a, b, n_iter)
+        self.stackModels(x_train)
+        if sparse_memorize:
+            for weekSVM in self.weekSVMs:
+                weekSVM.sparseMemorize()
+        return self
+
+    def stackModels(self, x_train):
+        """ Stack all one-vs-rest models so that they share the kernel block between X and
+        the union of their support vectors.
+          - x_SV       : shape=(n_SV, M)
+          - dual_coef_ : shape=(n_SV, n_classes) (0 for the samples which are not SVs of the model.)
+          - intercept_ : shape=(n_classes,)
         """
-        self.weekSVMs = []
-        for cls in np.unique(y_train):
-            print(f"[{cls} vs others]")
-            y_train_for_week = np.ones_like(y_train, dtype=int)
-            y_train_for_week[np.where(y_train != cls)] = -1
-            weekSVM = SVC(kernel=self.kernel, **self.kernelargs)
-            weekSVM.fit(x_train, y_train_for_week, max_iter=max_iter, zero_eps=zero_eps, sparse_memorize=sparse_memorize)
-            self.weekSVMs.append(weekSVM)
+        isSV = np.zeros(shape=len(x_train), dtype=bool)
+        for weekSVM in self.weekSVMs:
+            isSV[weekSVM.SVidx] = True
+        self.x_SV = x_train[isSV]
+        self.dual_coef_ = np.column_stack([(weekSVM.a*weekSVM.y_train)[isSV] for weekSVM in self.weekSVMs])
+        self.intercept_ = np.asarray([weekSVM.b for weekSVM in self.weekSVMs])
+
+    def decision_function(self, X, batch_size=None):
+        """
+        @params X          : shape=(N, M)
+        @params batch_size : (int) The number of samples whose kernel block K(X, SV) is computed at once.
+        @return            : shape=(N, n_classes)
+        """
+        K = self.weekSVMs[0].kernel.gram(X, self.x_SV, block_size=batch_size)
+        return K.dot(self.dual_coef_) + self.intercept_
 
-    def predict(self, X):
-        return np.asarray([np.argmax([weekSVM.y(x) for weekSVM in self.weekSVMs]) for x in X], dtype=int)
+    def predict(self, X, batch_size=None):
+        return np.argmax(self.decision_function(X, batch_size=batch_size), axis=1).astype(int)
 
     def accuracy(self, x_train, y_train):
         return np.mean(self.predict(x_train) == y_train)
@@ -242,23 +297,157 @@ class MultipleSVM():
 
 
 class RVM():
-    """Relevance Vector Machine
+    """Relevance Vector Machine (Regression)
+    y(x) = Σ_n w_n k(x, x_n) + w_0,  w_i ~ N(0, 1/alpha_i),  t ~ N(y(x), 1/beta)
+    The hyperparameters are optimized by the fast marginal likelihood maximization, which adds, deletes or
+    re-estimates one basis function per step, and updates the posterior (SN, mN) by the rank-one updates
+    instead of inverting the N×N matrix. The candidate design matrix Φ is kept, so the memory is O(N^2).
+    With M relevance vectors, each step costs O(N·M^2) to update the sparsity/quality factors of all candidates,
+    and adding a basis costs another O(N^2) for Φ^Tφ_i. (O(N^3) per iteration in the original RVM.)
+    Ref: M.E. Tipping, A.C. Faul. Fast Marginal Likelihood Maximisation for Sparse Bayesian Models. (AISTATS 2003)
+    ~~~
+    @params kernel       : The kernel function.
+    @params initial_beta : The initial noise precision. (Defaults to 10/Var[t])
+    @params update_beta  : (bool) Whether to re-estimate the noise precision.
+    @params add_bias     : (bool) Whether to add the bias basis function φ(x) = 1 as a candidate.
     """
-    def __init__(self, initial_alpha, initial_beta):
-        self.initial_alpha = initial_alpha
+    def __init__(self, kernel="gaussian", initial_beta=None, update_beta=True, add_bias=True, **kernelargs):
+        self.kernel = _kernel.get(kernel, **kernelargs)
         self.initial_beta  = initial_beta
-
-    def fit(self, x_train, y_train, max_iter=500, zero_eps=1e-2, sparse_memorize=True, add_bias=False):
+        self.update_beta = update_beta
+        self.add_bias = add_bias
+        self.alpha = None # Precision of the weights of the relevance vectors. shape=(M,)
+        self.beta  = None # Noise precision.
+        self.SN = None    # Posterior covariance. shape=(M,M)
+        self.mN = None    # Posterior mean. shape=(M,)
+        self.relevance_vectors = None # shape=(M,D) (M-1 if the bias is used.)
+        self.use_bias = False
+
+    def design_matrix(self, X):
+        Phi = self.kernel.gram(X, self.relevance_vectors)
+        if self.use_bias:
+            Phi = np.c_[Phi, np.ones(shape=len(Phi))]
+        return Phi
+
+    def fit(self, x_train, y_train, max_iter=1000, tol=1e-6, beta_update_interval=5, verbose=1):
         """
-        @param x_train : (ndarray) shape=(N,M)
-        @param t_train : (ndarray) shape=(N,)
-        @param max_iter: (int)
-        @param zero_eps: (float) if |x|<zero_eps, x is considered equal to 0.
+        @param x_train              : (ndarray) shape=(N,D)
+        @param t_train              : (ndarray) shape=(N,)
+        @param max_iter             : (int) The maximum number of the add/delete/re-estimate steps.
+        @param tol                  : (float) Stop when the best increase of the log marginal likelihood is less than tol.
+        @param beta_update_interval : (int) The noise precision (and the posterior) is re-estimated in every this steps.
         """
-        N,M = x_train.shape
-        if add_bias:
-            x_train = np.c_[np.copy(x_train), np.ones(shape=N)].shape
-            M+=1
-        self.phi = x_train
-        self.alpha = np.full(shape=M, fill_value=self.initial_alpha)
-        self.beta
+        x_train = np.asarray(x_train, dtype=float)
+        t = np.asarray(y_train, dtype=float).ravel()
+        N = len(x_train)
+        # Candidate basis functions (kernel bases computed blockwise by the Gram engine.)
+        Phi = self.kernel.gram(x_train)
+        if self.add_bias:
+            Phi = np.c_[Phi, np.ones(shape=N)]
+        n_basis = Phi.shape[1]
+        PhiTt = Phi.T.dot(t)
+        PhiTPhi_diag = np.sum(np.square(Phi), axis=0)
+        beta = self.initial_beta or 10/max(np.var(t), 1e-12)
+
+        # Initialization with the single basis which is most aligned with t.
+        i = np.argmax(PhiTt**2/PhiTPhi_diag)
+        active = [i]
+        alpha = np.asarray([PhiTPhi_diag[i]/max(PhiTt[i]**2/PhiTPhi_diag[i] - 1/beta, 1e-12)])
+        C = Phi.T.dot(Phi[:,i])[:,None] # Φ^Tφ_m for all active m. shape=(n_basis, M)
+        SN, mN = self._posterior(C[active], PhiTt[active], alpha, beta)
+
+        for it in range(max_iter):
+            #=== Sparsity (S) and Quality (Q) factors of all candidates. ===
+            CS = C.dot(SN)
+            S = beta*PhiTPhi_diag - beta**2*np.sum(CS*C, axis=1)
+            Q = beta*(PhiTt - C.dot(mN))
+            s = S.copy(); q = Q.copy()
+            s[active] = alpha*S[active]/(alpha-S[active])
+            q[active] = alpha*Q[active]/(alpha-S[active])
+            theta = q**2 - s
+
+            #=== The change of the log marginal likelihood (x2) of each action. ===
+            in_model = np.zeros(shape=n_basis, dtype=bool)
+            in_model[active] = True
+            dL = np.full(shape=n_basis, fill_value=-np.inf)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Add.
+                add = ~in_model & (theta>0)
+                dL[add] = (Q[add]**2-S[add])/S[add] + np.log(S[add]/Q[add]**2)
+                # Re-estimate.
+                re = np.where(theta[active]>0)[0]
+                idx = np.asarray(active)[re]
+                new_alpha = s[idx]**2/theta[idx]
+                delta = 1/new_alpha - 1/alpha[re]
+                dL[idx] = Q[idx]**2/(S[idx]+1/delta) - np.log(1+S[idx]*delta)
+                # Delete. (Keep at least one basis.)
+                if len(active)>1:
+                    de = np.where(theta[active]<=0)[0]
+                    idx = np.asarray(active)[de]
+                    dL[idx] = Q[idx]**2/(S[idx]-alpha[de]) - np.log(1-S[idx]/alpha[de])
+            dL[~np.isfinite(dL)] = -np.inf
+            i = np.argmax(dL)
+            if dL[i] < tol:
+                break
+
+            #=== Rank-one update of the posterior. ===
+            if not in_model[i]:
+                alpha_i = s[i]**2/theta[i]
+                Sii = 1/(alpha_i+S[i])
+                mu_i = Sii*Q[i]
+                v = beta*CS[i]
+                SN = np.block([[SN + Sii*np.outer(v,v), -Sii*v[:,None]], [-Sii*v[None,:], np.full((1,1), Sii)]])
+                mN = np.r_[mN - mu_i*v, mu_i]
+                alpha = np.r_[alpha, alpha_i]
+                active.append(i)
+                C = np.c_[C, Phi.T.dot(Phi[:,i])]
+            else:
+                j = active.index(i)
+                Sj = SN[:,j]
+                if theta[i]>0:
+                    alpha_i = s[i]**2/theta[i]
+                    kappa = 1/(SN[j,j] + 1/(alpha_i-alpha[j]))
+                    SN = SN - kappa*np.outer(Sj,Sj)
+                    mN = mN - kappa*mN[j]*Sj
+                    alpha[j] = alpha_i
+                else:
+                    mN = mN - mN[j]*Sj/Sj[j]
+                    SN = SN - np.outer(Sj,Sj)/Sj[j]
+                    SN = np.delete(np.delete(SN, j, axis=0), j, axis=1)
+                    mN = np.delete(mN, j)
+                    alpha = np.delete(alpha, j)
+                    del active[j]
+                    C = np.delete(C, j, axis=1)
+
+            #=== Noise precision. ===
+            if self.update_beta and (it+1)%beta_update_interval == 0:
+                residual = t - Phi[:,active].dot(mN)
+                gamma = 1 - alpha*np.diag(SN)
+                beta = (N - np.sum(gamma)) / max(residual.dot(residual), 1e-12)
+                SN, mN = self._posterior(C[active], PhiTt[active], alpha, beta)
+            flush_progress_bar(it, max_iter, metrics={"relevance vectors": len(active), "beta": beta}, verbose=verbose)
+        if verbose>0: print()
+
+        # Sort the basis functions so that the bias comes last.
+        order = np.argsort(active)
+        active = np.asarray(active)[order]
+        self.alpha = alpha[order]
+        self.beta = beta
+        self.SN = SN[order][:,order]
+        self.mN = mN[order]
+        self.use_bias = self.add_bias and active[-1]==N
+        self.relevance_vectors = x_train[active[active<N]]
+        return self
+
+    @staticmethod
+    def _posterior(PhiTPhi, PhiTt, alpha, beta):
+        """ SN = (A + βΦ^TΦ)^-1, mN = βSNΦ^Tt """
+        SN = np.linalg.inv(np.diag(alpha) + beta*PhiTPhi)
+        mN = beta*SN.dot(PhiTt)
+        return SN, mN
+
+    def predict(self, X):
+        Phi = self.design_matrix(X)
+        mu = Phi.dot(self.mN)
+        std = np.sqrt(1/self.beta + np.sum(Phi.dot(self.SN)*Phi, axis=1))
+        return (mu, std)
@@ -2,12 +2,69 @@
 # Ref: http://darden.hatenablog.com/entry/2016/12/15/222447
 import os
 import numpy as np
+from itertools import repeat
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
 from ..utils import DecisionTreeDOTexporter
 from ..utils import DOTexporterHandler
+from ..utils import make_batches
+from ..utils import handleNJobs
+from ..utils import handleKeyError
+from ..utils import handleRandomState
 
 def split_data(data, cond):
     return (data[cond], data[~cond])
 
+def impurity(counts, criterion="gini"):
+    """ Node impurity computed from the class counts.
+    @params counts    : shape=(..., num_classes) The number of samples which belongs to each class.
+    @params criterion : "gini" or "entropy"
+    @return           : shape=(...)
+    """
+    counts = np.asarray(counts, dtype=float)
+    num_data = np.sum(counts, axis=-1, keepdims=True)
+    p = counts / np.maximum(num_data, 1)
+    if criterion == "gini":
+        """ IG(t) = 1 - sum_{i=1}^c p(i|t)^2  """
+        return 1 - np.sum(p**2, axis=-1)
+    else:
+        """ IH(t) = - sum_{i=1}^c p(i|t)log p(i|t) """
+        return -np.sum(np.where(p>0, p*np.log2(np.where(p>0, p, 1)), 0), axis=-1)
+
+def bin_features(x_train, max_bins=255):
+    """ Discretize each feature into at most `max_bins` bins by the quantiles.
+    x <= bin_edges[f][b] if and only if x_binned[:,f] <= b, so the thresholds are valid for the raw features.
+    @params x_train   : shape=(N, M)
+    @return x_binned  : (uint8) shape=(N, M)
+    @return bin_edges : (list) bin_edges[f] is the sorted thresholds of the f-th feature.
+    """
+    if not 2 <= max_bins <= 256:
+        raise ValueError(f"max_bins should be in [2, 256], but got {max_bins}")
+    num_samples, num_features = x_train.shape
+    x_binned = np.empty(shape=(num_samples, num_features), dtype=np.uint8)
+    bin_edges = []
+    for f in range(num_features):
+        uniq_feature = np.unique(x_train[:,f])
+        if len(uniq_feature) <= max_bins:
+            edges = (uniq_feature[:-1] + uniq_feature[1:]) / 2.0
+        else:
+            edges = np.unique(np.quantile(x_train[:,f], np.linspace(0, 1, max_bins+1)[1:-1]))
+        x_binned[:,f] = np.searchsorted(edges, x_train[:,f], side="left")
+        bin_edges.append(edges)
+    return x_binned, bin_edges
+
+def resolve_max_features(max_features, num_features):
+    """ Turn `max_features` into the number of features to consider at each node. """
+    if max_features is None:
+        return num_features
+    if isinstance(max_features, str):
+        handleKeyError(lst=["sqrt", "log2"], max_features=max_features)
+        return max(1, int({"sqrt": np.sqrt, "log2": np.log2}[max_features](num_features)))
+    if isinstance(max_features, float):
+        return max(1, int(max_features*num_features))
+    return max(1, min(int(max_features), num_features))
+
 class Node():
     """ Node for Tree structure.
     @params depth       : (int)   Depth (Root: depth=0)
@@ -21,10 +78,16 @@ class Node():
     @params num_samples : (int)   The number of samples which flowed into the node
     @params num_classes : (list)  The number of samples which belongs to each class.
     """
-    def __init__(self, criterion="gini", max_depth=None, random_state=None):
+    __slots__ = [
+        "criterion", "max_depth", "random_state", "max_features", "splitter", "depth", "left", "right",
+        "feature", "threshold", "label", "impurity", "info_gain", "num_samples", "num_classes",
+    ]
+    def __init__(self, criterion="gini", max_depth=None, random_state=None, max_features=None, splitter="best"):
         self.criterion    = criterion
         self.max_depth    = max_depth
         self.random_state = random_state
+        self.max_features = max_features
+        self.splitter     = splitter
         self.depth        = None
         self.left         = None
         self.right        = None
@@ -36,72 +99,108 @@ class Node():
         self.num_samples  = None
         self.num_classes  = None
 
-    def split_node(self, x_train, y_train, depth, ini_classes):
+    def split_node(self, x_train, y_train, indices, depth, ini_classes, sorted_indices=None, x_binned=None, bin_edges=None):
+        """ Grow the tree recursively. The samples are not copied, but passed to the children as the index arrays.
+        @params x_train        : shape=(N,M) All training data.
+        @params y_train        : shape=(N,)  Encoded labels of all training data. (0,1,...,K-1)
+        @params indices        : shape=(n,)  Indices of the samples which flowed into this node.
+        @params ini_classes    : shape=(K,)  The original class labels.
+        @params sorted_indices : shape=(M,n) indices sorted by each feature. (Exact mode)
+        @params x_binned       : shape=(N,M) Binned features and their `bin_edges`. (Histogram mode)
+        """
         self.depth = depth
-        self.num_samples, num_features = x_train.shape
-        self.num_classes = [np.count_nonzero([y_train==k]) for k in ini_classes]
-
-        unique_classes = np.unique(y_train)
-        if len(unique_classes) == 1: # We don't have to divide!!
-            self.label = unique_classes[0]
-            self.impurity = self.criterion_func(y_train)
+        self.num_samples = len(indices)
+        num_features = x_train.shape[1]
+        counts = np.bincount(y_train[indices], minlength=len(ini_classes))
+        self.num_classes = counts.tolist()
+        self.label = ini_classes[np.argmax(counts)]
+        self.impurity = impurity(counts, criterion=self.criterion)
+        if np.count_nonzero(counts) == 1: # We don't have to divide!!
             return
 
-        class_count = {cls: np.count_nonzero(y_train==cls) for cls in np.unique(y_train)}
-        self.label  = max(class_count.items(), key=lambda x:x[1])[0]
-        self.impurity = self.criterion_func(y_train)
-
         self.info_gain = 0.0
         # The order of looking at features. (If Information gain is equal, the fastest one is given priority.)
-        f_order = np.random.RandomState(self.random_state).permutation(num_features).tolist()
+        rnd = handleRandomState(self.random_state)
+        f_order = rnd.permutation(num_features)[:self.max_features].tolist()
         for f in f_order:
-            uniq_feature = np.unique(x_train[:, f]) # NOTE: "uniq_feature" are sorted!!
-            split_points = (uniq_feature[:-1] + uniq_feature[1:]) / 2.0
-
-            for threshold in split_points:
-                y_train_l, y_train_r = split_data(data=y_train, cond=x_train[:,f]<=threshold)
-                val = self.calc_info_gain(y_train, y_train_l, y_train_r)
-                if self.info_gain < val:
-                    self.info_gain = val
-                    self.feature   = f
-                    self.threshold = threshold
+            if self.splitter == "random":
+                info_gain, threshold = self.random_split(x_train, y_train, indices, f, counts, rnd)
+            elif x_binned is None:
+                info_gain, threshold = self.sorted_scan(x_train, y_train, sorted_indices[f], f, counts)
+            else:
+                info_gain, threshold = self.histogram_scan(x_binned, y_train, indices, f, bin_edges[f], counts)
+            if self.info_gain < info_gain:
+                self.info_gain = info_gain
+                self.feature   = f
+                self.threshold = threshold
 
         if self.info_gain == 0.0: return
         if depth == self.max_depth: return
 
         #=== Recursion ===
-        x_train_l, x_train_r = split_data(data=x_train, cond=x_train[:,self.feature]<=self.threshold)
-        y_train_l, y_train_r = split_data(data=y_train, cond=x_train[:,self.feature]<=self.threshold)
+        go_left = x_train[indices, self.feature] <= self.threshold
+        indices_l, indices_r = split_data(data=indices, cond=go_left)
+        sorted_indices_l = sorted_indices_r = None
+        if sorted_indices is not None:
+            # Stable partition keeps each row sorted.
+            is_left = np.zeros(shape=len(x_train), dtype=bool)
+            is_left[indices_l] = True
+            mask = is_left[sorted_indices]
+            sorted_indices_l = sorted_indices[mask].reshape(num_features, len(indices_l))
+            sorted_indices_r = sorted_indices[~mask].reshape(num_features, len(indices_r))
         # Left Node
-        self.left  = Node(self.criterion, self.max_depth)
-        self.left.split_node(x_train_l, y_train_l, depth+1, ini_classes)
-        # Left Node
-        self.right = Node(self.criterion, self.max_depth, ini_classes)
-        self.right.split_node(x_train_r, y_train_r, depth+1, ini_classes)
-
-    def criterion_func(self, y_train):
-        num_classes = np.unique(y_train)
-        num_data = len(y_train)
-
-        if self.criterion == "gini":
-            """ IG(t) = 1 - sum_{i=1}^c p(i|t)^2  """
-            val = 1 - np.sum([(np.count_nonzero(y_train==cls)/num_data)**2 for cls in num_classes])
-
-        elif self.criterion == "entropy":
-            """ IH(t) = - sum_{i=1}^c p(i|t)log p(i|t) """
-            val = 0
-            for c in classes:
-                p = np.count_nonzero(y_train==c)/num_data
-                if p != 0.0: val -= p * np.log2(p)
-        return val
-
-    def calc_info_gain(self, y_train_all, y_train_l, y_train_r):
-        """ Information gain = I_before - (wL・I_after_L + wR・I_after_R) """
-        I_before = self.criterion_func(y_train_all); Nall = len(y_train_all)
-        I_afterL = self.criterion_func(y_train_l); NL = len(y_train_l)
-        I_afterR = self.criterion_func(y_train_r); NR = len(y_train_r)
-        InformationGain = I_before - (NL/Nall*I_afterL + NR/Nall*I_afterR)
-        return InformationGain
+        self.left  = Node(self.criterion, self.max_depth, random_state=rnd, max_features=self.max_features, splitter=self.splitter)
+        self.left.split_node(x_train, y_train, indices_l, depth+1, ini_classes, sorted_indices_l, x_binned, bin_edges)
+        # Right Node
+        self.right = Node(self.criterion, self.max_depth, random_state=rnd, max_features=self.max_features, splitter=self.splitter)
+        self.right.split_node(x_train, y_train, indices_r, depth+1, ini_classes, sorted_indices_r, x_binned, bin_edges)
+
+    def calc_info_gain(self, counts, counts_l):
+        """ Information gain = I_before - (wL・I_after_L + wR・I_after_R)
+        @params counts   : shape=(K,)   Class counts of this node.
+        @params counts_l : shape=(S,K)  Class counts of the left child for each split candidate.
+        """
+        counts_r = counts - counts_l
+        Nall = np.sum(counts)
+        NL = np.sum(counts_l, axis=-1); NR = Nall - NL
+        I_before = impurity(counts, criterion=self.criterion)
+        I_afterL = impurity(counts_l, criterion=self.criterion)
+        I_afterR = impurity(counts_r, criterion=self.criterion)
+        return I_before - (NL/Nall*I_afterL + NR/Nall*I_afterR)
+
+    def sorted_scan(self, x_train, y_train, sorted_index, f, counts):
+        """ Sweep the cumulative class counts along the samples sorted by the f-th feature. O(n·K) """
+        x_sorted = x_train[sorted_index, f]
+        # Split between the different consecutive values only.
+        is_boundary = x_sorted[:-1] < x_sorted[1:]
+        if not np.any(is_boundary): return 0.0, None
+        counts_l = np.cumsum(np.eye(len(counts), dtype=np.int64)[y_train[sorted_index]], axis=0)[:-1][is_boundary]
+        info_gains = self.calc_info_gain(counts, counts_l)
+        best = np.argmax(info_gains)
+        pos = np.flatnonzero(is_boundary)[best]
+        return info_gains[best], (x_sorted[pos] + x_sorted[pos+1]) / 2.0
+
+    def histogram_scan(self, x_binned, y_train, indices, f, edges, counts):
+        """ Sweep the cumulative class counts along the histogram of the f-th feature. O(n + n_bins·K) """
+        num_bins = len(edges)+1
+        K = len(counts)
+        hist = np.bincount(x_binned[indices, f].astype(np.intp)*K + y_train[indices], minlength=num_bins*K).reshape(num_bins, K)
+        counts_l = np.cumsum(hist, axis=0)[:-1]
+        NL = np.sum(counts_l, axis=1)
+        is_valid = (0 < NL) & (NL < len(indices))
+        if not np.any(is_valid): return 0.0, None
+        info_gains = self.calc_info_gain(counts, counts_l[is_valid])
+        best = np.argmax(info_gains)
+        return info_gains[best], edges[np.flatnonzero(is_valid)[best]]
+
+    def random_split(self, x_train, y_train, indices, f, counts, rnd):
+        """ Draw the threshold uniformly between the minimum and the maximum of the f-th feature. (Extremely Randomized Trees) """
+        x_node = x_train[indices, f]
+        x_min, x_max = np.min(x_node), np.max(x_node)
+        if x_min == x_max: return 0.0, None
+        threshold = rnd.uniform(x_min, x_max)
+        counts_l = np.bincount(y_train[indices[x_node <= threshold]], minlength=len(counts))
+        return self.calc_info_gain(counts, counts_l[None])[0], threshold
 
     def predict(self, x_train):
         if self.feature == None or self.depth == self.max_depth:
@@ -110,6 +209,80 @@ class Node():
             if x_train[self.feature] <= self.threshold: return self.left.predict(x_train)
             else: return self.right.predict(x_train)
 
+class CompactTree():
+    """ Array-backed representation of the fitted tree. The ith node is described by
+    @params feature   : (int)   Index of the features. (-1 for the leaves)
+    @params threshold : (float) Go left if x[feature] <= threshold.
+    @params left      : (int)   Index of the left child. (-1 for the leaves)
+    @params right     : (int)   Index of the right child. (-1 for the leaves)
+    @params value     : The number of samples which belongs to each class. shape=(num_classes,)
+                        (or the leaf values for the regression trees.)
+    """
+    def __init__(self, feature, threshold, left, right, value):
+        self.feature   = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left      = np.asarray(left, dtype=np.intp)
+        self.right     = np.asarray(right, dtype=np.intp)
+        self.value     = np.asarray(value)
+
+    FIELDS = ["feature", "threshold", "left", "right", "value"]
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    @property
+    def arrays(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_node(cls, root):
+        """ Flatten the linked `Node`s in the depth-first order. """
+        feature, threshold, left, right, value = [], [], [], [], []
+        stack = [(root, -1, False)]
+        while len(stack)>0:
+            node, parent, is_left = stack.pop()
+            node_id = len(feature)
+            if parent >= 0:
+                (left if is_left else right)[parent] = node_id
+            is_leaf = node.feature is None or node.depth == node.max_depth
+            feature.append(-1 if is_leaf else node.feature)
+            threshold.append(np.nan if is_leaf else node.threshold)
+            left.append(-1); right.append(-1)
+            value.append(node.num_classes)
+            if not is_leaf:
+                stack.append((node.right, node_id, False))
+                stack.append((node.left,  node_id, True))
+        return cls(feature, threshold, left, right, value)
+
+    def apply(self, X):
+        """ Route all samples level by level, and return the indices of the leaves they reach.
+        @params X : shape=(N,M)
+        @return   : shape=(N,)
+        """
+        X = np.asarray(X)
+        nodes = np.zeros(shape=len(X), dtype=np.intp)
+        active = np.flatnonzero(self.left[nodes] >= 0)
+        while len(active)>0:
+            current = nodes[active]
+            go_left = X[active, self.feature[current]] <= self.threshold[current]
+            nodes[active] = np.where(go_left, self.left[current], self.right[current])
+            active = active[self.left[nodes[active]] >= 0]
+        return nodes
+
+    def predict_proba(self, X):
+        value = self.value[self.apply(X)]
+        return value / np.sum(value, axis=1, keepdims=True)
+
+    def save(self, path, **kwargs):
+        """ Save the arrays (and `kwargs`) in `.npz` format. """
+        np.savez(path, **self.arrays, **kwargs)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(**{field: f[field] for field in cls.FIELDS})
+
 class TreeAnalysis():
     """ Calcurate the feature importances. """
     def __init__(self):
@@ -132,26 +305,83 @@ class TreeAnalysis():
             if normalizer > 0.0: self.importances /= normalizer # Avoid dividing by zero (e.g., when root is pure)
         return self.importances
 
+    def get_ensemble_feature_importances(self, estimators, normalize=True):
+        """ Average the (normalized) feature importances over the trees of the ensemble. """
+        self.importances = np.mean([estimator.feature_importances_ for estimator in estimators], axis=0)
+        if normalize:
+            normalizer = np.sum(self.importances)
+            if normalizer > 0.0: self.importances /= normalizer
+        return self.importances
+
 class DecisionTreeClassifier():
-    def __init__(self, criterion="gini", max_depth=None, random_state=None):
+    """
+    @params criterion    : "gini" or "entropy"
+    @params max_depth    : (int) The maximum depth of the tree.
+    @params random_state : The order of looking at features.
+    @params max_bins     : (int) If given, the features are discretized into at most `max_bins` (<=256) bins,
+                           and the splits are searched over the histograms. Otherwise, all midpoints are searched
+                           by sweeping the samples sorted (only once) by each feature.
+    @params max_features : The number of features to consider at each node. (int, float, "sqrt", "log2" or None=all)
+    @params splitter     : "best" or "random" (The threshold of each feature is drawn at random.)
+    """
+    def __init__(self, criterion="gini", max_depth=None, random_state=None, max_bins=None, max_features=None, splitter="best"):
+        handleKeyError(lst=["gini", "entropy"], criterion=criterion)
+        handleKeyError(lst=["best", "random"], splitter=splitter)
         self.root          = None
         self.criterion     = criterion
         self.max_depth     = max_depth
         self.random_state  = random_state
+        self.max_bins      = max_bins
+        self.max_features  = max_features
+        self.splitter      = splitter
         self.root_analysis = TreeAnalysis()
 
     def fit(self, x_train, y_train):
-        num_samples, num_features = x_train.shape
-        ini_classes = np.unique(y_train)
-        self.root = Node(criterion=self.criterion, max_depth=self.max_depth, random_state=self.random_state)
-        self.root.split_node(x_train=x_train, y_train=y_train, depth=0, ini_classes=ini_classes)
+        x_train = np.asarray(x_train)
+        ini_classes, y_encoded = np.unique(y_train, return_inverse=True)
+        x_binned = bin_edges = None
+        if self.max_bins is not None and self.splitter == "best":
+            x_binned, bin_edges = bin_features(x_train, max_bins=self.max_bins)
+        return self._fit(x_train, y_encoded, ini_classes, indices=np.arange(len(x_train)), x_binned=x_binned, bin_edges=bin_edges)
+
+    def _fit(self, x_train, y_encoded, ini_classes, indices, x_binned=None, bin_edges=None):
+        """ Grow the tree from the samples `x_train[indices]`. (`indices` may contain duplicates for bootstrap.) """
+        num_features = x_train.shape[1]
+        sorted_indices = None
+        if x_binned is None and self.splitter == "best":
+            sorted_indices = indices[np.argsort(x_train[indices], axis=0, kind="stable")].T
+        self.root = Node(
+            criterion=self.criterion, max_depth=self.max_depth, random_state=handleRandomState(self.random_state),
+            max_features=resolve_max_features(self.max_features, num_features), splitter=self.splitter,
+        )
+        self.root.split_node(
+            x_train=x_train, y_train=y_encoded, indices=indices, depth=0, ini_classes=ini_classes,
+            sorted_indices=sorted_indices, x_binned=x_binned, bin_edges=bin_edges
+        )
         self.feature_importances_ = self.root_analysis.get_feature_importances(node=self.root, num_features=num_features)
         self.num_features = num_features
         self.ini_classes = ini_classes
+        self.tree_ = CompactTree.from_node(self.root)
+        return self
+
+    def predict_proba(self, x_train):
+        return self.tree_.predict_proba(x_train)
 
     def predict(self, x_train):
-        predictions = np.asarray([self.root.predict(x) for x in x_train])
-        return predictions
+        return self.ini_classes[np.argmax(self.tree_.value[self.tree_.apply(x_train)], axis=1)]
+
+    def save_tree(self, path):
+        """ Save the compact tree and the class labels in `.npz` format. """
+        self.tree_.save(path, ini_classes=self.ini_classes, feature_importances=self.feature_importances_)
+
+    def load_tree(self, path):
+        """ Load the tree saved by `save_tree`. (The linked `Node`s are not restored.) """
+        self.tree_ = CompactTree.load(path)
+        with np.load(path) as f:
+            self.ini_classes = f["ini_classes"]
+            self.feature_importances_ = f["feature_importances"]
+        self.num_features = len(self.feature_importances_)
+        return self
 
     def score(self, x_train, y_train):
         return sum(self.predict(x_train) == y_train)/float(len(y_train))
@@ -168,3 +398,128 @@ class DecisionTreeClassifier():
             filled=filled, rounded=rounded, precision=precision
         )
         return DOTexporterHandler(exporter, root=self.root, out_file=out_file)
+
+def _grow_tree(x_train, x_binned, y_encoded, ini_classes, bin_edges, tree_params, bootstrap, seed):
+    """ Grow a tree of the ensemble from the (bootstrap) sample determined by `seed`. """
+    rnd = np.random.RandomState(seed)
+    num_samples = len(x_train)
+    indices = rnd.randint(num_samples, size=num_samples) if bootstrap else np.arange(num_samples)
+    tree = DecisionTreeClassifier(random_state=rnd, **tree_params)
+    return tree._fit(x_train, y_encoded, ini_classes, indices=indices, x_binned=x_binned, bin_edges=bin_edges)
+
+def _grow_tree_shared(shm_names, shapes, *args):
+    """ Grow a tree in the worker process with the training data in the shared memory. """
+    shms = [shared_memory.SharedMemory(name=name) if name is not None else None for name in shm_names]
+    try:
+        x_train = np.ndarray(shapes[0], dtype=np.float64, buffer=shms[0].buf)
+        x_binned = None if shms[1] is None else np.ndarray(shapes[1], dtype=np.uint8, buffer=shms[1].buf)
+        tree = _grow_tree(x_train, x_binned, *args)
+        tree.root = None # The linked nodes are not sent back.
+        del x_train, x_binned
+    finally:
+        for shm in shms:
+            if shm is not None: shm.close()
+    return tree
+
+class RandomForestClassifier():
+    """ Ensemble of the decision trees, each of which is grown from a bootstrap sample and looks at
+    `max_features` randomly chosen features at each node. The class probabilities are averaged.
+    Ref: L. Breiman. Random Forests. (Machine Learning 2001)
+    ~~~
+    @params n_estimators : (int) The number of trees.
+    @params criterion    : "gini" or "entropy"
+    @params max_depth    : (int) The maximum depth of each tree.
+    @params max_features : The number of features to consider at each node. (int, float, "sqrt", "log2" or None=all)
+    @params bootstrap    : (bool) Whether to grow each tree from a bootstrap sample.
+    @params max_bins     : (int) If given, the features are binned only once and shared by all trees.
+    @params random_state : (int, RandomState)
+    @params n_jobs       : (int) The number of processes to grow the trees.
+    """
+    splitter = "best"
+
+    def __init__(self, n_estimators=100, criterion="gini", max_depth=None, max_features="sqrt",
+                 bootstrap=True, max_bins=None, random_state=None, n_jobs=1):
+        handleKeyError(lst=["gini", "entropy"], criterion=criterion)
+        self.n_estimators = n_estimators
+        self.criterion    = criterion
+        self.max_depth    = max_depth
+        self.max_features = max_features
+        self.bootstrap    = bootstrap
+        self.max_bins     = max_bins
+        self.random_state = random_state
+        self.n_jobs       = n_jobs
+        self.estimators_  = []
+        self.root_analysis = TreeAnalysis()
+
+    def fit(self, x_train, y_train):
+        x_train = np.ascontiguousarray(x_train, dtype=np.float64)
+        num_features = x_train.shape[1]
+        ini_classes, y_encoded = np.unique(y_train, return_inverse=True)
+        x_binned = bin_edges = None
+        if self.max_bins is not None and self.splitter == "best":
+            x_binned, bin_edges = bin_features(x_train, max_bins=self.max_bins)
+        tree_params = dict(criterion=self.criterion, max_depth=self.max_depth, max_bins=self.max_bins,
+                           max_features=self.max_features, splitter=self.splitter)
+        seeds = handleRandomState(self.random_state).randint(np.iinfo(np.int32).max, size=self.n_estimators)
+        n_jobs = min(handleNJobs(self.n_jobs), self.n_estimators)
+
+        if n_jobs == 1:
+            self.estimators_ = [
+                _grow_tree(x_train, x_binned, y_encoded, ini_classes, bin_edges, tree_params, self.bootstrap, seed)
+                for seed in seeds
+            ]
+        else:
+            # Place the training data in the shared memory, so that it is not copied to each process.
+            arrays = [x_train, x_binned]
+            shms = [shared_memory.SharedMemory(create=True, size=arr.nbytes) if arr is not None else None for arr in arrays]
+            try:
+                for shm,arr in zip(shms, arrays):
+                    if shm is not None:
+                        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+                shm_names = [None if shm is None else shm.name for shm in shms]
+                shapes = [None if arr is None else arr.shape for arr in arrays]
+                with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                    self.estimators_ = list(executor.map(
+                        _grow_tree_shared, repeat(shm_names), repeat(shapes), repeat(y_encoded), repeat(ini_classes),
+                        repeat(bin_edges), repeat(tree_params), repeat(self.bootstrap), seeds,
+                    ))
+            finally:
+                for shm in shms:
+                    if shm is not None:
+                        shm.close()
+                        shm.unlink()
+
+        self.num_features = num_features
+        self.ini_classes = ini_classes
+        self.feature_importances_ = self.root_analysis.get_ensemble_feature_importances(self.estimators_)
+        return self
+
+    def predict_proba(self, x_train, batch_size=None):
+        """ Average the class probabilities of the compact trees.
+        @params batch_size : (int) The number of samples routed through the trees at once.
+        """
+        x_train = np.asarray(x_train)
+        num_samples = len(x_train)
+        proba = np.zeros(shape=(num_samples, len(self.ini_classes)))
+        for start, end in make_batches(num_samples, batch_size or max(1, num_samples)):
+            for estimator in self.estimators_:
+                proba[start:end] += estimator.tree_.predict_proba(x_train[start:end])
+        return proba / len(self.estimators_)
+
+    def predict(self, x_train, batch_size=None):
+        return self.ini_classes[np.argmax(self.predict_proba(x_train, batch_size=batch_size), axis=1)]
+
+    def score(self, x_train, y_train):
+        return sum(self.predict(x_train) == y_train)/float(len(y_train))
+
+class ExtraTreesClassifier(RandomForestClassifier):
+    """ Extremely Randomized Trees: The threshold of each candidate feature is drawn at random,
+    and each tree is grown from the whole training data by default.
+    Ref: P. Geurts, D. Ernst, L. Wehenkel. Extremely randomized trees. (Machine Learning 2006)
+    """
+    splitter = "random"
+
+    def __init__(self, n_estimators=100, criterion="gini", max_depth=None, max_features="sqrt",
+                 bootstrap=False, random_state=None, n_jobs=1):
+        super().__init__(n_estimators=n_estimators, criterion=criterion, max_depth=max_depth, max_features=max_features,
+                         bootstrap=bootstrap, max_bins=None, random_state=random_state, n_jobs=n_jobs)
@@ -1,6 +1,6 @@
 from distutils.version import LooseVersion
 
-CYTHON_MIN_VERSION = '0.28.5'
+CYTHON_MIN_VERSION = '0.29.31'
 
 def _check_cython_version():
     message = f'Please install Cython with a version >= {CYTHON_MIN_VERSION} \
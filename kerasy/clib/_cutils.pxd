@@ -6,7 +6,7 @@
 from numpy.math cimport expl, logl, log1pl, isinf, fabsl, INFINITY
 from libc.math import sqrt, ceil
 
-cdef inline double clip(double val, v_min, v_max):
+cdef inline double clip(double val, double v_min, double v_max) noexcept nogil:
     if val > v_max:
         return v_max
     elif val < v_min:
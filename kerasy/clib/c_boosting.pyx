@@ -0,0 +1,99 @@
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+
+# Ref: G. Ke, et al. LightGBM: A Highly Efficient Gradient Boosting Decision Tree. (NIPS 2017)
+import numpy as np
+cimport numpy as np
+from libc.math cimport INFINITY
+from cython.parallel cimport prange
+
+ctypedef np.float64_t DOUBLE
+ctypedef np.intp_t ITYPE
+ctypedef np.uint8_t BINNED
+
+def build_histogram(np.ndarray[BINNED, ndim=2, mode='c'] X_binned_T,
+                    np.ndarray[DOUBLE, ndim=1, mode='c'] gradients,
+                    np.ndarray[DOUBLE, ndim=1, mode='c'] hessians,
+                    np.ndarray[ITYPE, ndim=1, mode='c'] sample_indices,
+                    int n_bins, int n_jobs=1):
+    """ Sum of the gradients, the hessians and the number of samples in each bin of each feature.
+    ~~~
+    @params X_binned_T     : Binned features (transposed, so that each feature is contiguous.) shape=(n_features, N)
+    @params gradients      : shape=(N,)
+    @params hessians       : shape=(N,)
+    @params sample_indices : Indices of the samples in the node. shape=(n,)
+    @params n_bins         : The maximum number of bins. (<=256)
+    @params n_jobs         : The number of OpenMP threads. (Features are processed in parallel.)
+    @return hist           : hist[f,b] = (Σg, Σh, count) shape=(n_features, n_bins, 3)
+    """
+    cdef ITYPE n_features = X_binned_T.shape[0]
+    cdef ITYPE n_total = X_binned_T.shape[1]
+    cdef ITYPE n_samples = sample_indices.shape[0]
+    cdef np.ndarray[DOUBLE, ndim=3, mode='c'] hist = np.zeros((n_features, n_bins, 3), dtype=np.float64)
+    cdef BINNED* X_p = <BINNED*>X_binned_T.data
+    cdef DOUBLE* g_p = <DOUBLE*>gradients.data
+    cdef DOUBLE* h_p = <DOUBLE*>hessians.data
+    cdef ITYPE* idx_p = <ITYPE*>sample_indices.data
+    cdef DOUBLE* hist_p = <DOUBLE*>hist.data
+    cdef ITYPE f, k, i
+    cdef DOUBLE* hist_f
+    cdef BINNED* X_f
+
+    for f in prange(n_features, nogil=True, schedule='static', num_threads=n_jobs):
+        X_f = X_p + f*n_total
+        hist_f = hist_p + f*n_bins*3
+        for k in range(n_samples):
+            i = idx_p[k]
+            hist_f[3*X_f[i]]   += g_p[i]
+            hist_f[3*X_f[i]+1] += h_p[i]
+            hist_f[3*X_f[i]+2] += 1
+    return hist
+
+def find_best_splits(np.ndarray[DOUBLE, ndim=3, mode='c'] hist,
+                     np.ndarray[ITYPE, ndim=1, mode='c'] n_bins_per_feature,
+                     double l2_regularization=0., ITYPE min_samples_leaf=20,
+                     double min_hessian_to_split=1e-3, int n_jobs=1):
+    """ Scan the cumulative histogram of each feature, and find the best bin to split.
+    gain = 1/2 [G_L^2/(H_L+λ) + G_R^2/(H_R+λ) - G^2/(H+λ)]
+    ~~~
+    @params hist               : Output of `build_histogram`. shape=(n_features, n_bins, 3)
+    @params n_bins_per_feature : The number of the used bins of each feature. shape=(n_features,)
+    @return gains              : The best gain of each feature. (-inf if it can not be split.) shape=(n_features,)
+    @return bins               : Go left if the binned feature <= bins[f]. shape=(n_features,)
+    """
+    cdef ITYPE n_features = hist.shape[0]
+    cdef ITYPE n_bins = hist.shape[1]
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] gains = np.full(n_features, -INFINITY, dtype=np.float64)
+    cdef np.ndarray[ITYPE, ndim=1, mode='c'] bins = np.zeros(n_features, dtype=np.intp)
+    cdef DOUBLE* hist_p = <DOUBLE*>hist.data
+    cdef ITYPE* n_bins_p = <ITYPE*>n_bins_per_feature.data
+    cdef DOUBLE* gains_p = <DOUBLE*>gains.data
+    cdef ITYPE* bins_p = <ITYPE*>bins.data
+    cdef ITYPE f, b
+    cdef DOUBLE* hist_f
+    cdef double G, H, N, G_L, H_L, N_L, G_R, H_R, N_R, gain, parent_score
+
+    for f in prange(n_features, nogil=True, schedule='static', num_threads=n_jobs):
+        hist_f = hist_p + f*n_bins*3
+        G = 0; H = 0; N = 0
+        for b in range(n_bins_p[f]):
+            G = G + hist_f[3*b]
+            H = H + hist_f[3*b+1]
+            N = N + hist_f[3*b+2]
+        parent_score = G*G/(H+l2_regularization)
+        G_L = 0; H_L = 0; N_L = 0
+        for b in range(n_bins_p[f]-1):
+            G_L = G_L + hist_f[3*b]
+            H_L = H_L + hist_f[3*b+1]
+            N_L = N_L + hist_f[3*b+2]
+            G_R = G - G_L; H_R = H - H_L; N_R = N - N_L
+            if N_L < min_samples_leaf or H_L < min_hessian_to_split:
+                continue
+            if N_R < min_samples_leaf or H_R < min_hessian_to_split:
+                break
+            gain = 0.5*(G_L*G_L/(H_L+l2_regularization) + G_R*G_R/(H_R+l2_regularization) - parent_score)
+            if gain > gains_p[f]:
+                gains_p[f] = gain
+                bins_p[f] = b
+    return gains, bins
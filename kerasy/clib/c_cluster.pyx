@@ -0,0 +1,50 @@
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+
+import numpy as np
+cimport numpy as np
+cimport cython
+
+from libcpp.vector cimport vector
+
+ctypedef np.intp_t ITYPE
+
+# Ref: https://github.com/scikit-learn/scikit-learn/blob/95d4f0841d57e8b5f6b2a570312e9d832e69debc/sklearn/cluster/_dbscan_inner.pyx#L19
+def dbscan_inner(
+        np.ndarray[np.uint8_t, ndim=1, mode='c'] is_core,
+        np.ndarray[ITYPE,      ndim=1, mode='c'] indptr,
+        np.ndarray[ITYPE,      ndim=1, mode='c'] indices,
+        np.ndarray[ITYPE,      ndim=1, mode='c'] labels):
+    """Cluster expansion of DBSCAN. (Inplace)
+    @params is_core : shape=(N,) Whether ith data is core or not.
+    @params indptr  : shape=(N+1,) ith data's neighbors are indices[indptr[i]:indptr[i+1]]
+    @params indices : shape=(n_neighbors_total,)
+    @params labels  : shape=(N,) Cluster labels for each point. Noisy samples are given the label -1.
+    """
+    cdef ITYPE i, j, v, k
+    cdef ITYPE label = 0
+    cdef ITYPE n_samples = labels.shape[0]
+    cdef vector[ITYPE] stack
+
+    with nogil:
+        for i in range(n_samples):
+            if labels[i] != -1 or not is_core[i]:
+                continue
+            # Depth-first search starting from i,
+            # ending at the non-core points.
+            j = i
+            while True:
+                if labels[j] == -1:
+                    labels[j] = label
+                    if is_core[j]:
+                        for k in range(indptr[j], indptr[j+1]):
+                            v = indices[k]
+                            if labels[v] == -1:
+                                stack.push_back(v)
+                if stack.size() == 0:
+                    break
+                j = stack.back()
+                stack.pop_back()
+            label += 1
+    return labels
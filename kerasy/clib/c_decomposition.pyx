@@ -8,21 +8,24 @@ from numpy.math cimport INFINITY
 
 from cython cimport floating
 
+from cython.parallel cimport prange, threadid
+from libc.math cimport pow
+
 from ..utils import flush_progress_bar
 from _cutils cimport clip
 
-cdef tau_rand_int(np.ndarray[np.int64_t, ndim=1, mode='c'] state):
+cdef inline np.int64_t tau_rand_int(np.int64_t* state) noexcept nogil:
     """A fast (pseudo)-random number generator.
     state: The internal state of the rng. array of int64, shape (3,)
     """
-    state[0] = (((state[0] & 4294967294) << 12) & 0xFFFFFFFF) ^ (
-        (((state[0] << 13) & 0xFFFFFFFF) ^ state[0]) >> 19
+    state[0] = (((state[0] & <np.int64_t>4294967294) << 12) & <np.int64_t>0xFFFFFFFF) ^ (
+        (((state[0] << 13) & <np.int64_t>0xFFFFFFFF) ^ state[0]) >> 19
     )
-    state[1] = (((state[1] & 4294967288) << 4) & 0xFFFFFFFF) ^ (
-        (((state[1] << 2) & 0xFFFFFFFF) ^ state[1]) >> 25
+    state[1] = (((state[1] & <np.int64_t>4294967288) << 4) & <np.int64_t>0xFFFFFFFF) ^ (
+        (((state[1] << 2) & <np.int64_t>0xFFFFFFFF) ^ state[1]) >> 25
     )
-    state[2] = (((state[2] & 4294967280) << 17) & 0xFFFFFFFF) ^ (
-        (((state[2] << 3) & 0xFFFFFFFF) ^ state[2]) >> 11
+    state[2] = (((state[2] & <np.int64_t>4294967280) << 17) & <np.int64_t>0xFFFFFFFF) ^ (
+        (((state[2] << 3) & <np.int64_t>0xFFFFFFFF) ^ state[2]) >> 11
     )
     return state[0] ^ state[1] ^ state[2]
 
@@ -106,70 +109,359 @@ def compute_membership_strengths(
             cols[i*n_neighbors + j] = knn_indices[i,j]
             vals[i*n_neighbors + j] = val
 
+cdef void optimize_edge(floating* head_embedding, floating* tail_embedding, int j, int k, int dim,
+                        bint move_other, int n_neg_samples, np.int64_t* rng_state, int n_vertices,
+                        double a, double b, double gamma, double alpha) noexcept nogil:
+    """ SGD of one positive edge (j,k) and `n_neg_samples` negative samples. """
+    cdef int d, p
+    cdef floating* current = head_embedding + j*dim
+    cdef floating* other = tail_embedding + k*dim
+    cdef double dist_squared, grad_coeff, grad_d
+
+    dist_squared = 0.0
+    for d in range(dim):
+        dist_squared += (current[d]-other[d]) * (current[d]-other[d])
+    if dist_squared > 0.0:
+        grad_coeff = -2.0 * a * b * pow(dist_squared, b-1.0)
+        grad_coeff /= a*pow(dist_squared, b)+1.0
+    else:
+        grad_coeff = 0.0
+
+    for d in range(dim):
+        grad_d = clip(grad_coeff*(current[d]-other[d]), -4.0, 4.0)
+        current[d] += grad_d * alpha
+        if move_other:
+            other[d] += -grad_d * alpha
+
+    for p in range(n_neg_samples):
+        k = tau_rand_int(rng_state) % n_vertices
+        if k < 0: k += n_vertices
+        other = tail_embedding + k*dim
+        dist_squared = 0.0
+        for d in range(dim):
+            dist_squared += (current[d]-other[d]) * (current[d]-other[d])
+
+        if dist_squared > 0.0:
+            grad_coeff = 2.0 * gamma * b
+            grad_coeff /= (0.001+dist_squared)*(a*pow(dist_squared, b) + 1)
+        elif j == k:
+            continue
+        else:
+            grad_coeff = 0.0
+
+        for d in range(dim):
+            if grad_coeff > 0.0:
+                grad_d = clip(grad_coeff*(current[d]-other[d]), -4.0, 4.0)
+            else:
+                grad_d = 4.0
+            current[d] += grad_d * alpha
+
 def optimize_layout(
-    np.ndarray[floating,   ndim=2, mode='c'] head_embedding, tail_embedding,
-    np.ndarray[np.int32_t, ndim=1, mode='c'] head, tail,
+    np.ndarray[floating,   ndim=2, mode='c'] head_embedding,
+    np.ndarray[floating,   ndim=2, mode='c'] tail_embedding,
+    np.ndarray[np.int32_t, ndim=1, mode='c'] head,
+    np.ndarray[np.int32_t, ndim=1, mode='c'] tail,
     np.ndarray[floating,   ndim=1, mode='c'] epochs_per_sample,
     np.ndarray[np.int64_t, ndim=1, mode='c'] rng_state,
-    int epochs, n_vertices, float a, b,
-    float gamma=1.0, initial_alpha=1.0, negative_sample_rate=5.0, int verbose=1):
-
-    cdef int i,j,k,p
+    int epochs, int n_vertices, double a, double b,
+    double gamma=1.0, double initial_alpha=1.0, double negative_sample_rate=5.0, int verbose=1, int n_jobs=1,
+    move_other=None):
+    """ Optimize the embeddings by SGD over the edges.
+    If `move_other` is False, `tail_embedding` is held fixed. (Defaults to True when the head and tail are the same size.)
+    When `n_jobs` > 1, the edges are partitioned across the OpenMP threads and the embeddings are
+    updated without locks (Hogwild!), with the per-thread states of the random number generator.
+    (The updates conflict rarely because the graph is sparse.)
+    """
+    cdef int i, j, k, n_neg_samples, tid
+    cdef int epoch
+    cdef int n_edges = epochs_per_sample.shape[0]
     cdef int dim = head_embedding.shape[1]
-    cdef int move_other = head_embedding.shape[0] == tail_embedding.shape[0]
-    cdef float alpha = initial_alpha
+    cdef bint c_move_other = (head_embedding.shape[0] == tail_embedding.shape[0]) if move_other is None else move_other
+    cdef double alpha = initial_alpha
+    n_jobs = max(1, n_jobs)
 
     cdef np.ndarray[floating, ndim=1, mode='c'] epochs_per_negative_sample = epochs_per_sample / negative_sample_rate
     cdef np.ndarray[floating, ndim=1, mode='c'] epoch_of_next_negative_sample = epochs_per_negative_sample.copy()
     cdef np.ndarray[floating, ndim=1, mode='c'] epoch_of_next_sample = epochs_per_sample.copy()
+    # Per-thread states. (The 1st thread uses `rng_state` itself.)
+    cdef np.ndarray[np.int64_t, ndim=2, mode='c'] rng_states = np.tile(rng_state, (n_jobs, 1))
+    rng_states[:,0] += np.arange(n_jobs, dtype=np.int64)
+
+    cdef floating* head_p = <floating*>head_embedding.data
+    cdef floating* tail_p = <floating*>tail_embedding.data
+    cdef np.int64_t* rng_p = <np.int64_t*>rng_states.data
 
     for epoch in range(epochs):
-        for i in range(epochs_per_sample.shape[0]):
+        for i in prange(n_edges, nogil=True, schedule='static', num_threads=n_jobs):
             if epoch_of_next_sample[i] <= epoch:
+                tid = threadid()
                 j = head[i]
                 k = tail[i]
+                n_neg_samples = <int>((epoch-epoch_of_next_negative_sample[i]) / epochs_per_negative_sample[i])
+                optimize_edge(head_p, tail_p, j, k, dim, c_move_other, n_neg_samples,
+                              rng_p+3*tid, n_vertices, a, b, gamma, alpha)
+                epoch_of_next_sample[i] += epochs_per_sample[i]
+                epoch_of_next_negative_sample[i] += n_neg_samples*epochs_per_negative_sample[i]
+        alpha = initial_alpha*(1.0-(float(epoch)/float(epochs)))
+        flush_progress_bar(epoch, epochs, verbose=verbose)
+    rng_state[:] = rng_states[0]
+    if verbose>0: print()
 
-                current = head_embedding[j]
-                other = tail_embedding[k]
+#=== Barnes-Hut t-SNE ===
+# Ref: L.J.P. van der Maaten. Accelerating t-SNE using Tree-Based Algorithms. (JMLR 2014)
+from cython.operator cimport dereference as deref
+from libc.math cimport log
+from libcpp.vector cimport vector
 
-                dist_squared = sum((current-other)**2)
+ctypedef np.float64_t DOUBLE
+ctypedef np.intp_t ITYPE
 
-                if dist_squared > 0.0:
-                    grad_coeff = -2.0 * a * b * pow(dist_squared, b-1.0)
-                    grad_coeff /= a*pow(dist_squared, b)+1.0
-                else:
-                    grad_coeff = 0.0
+cdef int ORTHTREE_MAX_DIM = 3
+cdef int ORTHTREE_MAX_DEPTH = 50
 
-                for d in range(dim):
-                    grad_d = clip(val=grad_coeff*(current[d]-other[d]), v_min=-4.0, v_max=4.0)
-                    current[d] += grad_d * alpha
-                    if move_other:
-                        other[d] += -grad_d * alpha
+cdef struct OrthNode:
+    # Quadtree (dim=2) / Octree (dim=3) node. Each node has 2^dim children.
+    double center[3]
+    double width[3]
+    double com[3]       # Center of mass.
+    double max_width
+    ITYPE count         # The number of points in this node.
+    ITYPE children[8]   # -1 means that the child is empty.
+    bint is_leaf
 
-                epoch_of_next_sample[i] += epochs_per_sample[i]
-                n_neg_samples = int( (epoch-epoch_of_next_negative_sample[i]) / epochs_per_negative_sample[i] )
-
-                for p in range(n_neg_samples):
-                    k = tau_rand_int(rng_state) % n_vertices
-                    other = tail_embedding[k]
-                    dist_squared = sum((current-other)**2)
-
-                    if dist_squared > 0.0:
-                        grad_coeff = 2.0 * gamma * b
-                        grad_coeff /= (0.001+dist_squared)*(a*pow(dist_squared, b) + 1)
-                    elif j == k:
-                        continue
-                    else:
-                        grad_coeff = 0.0
-
-                    for d in range(dim):
-                        if grad_coeff > 0.0:
-                            grad_d = clip(val=grad_coeff*(current[d]-other[d]), v_min=-4.0, v_max=4.0)
-                        else:
-                            grad_d = 4.0
-                        current[d] += grad_d * alpha
+cdef ITYPE build_orthtree(vector[OrthNode]* nodes, DOUBLE* Y, ITYPE* idx, ITYPE* buf,
+                          ITYPE start, ITYPE end, double* center, double* width,
+                          int dim, int depth) noexcept nogil:
+    """ Build the tree for the points `idx[start:end]` recursively, and return the index of the node. """
+    cdef OrthNode node
+    cdef ITYPE i, p, code, child, node_idx
+    cdef int d, c, n_children = 1 << dim
+    cdef ITYPE offsets[9]
+    cdef ITYPE starts[9]
+    cdef double child_center[3]
+    cdef double child_width[3]
 
-                epoch_of_next_negative_sample[i] += n_neg_samples*epochs_per_negative_sample[i]
-        alpha = initial_alpha*(1.0-(float(epoch)/float(epochs)))
-        flush_progress_bar(epoch, epochs, verbose=verbose)
-    if verbose>0: print
+    node.count = end-start
+    node.max_width = 0
+    for d in range(dim):
+        node.center[d] = center[d]
+        node.width[d] = width[d]
+        node.com[d] = 0
+        if width[d] > node.max_width:
+            node.max_width = width[d]
+    for i in range(start, end):
+        p = idx[i]
+        for d in range(dim):
+            node.com[d] += Y[p*dim+d]
+    for d in range(dim):
+        node.com[d] /= node.count
+    for c in range(8):
+        node.children[c] = -1
+    node.is_leaf = node.count == 1 or depth >= ORTHTREE_MAX_DEPTH
+    node_idx = deref(nodes).size()
+    nodes.push_back(node)
+    if node.is_leaf:
+        return node_idx
+
+    # Counting sort by the orthant.
+    for c in range(n_children+1):
+        offsets[c] = 0
+    for i in range(start, end):
+        p = idx[i]
+        code = 0
+        for d in range(dim):
+            if Y[p*dim+d] > center[d]:
+                code |= (1 << d)
+        offsets[code+1] += 1
+    offsets[0] = start
+    for c in range(n_children):
+        offsets[c+1] += offsets[c]
+        starts[c] = offsets[c]
+    starts[n_children] = end
+    for i in range(start, end):
+        p = idx[i]
+        code = 0
+        for d in range(dim):
+            if Y[p*dim+d] > center[d]:
+                code |= (1 << d)
+        buf[offsets[code]] = p
+        offsets[code] += 1
+    for i in range(start, end):
+        idx[i] = buf[i]
+
+    for c in range(n_children):
+        if starts[c+1] > starts[c]:
+            for d in range(dim):
+                child_width[d] = width[d]/2
+                child_center[d] = center[d] + (width[d]/4 if c & (1 << d) else -width[d]/4)
+            child = build_orthtree(nodes, Y, idx, buf, starts[c], starts[c+1], child_center, child_width, dim, depth+1)
+            deref(nodes)[node_idx].children[c] = child
+    return node_idx
+
+cdef void compute_repulsive_forces(OrthNode* nodes, ITYPE node_idx, DOUBLE* yi, int dim, double theta2,
+                                   DOUBLE* neg_f, DOUBLE* sum_Q) noexcept nogil:
+    """ Approximate sum_j q_ij^2 Z^2 (yi-yj) and sum_j q_ij Z by summarizing the far cells.
+    (q_ij Z = (1+||yi-yj||^2)^{-1}) """
+    cdef OrthNode* node = &nodes[node_idx]
+    cdef double d2 = 0, diff, q, mult
+    cdef int d, c
+    for d in range(dim):
+        diff = yi[d] - node.com[d]
+        d2 += diff*diff
+    # The point itself (or its duplicates.)
+    if node.is_leaf and d2 < 1e-12:
+        return
+    if node.is_leaf or node.max_width*node.max_width < theta2*d2:
+        q = 1.0 / (1.0+d2)
+        sum_Q[0] += node.count*q
+        mult = node.count*q*q
+        for d in range(dim):
+            neg_f[d] += mult*(yi[d]-node.com[d])
+    else:
+        for c in range(1 << dim):
+            if node.children[c] >= 0:
+                compute_repulsive_forces(nodes, node.children[c], yi, dim, theta2, neg_f, sum_Q)
+
+def bh_tsne_gradient(
+        np.ndarray[DOUBLE, ndim=2, mode='c'] Y,
+        np.ndarray[DOUBLE, ndim=1, mode='c'] P_data,
+        np.ndarray[ITYPE,  ndim=1, mode='c'] P_indices,
+        np.ndarray[ITYPE,  ndim=1, mode='c'] P_indptr,
+        double theta=0.5, int n_jobs=1):
+    """ Barnes-Hut approximation of the t-SNE gradient. O(N log N)
+    dC/dyi ∝ Σj pij qij Z (yi-yj) - Σj qij^2 Z (yi-yj)
+    ~~~
+    @params Y         : Embeddings. shape=(n_samples, n_components) (n_components <= 3)
+    @params P_data    : Joint probabilities in the CSR format.
+    @params P_indices : ith data's neighbors are P_indices[P_indptr[i]:P_indptr[i+1]]
+    @params P_indptr  : shape=(n_samples+1,)
+    @params theta     : Trade-off between speed and accuracy. (0 means the exact computation.)
+    @params n_jobs    : The number of OpenMP threads.
+    @return grad      : shape=(n_samples, n_components)
+    @return kl        : KL(P||Q) over the non-zero elements of P.
+    """
+    cdef ITYPE n_samples = Y.shape[0]
+    cdef int dim = Y.shape[1]
+    if dim > ORTHTREE_MAX_DIM:
+        raise ValueError(f"Barnes-Hut t-SNE only supports n_components <= {ORTHTREE_MAX_DIM}, but got {dim}.")
+    cdef ITYPE i, j, k
+    cdef int d
+    cdef double center[3]
+    cdef double width[3]
+    cdef double q, d2, diff, pij, Z
+    cdef double theta2 = theta*theta
+    cdef DOUBLE* Y_p = <DOUBLE*>Y.data
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] mins = Y.min(axis=0)
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] maxs = Y.max(axis=0)
+    for d in range(dim):
+        center[d] = (mins[d]+maxs[d])/2
+        width[d] = (maxs[d]-mins[d])*(1+1e-3) + 1e-3
+
+    cdef np.ndarray[ITYPE, ndim=1, mode='c'] idx = np.arange(n_samples, dtype=np.intp)
+    cdef np.ndarray[ITYPE, ndim=1, mode='c'] buf = np.empty(n_samples, dtype=np.intp)
+    cdef vector[OrthNode] nodes
+    nodes.reserve(2*n_samples)
+    with nogil:
+        build_orthtree(&nodes, Y_p, <ITYPE*>idx.data, <ITYPE*>buf.data, 0, n_samples, center, width, dim, 0)
+
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] neg_f = np.zeros((n_samples, dim), dtype=np.float64)
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] pos_f = np.zeros((n_samples, dim), dtype=np.float64)
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] sum_Q = np.zeros(n_samples, dtype=np.float64)
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] kl = np.zeros(n_samples, dtype=np.float64)
+    cdef DOUBLE* neg_f_p = <DOUBLE*>neg_f.data
+    cdef DOUBLE* pos_f_p = <DOUBLE*>pos_f.data
+    cdef DOUBLE* sum_Q_p = <DOUBLE*>sum_Q.data
+    cdef DOUBLE* kl_p = <DOUBLE*>kl.data
+    cdef OrthNode* nodes_p = nodes.data()
+
+    # Repulsive forces (approximated by the tree.)
+    for i in prange(n_samples, nogil=True, schedule='dynamic', num_threads=n_jobs):
+        compute_repulsive_forces(nodes_p, 0, Y_p+i*dim, dim, theta2, neg_f_p+i*dim, sum_Q_p+i)
+    Z = max(sum_Q.sum(), 1e-12)
+
+    # Attractive forces (sparse P.)
+    for i in prange(n_samples, nogil=True, schedule='static', num_threads=n_jobs):
+        for k in range(P_indptr[i], P_indptr[i+1]):
+            j = P_indices[k]
+            pij = P_data[k]
+            d2 = 0
+            for d in range(dim):
+                diff = Y_p[i*dim+d] - Y_p[j*dim+d]
+                d2 = d2 + diff*diff
+            q = 1.0 / (1.0+d2)
+            for d in range(dim):
+                pos_f_p[i*dim+d] += pij*q*(Y_p[i*dim+d] - Y_p[j*dim+d])
+            if pij > 0:
+                kl_p[i] += pij*log(pij / max(q/Z, 1e-12))
+
+    return pos_f - neg_f/Z, kl.sum()
+
+#=== Perplexity calibration ===
+from libc.math cimport exp, fabs
+
+def binary_search_perplexity(
+        np.ndarray[DOUBLE, ndim=2, mode='c'] D,
+        double perplexity, double tol=1e-5, int max_iter=50, int n_jobs=1):
+    """ Binary search for the precisions (beta) of all rows in parallel,
+    so that each conditional Gaussian has the same perplexity.
+    ~~~
+    @params D          : Squared distances to the nearest neighbors. shape=(n_samples, n_neighbors)
+    @params perplexity : The target perplexity.
+    @params tol        : The tolerance of |log(Perp(Pi)) - log(perplexity)|
+    @params max_iter   : The maximum number of bisection steps for each row.
+    @params n_jobs     : The number of OpenMP threads.
+    @return P          : P[i,k] means that p_{k-th neighbor|i}. shape=(n_samples, n_neighbors)
+    @return beta       : 1/2 * precision = 1/(2*sigma^2). shape=(n_samples,)
+    --------------------
+    log(Perp(Pi)) = log(Σj exp(-beta*Dij)) + beta * Σj pj|i Dij
+    (Distances are shifted by min_j Dij to avoid underflow, which does not change Pi.)
+    """
+    cdef ITYPE n_samples = D.shape[0]
+    cdef ITYPE n_neighbors = D.shape[1]
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] P = np.zeros((n_samples, n_neighbors), dtype=np.float64)
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] beta = np.ones(n_samples, dtype=np.float64)
+    cdef DOUBLE* D_p = <DOUBLE*>D.data
+    cdef DOUBLE* P_p = <DOUBLE*>P.data
+    cdef DOUBLE* beta_p = <DOUBLE*>beta.data
+    cdef double goal_log_perp = log(perplexity)
+    cdef ITYPE i, k
+    cdef int it
+    cdef double b, bmin, bmax, d_min, sum_P, sum_DP, log_perp, diff
+
+    for i in prange(n_samples, nogil=True, schedule='static', num_threads=n_jobs):
+        d_min = INFINITY
+        for k in range(n_neighbors):
+            if D_p[i*n_neighbors+k] < d_min:
+                d_min = D_p[i*n_neighbors+k]
+        b = 1.0
+        bmin = -INFINITY
+        bmax = INFINITY
+        for it in range(max_iter+1):
+            sum_P = 0.0
+            sum_DP = 0.0
+            for k in range(n_neighbors):
+                P_p[i*n_neighbors+k] = exp(-(D_p[i*n_neighbors+k]-d_min)*b)
+                sum_P = sum_P + P_p[i*n_neighbors+k]
+                sum_DP = sum_DP + (D_p[i*n_neighbors+k]-d_min)*P_p[i*n_neighbors+k]
+            log_perp = log(sum_P) + b*sum_DP/sum_P
+            diff = log_perp - goal_log_perp
+            if fabs(diff) < tol or it == max_iter:
+                break
+            # Binary Search
+            if diff > 0:
+                # current Perp > goal Prep → increase the precision
+                bmin = b
+                if bmax == INFINITY:
+                    b = b*2
+                else:
+                    b = (b+bmax)/2
+            else:
+                bmax = b
+                if bmin == -INFINITY:
+                    b = b/2
+                else:
+                    b = (b+bmin)/2
+        for k in range(n_neighbors):
+            P_p[i*n_neighbors+k] = P_p[i*n_neighbors+k] / sum_P
+        beta_p[i] = b
+    return P, beta
@@ -0,0 +1,72 @@
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+
+# Ref: J. Friedman, T. Hastie, R. Tibshirani. Regularization Paths for Generalized Linear Models via Coordinate Descent. (JSS 2010)
+import numpy as np
+cimport numpy as np
+from libc.math cimport fabs
+
+ctypedef np.float64_t DOUBLE
+ctypedef np.intp_t ITYPE
+
+cdef inline double soft_threshold(double x, double c) noexcept nogil:
+    if x > c:
+        return x - c
+    elif x < -c:
+        return x + c
+    return 0.
+
+def enet_coordinate_descent_gram(np.ndarray[DOUBLE, ndim=1, mode='c'] w,
+                                 np.ndarray[DOUBLE, ndim=2, mode='c'] G,
+                                 np.ndarray[DOUBLE, ndim=1, mode='c'] c,
+                                 np.ndarray[DOUBLE, ndim=1, mode='c'] Gw,
+                                 np.ndarray[ITYPE, ndim=1, mode='c'] active,
+                                 double l1_reg, double l2_reg, int max_iter=1000, double tol=1e-7):
+    """ Coordinate descent for the elastic net with the precomputed Gram matrix.
+    min_w 1/2 w^TGw - c^Tw + l1_reg||w||_1 + l2_reg/2 ||w||^2   (G = Φ^TΦ, c = Φ^Ty)
+    Only the coordinates in `active` are updated. `w` and `Gw` (= G@w) are updated inplace.
+    ~~~
+    @params w       : Coefficients. (Warm start) shape=(M,)
+    @params G       : Gram matrix Φ^TΦ. shape=(M,M)
+    @params c       : Φ^Ty. shape=(M,)
+    @params Gw      : G@w. shape=(M,)
+    @params active  : Indices of the coordinates to be updated. shape=(n_active,)
+    @params max_iter: The maximum number of sweeps over the active coordinates.
+    @params tol     : Stop when the maximal coordinate update is less than tol.
+    @return n_iter  : The number of sweeps.
+    """
+    cdef ITYPE M = w.shape[0]
+    cdef ITYPE n_active = active.shape[0]
+    cdef DOUBLE* w_p = <DOUBLE*>w.data
+    cdef DOUBLE* G_p = <DOUBLE*>G.data
+    cdef DOUBLE* c_p = <DOUBLE*>c.data
+    cdef DOUBLE* Gw_p = <DOUBLE*>Gw.data
+    cdef ITYPE* act_p = <ITYPE*>active.data
+    cdef ITYPE p, j, k
+    cdef int it = 0
+    cdef double w_old, w_new, delta, max_delta, rho
+    cdef DOUBLE* G_j
+
+    with nogil:
+        for it in range(max_iter):
+            max_delta = 0.
+            for p in range(n_active):
+                j = act_p[p]
+                G_j = G_p + j*M
+                if G_j[j] == 0:
+                    continue
+                w_old = w_p[j]
+                # Partial residual correlation excluding the jth coordinate.
+                rho = c_p[j] - Gw_p[j] + G_j[j]*w_old
+                w_new = soft_threshold(rho, l1_reg) / (G_j[j] + l2_reg)
+                delta = w_new - w_old
+                if delta != 0.:
+                    w_p[j] = w_new
+                    for k in range(M):
+                        Gw_p[k] += delta*G_j[k]
+                    if fabs(delta) > max_delta:
+                        max_delta = fabs(delta)
+            if max_delta < tol:
+                break
+    return it+1
@@ -0,0 +1,608 @@
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+
+# Ref: https://github.com/scikit-learn/scikit-learn/blob/95d4f0841d57e8b5f6b2a570312e9d832e69debc/sklearn/neighbors/_binary_tree.pxi
+import numpy as np
+cimport numpy as np
+cimport cython
+
+from cython.parallel cimport prange
+from libc.math cimport sqrt, log2, fabs, INFINITY
+
+ctypedef np.float64_t DOUBLE
+ctypedef np.intp_t ITYPE
+
+cdef int KD_TREE   = 0
+cdef int BALL_TREE = 1
+
+cdef struct TreeData:
+    DOUBLE* data          # shape=(n_samples, n_features)
+    ITYPE*  idx_array     # shape=(n_samples,)
+    ITYPE*  node_start    # shape=(n_nodes,)
+    ITYPE*  node_end      # shape=(n_nodes,)
+    ITYPE*  node_is_leaf  # shape=(n_nodes,)
+    DOUBLE* node_bounds   # KD: shape=(2, n_nodes, n_features), BALL: centroids shape=(n_nodes, n_features)
+    DOUBLE* node_radius   # BALL: shape=(n_nodes,)
+    ITYPE   n_features
+    ITYPE   n_nodes
+    int     kind
+
+cdef inline DOUBLE rdist(DOUBLE* x, DOUBLE* y, ITYPE n_features) noexcept nogil:
+    """ Reduced distance (squared euclidean distance) between `x` and `y`. """
+    cdef DOUBLE d, result = 0
+    cdef ITYPE j
+    for j in range(n_features):
+        d = x[j]-y[j]
+        result += d*d
+    return result
+
+cdef inline DOUBLE min_rdist(TreeData* tree, ITYPE i_node, DOUBLE* pt) noexcept nogil:
+    """ Lower bound of the reduced distance between `pt` and any point in the node. """
+    cdef ITYPE j, nf = tree.n_features
+    cdef DOUBLE d, lo, hi, result = 0
+    if tree.kind == KD_TREE:
+        for j in range(nf):
+            lo = tree.node_bounds[i_node*nf + j] - pt[j]
+            hi = pt[j] - tree.node_bounds[(tree.n_nodes + i_node)*nf + j]
+            # Only one of (lo, hi) can be positive.
+            d = 0.5*((lo + fabs(lo)) + (hi + fabs(hi)))
+            result += d*d
+        return result
+    else:
+        d = sqrt(rdist(pt, tree.node_bounds + i_node*nf, nf)) - tree.node_radius[i_node]
+        return d*d if d > 0 else 0.0
+
+cdef inline DOUBLE max_rdist(TreeData* tree, ITYPE i_node, DOUBLE* pt) noexcept nogil:
+    """ Upper bound of the reduced distance between `pt` and any point in the node. """
+    cdef ITYPE j, nf = tree.n_features
+    cdef DOUBLE d, lo, hi, result = 0
+    if tree.kind == KD_TREE:
+        for j in range(nf):
+            lo = fabs(pt[j] - tree.node_bounds[i_node*nf + j])
+            hi = fabs(pt[j] - tree.node_bounds[(tree.n_nodes + i_node)*nf + j])
+            d = lo if lo > hi else hi
+            result += d*d
+        return result
+    else:
+        d = sqrt(rdist(pt, tree.node_bounds + i_node*nf, nf)) + tree.node_radius[i_node]
+        return d*d
+
+#=== Fixed size max-heap to keep the k nearest neighbors. ===
+cdef inline void heap_push(DOUBLE* dists, ITYPE* idxes, ITYPE size, DOUBLE val, ITYPE i_val) noexcept nogil:
+    """ Replace the largest element (root) with `val` and sift it down. """
+    cdef ITYPE i = 0, ic1, ic2, i_swap
+    if val >= dists[0]:
+        return
+    dists[0] = val
+    idxes[0] = i_val
+    while True:
+        ic1 = 2*i + 1
+        ic2 = ic1 + 1
+        if ic1 >= size:
+            break
+        elif ic2 >= size:
+            if dists[ic1] > val:
+                i_swap = ic1
+            else:
+                break
+        elif dists[ic1] >= dists[ic2]:
+            if val < dists[ic1]:
+                i_swap = ic1
+            else:
+                break
+        else:
+            if val < dists[ic2]:
+                i_swap = ic2
+            else:
+                break
+        dists[i] = dists[i_swap]
+        idxes[i] = idxes[i_swap]
+        i = i_swap
+    dists[i] = val
+    idxes[i] = i_val
+
+cdef inline void sift_down(DOUBLE* dists, ITYPE* idxes, ITYPE root, ITYPE size) noexcept nogil:
+    cdef ITYPE child
+    cdef DOUBLE tmp_d
+    cdef ITYPE tmp_i
+    while 2*root + 1 < size:
+        child = 2*root + 1
+        if child+1 < size and dists[child+1] > dists[child]:
+            child += 1
+        if dists[root] >= dists[child]:
+            break
+        tmp_d = dists[root]; dists[root] = dists[child]; dists[child] = tmp_d
+        tmp_i = idxes[root]; idxes[root] = idxes[child]; idxes[child] = tmp_i
+        root = child
+
+cdef inline void heap_sort(DOUBLE* dists, ITYPE* idxes, ITYPE size) noexcept nogil:
+    """ Sort the max-heap in ascending order inplace. """
+    cdef ITYPE end
+    cdef DOUBLE tmp_d
+    cdef ITYPE tmp_i
+    for end in range(size-1, 0, -1):
+        tmp_d = dists[0]; dists[0] = dists[end]; dists[end] = tmp_d
+        tmp_i = idxes[0]; idxes[0] = idxes[end]; idxes[end] = tmp_i
+        sift_down(dists, idxes, 0, end)
+
+#=== Recursive queries. ===
+cdef void query_recursive(TreeData* tree, ITYPE i_node, DOUBLE* pt, ITYPE k,
+                          DOUBLE* dists, ITYPE* idxes, DOUBLE rdist_LB) noexcept nogil:
+    """ Depth-first search which visits the closer child first. """
+    cdef ITYPE i, i1, i2, nf = tree.n_features
+    cdef DOUBLE d, rdist_LB_1, rdist_LB_2
+    if rdist_LB > dists[0]:
+        return
+    if tree.node_is_leaf[i_node]:
+        for i in range(tree.node_start[i_node], tree.node_end[i_node]):
+            d = rdist(pt, tree.data + tree.idx_array[i]*nf, nf)
+            if d < dists[0]:
+                heap_push(dists, idxes, k, d, tree.idx_array[i])
+    else:
+        i1 = 2*i_node + 1
+        i2 = i1 + 1
+        rdist_LB_1 = min_rdist(tree, i1, pt)
+        rdist_LB_2 = min_rdist(tree, i2, pt)
+        if rdist_LB_1 <= rdist_LB_2:
+            query_recursive(tree, i1, pt, k, dists, idxes, rdist_LB_1)
+            query_recursive(tree, i2, pt, k, dists, idxes, rdist_LB_2)
+        else:
+            query_recursive(tree, i2, pt, k, dists, idxes, rdist_LB_2)
+            query_recursive(tree, i1, pt, k, dists, idxes, rdist_LB_1)
+
+cdef ITYPE count_radius_recursive(TreeData* tree, ITYPE i_node, DOUBLE* pt, DOUBLE r2) noexcept nogil:
+    cdef ITYPE i, count = 0, nf = tree.n_features
+    if min_rdist(tree, i_node, pt) > r2:
+        return 0
+    if max_rdist(tree, i_node, pt) <= r2:
+        return tree.node_end[i_node] - tree.node_start[i_node]
+    if tree.node_is_leaf[i_node]:
+        for i in range(tree.node_start[i_node], tree.node_end[i_node]):
+            if rdist(pt, tree.data + tree.idx_array[i]*nf, nf) <= r2:
+                count += 1
+        return count
+    return count_radius_recursive(tree, 2*i_node+1, pt, r2) \
+         + count_radius_recursive(tree, 2*i_node+2, pt, r2)
+
+cdef ITYPE fill_radius_recursive(TreeData* tree, ITYPE i_node, DOUBLE* pt, DOUBLE r2,
+                                 ITYPE* idxes, DOUBLE* dists, ITYPE pos) noexcept nogil:
+    """ Write the neighbors within the radius from `pos`, and return the next position.
+    If `dists` is NULL, only the indices are written.
+    """
+    cdef ITYPE i, nf = tree.n_features
+    cdef DOUBLE d
+    cdef bint all_in
+    if min_rdist(tree, i_node, pt) > r2:
+        return pos
+    all_in = max_rdist(tree, i_node, pt) <= r2
+    if all_in or tree.node_is_leaf[i_node]:
+        for i in range(tree.node_start[i_node], tree.node_end[i_node]):
+            d = rdist(pt, tree.data + tree.idx_array[i]*nf, nf)
+            if all_in or d <= r2:
+                idxes[pos] = tree.idx_array[i]
+                if dists != NULL:
+                    dists[pos] = sqrt(d)
+                pos += 1
+        return pos
+    pos = fill_radius_recursive(tree, 2*i_node+1, pt, r2, idxes, dists, pos)
+    return fill_radius_recursive(tree, 2*i_node+2, pt, r2, idxes, dists, pos)
+
+cdef class BinaryTree:
+    """ Binary space partitioning tree for the euclidean nearest neighbor search.
+    The tree is stored as a complete binary tree in flat arrays
+    (children of the node `i` are `2i+1` and `2i+2`), and each node
+    has the bounds of its points. (kd_tree: bounding box, ball_tree: bounding ball)
+    ~~~
+    @params data      : shape=(n_samples, n_features)
+    @params leaf_size : (int) Each leaf node has between leaf_size and 2*leaf_size points.
+    @params kind      : (str) "kd_tree" or "ball_tree"
+    """
+    cdef readonly np.ndarray data
+    cdef readonly np.ndarray idx_array
+    cdef readonly np.ndarray node_start
+    cdef readonly np.ndarray node_end
+    cdef readonly np.ndarray node_is_leaf
+    cdef readonly np.ndarray node_bounds
+    cdef readonly np.ndarray node_radius
+    cdef readonly ITYPE leaf_size
+    cdef readonly ITYPE n_levels
+    cdef readonly ITYPE n_nodes
+    cdef TreeData tree
+
+    def __init__(self, np.ndarray[DOUBLE, ndim=2, mode='c'] data, ITYPE leaf_size=40, str kind="kd_tree"):
+        if kind not in ("kd_tree", "ball_tree"):
+            raise KeyError(f"Please chose the argment `kind` from 'kd_tree', 'ball_tree'.")
+        if leaf_size < 1:
+            raise ValueError("`leaf_size` must be greater than or equal to 1.")
+        cdef ITYPE n_samples = data.shape[0]
+        cdef ITYPE n_features = data.shape[1]
+        if n_samples == 0:
+            raise ValueError("`data` must have at least one sample.")
+
+        self.data = data
+        self.leaf_size = leaf_size
+        self.n_levels = int(log2(max(1.0, (n_samples-1)/<double>leaf_size))) + 1
+        self.n_nodes = (1 << self.n_levels) - 1
+
+        self.idx_array    = np.arange(n_samples, dtype=np.intp)
+        self.node_start   = np.zeros(self.n_nodes, dtype=np.intp)
+        self.node_end     = np.zeros(self.n_nodes, dtype=np.intp)
+        self.node_is_leaf = np.zeros(self.n_nodes, dtype=np.intp)
+        if kind == "kd_tree":
+            self.node_bounds = np.zeros((2, self.n_nodes, n_features), dtype=np.float64)
+            self.node_radius = np.zeros(0, dtype=np.float64)
+        else:
+            self.node_bounds = np.zeros((self.n_nodes, n_features), dtype=np.float64)
+            self.node_radius = np.zeros(self.n_nodes, dtype=np.float64)
+        self.tree.kind = KD_TREE if kind == "kd_tree" else BALL_TREE
+        self._recursive_build(0, 0, n_samples)
+
+        self.tree.data         = <DOUBLE*>self.data.data
+        self.tree.idx_array    = <ITYPE*>self.idx_array.data
+        self.tree.node_start   = <ITYPE*>self.node_start.data
+        self.tree.node_end     = <ITYPE*>self.node_end.data
+        self.tree.node_is_leaf = <ITYPE*>self.node_is_leaf.data
+        self.tree.node_bounds  = <DOUBLE*>self.node_bounds.data
+        self.tree.node_radius  = <DOUBLE*>self.node_radius.data
+        self.tree.n_features   = n_features
+        self.tree.n_nodes      = self.n_nodes
+
+    def _recursive_build(self, ITYPE i_node, ITYPE idx_start, ITYPE idx_end):
+        idxes = self.idx_array[idx_start:idx_end]
+        points = self.data[idxes]
+        self.node_start[i_node] = idx_start
+        self.node_end[i_node] = idx_end
+        if self.tree.kind == KD_TREE:
+            self.node_bounds[0, i_node] = points.min(axis=0)
+            self.node_bounds[1, i_node] = points.max(axis=0)
+        else:
+            centroid = points.mean(axis=0)
+            self.node_bounds[i_node] = centroid
+            self.node_radius[i_node] = np.sqrt(np.max(np.sum((points-centroid)**2, axis=1)))
+
+        if 2*i_node+1 >= self.n_nodes:
+            self.node_is_leaf[i_node] = True
+            return
+        # Split at the median of the dimension with the maximum spread.
+        split_dim = np.argmax(points.max(axis=0) - points.min(axis=0))
+        n_mid = (idx_end-idx_start)//2
+        self.idx_array[idx_start:idx_end] = idxes[np.argpartition(points[:, split_dim], n_mid)]
+        self._recursive_build(2*i_node+1, idx_start, idx_start+n_mid)
+        self._recursive_build(2*i_node+2, idx_start+n_mid, idx_end)
+
+    def query(self, np.ndarray[DOUBLE, ndim=2, mode='c'] X, ITYPE k=1, int n_jobs=1):
+        """ Find the `k` nearest neighbors of each query point.
+        @params X         : Query points. shape=(n_queries, n_features)
+        @params k         : (int) The number of neighbors.
+        @params n_jobs    : (int) The number of OpenMP threads.
+        @return distances : shape=(n_queries, k) sorted in ascending order.
+        @return indices   : shape=(n_queries, k)
+        """
+        if X.shape[1] != self.tree.n_features:
+            raise ValueError(f"query data dimension ({X.shape[1]}) must match training data dimension ({self.tree.n_features}).")
+        if k < 1 or k > self.data.shape[0]:
+            raise ValueError(f"`k` must be in [1, n_samples={self.data.shape[0]}], but got {k}.")
+        cdef ITYPE i, j, n_queries = X.shape[0]
+        cdef np.ndarray[DOUBLE, ndim=2, mode='c'] distances = np.full((n_queries, k), INFINITY, dtype=np.float64)
+        cdef np.ndarray[ITYPE, ndim=2, mode='c'] indices = np.full((n_queries, k), -1, dtype=np.intp)
+        cdef DOUBLE* X_p = <DOUBLE*>X.data
+        cdef DOUBLE* dist_p = <DOUBLE*>distances.data
+        cdef ITYPE* idx_p = <ITYPE*>indices.data
+        cdef TreeData* tree = &self.tree
+        cdef ITYPE nf = tree.n_features
+
+        for i in prange(n_queries, nogil=True, schedule='dynamic', num_threads=n_jobs):
+            query_recursive(tree, 0, X_p+i*nf, k, dist_p+i*k, idx_p+i*k, min_rdist(tree, 0, X_p+i*nf))
+            heap_sort(dist_p+i*k, idx_p+i*k, k)
+            for j in range(k):
+                dist_p[i*k+j] = sqrt(dist_p[i*k+j])
+        return distances, indices
+
+    def query_radius(self, np.ndarray[DOUBLE, ndim=2, mode='c'] X, DOUBLE r, bint return_distance=True, int n_jobs=1):
+        """ Find all neighbors within the radius `r` for each query point.
+        The results are returned in the CSR format, that is, the neighbors of `X[i]`
+        are `indices[indptr[i]:indptr[i+1]]`. (The order in each row is arbitrary.)
+        @params X               : Query points. shape=(n_queries, n_features)
+        @params r               : (float) Radius.
+        @params return_distance : (bool) If False, distances are not stored. (`distances` is None)
+        @params n_jobs          : (int) The number of OpenMP threads.
+        @return indptr          : shape=(n_queries+1,)
+        @return indices         : shape=(n_neighbors_total,)
+        @return distances       : shape=(n_neighbors_total,)
+        """
+        if X.shape[1] != self.tree.n_features:
+            raise ValueError(f"query data dimension ({X.shape[1]}) must match training data dimension ({self.tree.n_features}).")
+        cdef ITYPE i, n_queries = X.shape[0]
+        cdef DOUBLE r2 = r*r
+        cdef DOUBLE* X_p = <DOUBLE*>X.data
+        cdef TreeData* tree = &self.tree
+        cdef ITYPE nf = tree.n_features
+        cdef np.ndarray[ITYPE, ndim=1, mode='c'] counts = np.zeros(n_queries+1, dtype=np.intp)
+        cdef ITYPE* counts_p = <ITYPE*>counts.data
+
+        # 1st pass: count the neighbors to allocate the buffers.
+        for i in prange(n_queries, nogil=True, schedule='dynamic', num_threads=n_jobs):
+            counts_p[i+1] = count_radius_recursive(tree, 0, X_p+i*nf, r2)
+        cdef np.ndarray[ITYPE, ndim=1, mode='c'] indptr = np.cumsum(counts).astype(np.intp)
+        cdef ITYPE* indptr_p = <ITYPE*>indptr.data
+        cdef np.ndarray[ITYPE, ndim=1, mode='c'] indices = np.empty(indptr[n_queries], dtype=np.intp)
+        cdef np.ndarray[DOUBLE, ndim=1, mode='c'] distances = np.empty(indptr[n_queries] if return_distance else 0, dtype=np.float64)
+        cdef ITYPE* idx_p = <ITYPE*>indices.data
+        cdef DOUBLE* dist_p = <DOUBLE*>distances.data if return_distance else NULL
+
+        # 2nd pass: fill the neighbors.
+        for i in prange(n_queries, nogil=True, schedule='dynamic', num_threads=n_jobs):
+            fill_radius_recursive(tree, 0, X_p+i*nf, r2, idx_p, dist_p, indptr_p[i])
+        return indptr, indices, (distances if return_distance else None)
+
+#=== Approximate k nearest neighbor graph (RP-forest + NN-descent) ===
+# Ref: W. Dong, C. Moses, K. Li. Efficient k-nearest neighbor graph construction for generic similarity measures. (WWW 2011)
+#      https://github.com/lmcinnes/pynndescent
+from libcpp.vector cimport vector
+
+ctypedef np.uint64_t UINT64
+ctypedef np.uint8_t  UINT8
+
+cdef inline UINT64 rand_next(UINT64* state) noexcept nogil:
+    """ SplitMix64 pseudo-random number generator. """
+    cdef UINT64 z
+    state[0] += <UINT64>0x9E3779B97F4A7C15
+    z = state[0]
+    z = (z ^ (z >> 30)) * <UINT64>0xBF58476D1CE4E5B9
+    z = (z ^ (z >> 27)) * <UINT64>0x94D049BB133111EB
+    return z ^ (z >> 31)
+
+cdef inline DOUBLE rand_uniform(UINT64* state) noexcept nogil:
+    return (rand_next(state) >> 11) * (1.0/9007199254740992.0)
+
+cdef inline int flagged_heap_push(DOUBLE* dists, ITYPE* idxes, UINT8* flags, ITYPE size,
+                                  DOUBLE val, ITYPE i_val, UINT8 flag) noexcept nogil:
+    """ `heap_push` which rejects the duplicated index and also moves the `flags` (if not NULL).
+    @return 1 if `i_val` is newly pushed else 0.
+    """
+    cdef ITYPE i = 0, ic1, ic2, i_swap
+    if val >= dists[0]:
+        return 0
+    for i in range(size):
+        if idxes[i] == i_val:
+            return 0
+    i = 0
+    while True:
+        ic1 = 2*i + 1
+        ic2 = ic1 + 1
+        if ic1 >= size:
+            break
+        elif ic2 >= size:
+            if dists[ic1] > val:
+                i_swap = ic1
+            else:
+                break
+        elif dists[ic1] >= dists[ic2]:
+            if val < dists[ic1]:
+                i_swap = ic1
+            else:
+                break
+        else:
+            if val < dists[ic2]:
+                i_swap = ic2
+            else:
+                break
+        dists[i] = dists[i_swap]
+        idxes[i] = idxes[i_swap]
+        if flags != NULL:
+            flags[i] = flags[i_swap]
+        i = i_swap
+    dists[i] = val
+    idxes[i] = i_val
+    if flags != NULL:
+        flags[i] = flag
+    return 1
+
+cdef void build_rp_tree(DOUBLE* data, ITYPE n_samples, ITYPE n_features, ITYPE leaf_size,
+                        ITYPE* perm, ITYPE* leaf_start, ITYPE* leaf_end, DOUBLE* normal, UINT64* state) noexcept nogil:
+    """ Random projection tree. Each node is split by the hyperplane which is equidistant
+    from two randomly selected points. The points in the leaf containing `i` are
+    `perm[leaf_start[i]:leaf_end[i]]`.
+    """
+    cdef ITYPE i, j, start, end, size, mid, a, b, tmp
+    cdef DOUBLE offset, margin
+    cdef vector[ITYPE] stack
+    for i in range(n_samples):
+        perm[i] = i
+    stack.push_back(0)
+    stack.push_back(n_samples)
+    while stack.size() > 0:
+        end = stack.back(); stack.pop_back()
+        start = stack.back(); stack.pop_back()
+        size = end-start
+        if size <= leaf_size:
+            for i in range(start, end):
+                leaf_start[perm[i]] = start
+                leaf_end[perm[i]] = end
+            continue
+        a = perm[start + <ITYPE>(rand_next(state) % size)]
+        b = perm[start + <ITYPE>(rand_next(state) % size)]
+        offset = 0
+        for j in range(n_features):
+            normal[j] = data[a*n_features+j] - data[b*n_features+j]
+            offset += normal[j] * (data[a*n_features+j] + data[b*n_features+j]) / 2
+        # Partition perm[start:end] into the both sides of the hyperplane.
+        i = start; mid = end
+        while i < mid:
+            margin = -offset
+            for j in range(n_features):
+                margin += normal[j] * data[perm[i]*n_features+j]
+            if margin < 0 or (margin == 0 and rand_next(state) & 1):
+                i += 1
+            else:
+                mid -= 1
+                tmp = perm[i]; perm[i] = perm[mid]; perm[mid] = tmp
+        if mid == start or mid == end:
+            # All points are on the same side. (e.g. duplicated points)
+            mid = start + size//2
+        stack.push_back(start); stack.push_back(mid)
+        stack.push_back(mid);   stack.push_back(end)
+
+cdef void init_heap_row(DOUBLE* data, ITYPE n_samples, ITYPE n_features, ITYPE i, ITYPE k,
+                        ITYPE n_trees, ITYPE* perms, ITYPE* leaf_starts, ITYPE* leaf_ends,
+                        DOUBLE* dists, ITYPE* idxes, UINT8* flags, UINT64 seed) noexcept nogil:
+    """ Initialize the ith heap with the points in the same leaves (and random points if not enough.) """
+    cdef ITYPE t, p, j, it
+    cdef UINT64 state = seed ^ (<UINT64>i * <UINT64>0xD1B54A32D192ED03)
+    # The first neighbor is the data itself.
+    flagged_heap_push(dists, idxes, flags, k, 0., i, 0)
+    for t in range(n_trees):
+        for p in range(leaf_starts[t*n_samples+i], leaf_ends[t*n_samples+i]):
+            j = perms[t*n_samples+p]
+            if j != i:
+                flagged_heap_push(dists, idxes, flags, k, rdist(data+i*n_features, data+j*n_features, n_features), j, 1)
+    for it in range(3*k):
+        if dists[0] < INFINITY:
+            break
+        j = <ITYPE>(rand_next(&state) % <UINT64>n_samples)
+        flagged_heap_push(dists, idxes, flags, k, rdist(data+i*n_features, data+j*n_features, n_features), j, 1)
+
+cdef inline bint in_heap(ITYPE* idxes, ITYPE size, ITYPE i_val) noexcept nogil:
+    cdef ITYPE i
+    for i in range(size):
+        if idxes[i] == i_val:
+            return True
+    return False
+
+cdef ITYPE local_join_row(DOUBLE* data, ITYPE n_features, ITYPE i, ITYPE k, ITYPE n_candidates,
+                          ITYPE* new_cand, ITYPE* old_cand,
+                          DOUBLE* dists, ITYPE* idxes, UINT8* flags) noexcept nogil:
+    """ Pull style local join: try the neighbors of the ith candidates as the ith neighbors.
+    At least one of the two edges must be new, so (old, old) pairs are skipped.
+    Only the ith heap is updated, so the rows can be processed in parallel without locks.
+    (Points which are already in the heap are skipped before computing the distances.)
+    """
+    cdef ITYPE a, b, u, v, n_updates = 0
+    for a in range(n_candidates):
+        u = new_cand[i*n_candidates+a]
+        if u < 0: continue
+        for b in range(n_candidates):
+            v = new_cand[u*n_candidates+b]
+            if v >= 0 and v != i and not in_heap(idxes, k, v):
+                n_updates += flagged_heap_push(dists, idxes, flags, k, rdist(data+i*n_features, data+v*n_features, n_features), v, 1)
+            v = old_cand[u*n_candidates+b]
+            if v >= 0 and v != i and not in_heap(idxes, k, v):
+                n_updates += flagged_heap_push(dists, idxes, flags, k, rdist(data+i*n_features, data+v*n_features, n_features), v, 1)
+    for a in range(n_candidates):
+        u = old_cand[i*n_candidates+a]
+        if u < 0: continue
+        for b in range(n_candidates):
+            v = new_cand[u*n_candidates+b]
+            if v >= 0 and v != i and not in_heap(idxes, k, v):
+                n_updates += flagged_heap_push(dists, idxes, flags, k, rdist(data+i*n_features, data+v*n_features, n_features), v, 1)
+    return n_updates
+
+def nn_descent(np.ndarray[DOUBLE, ndim=2, mode='c'] data, ITYPE n_neighbors,
+               ITYPE n_trees=8, ITYPE leaf_size=30, int n_iters=10, ITYPE max_candidates=30,
+               double delta=0.001, UINT64 seed=0, int n_jobs=1, int verbose=0):
+    """ Approximate k nearest neighbor graph of `data` (euclidean).
+    1. The heaps are initialized by the leaves of the random projection forest.
+    2. NN-descent: "a neighbor of a neighbor is also likely to be a neighbor".
+       The graph is refined until the number of updates becomes less than `delta*n_samples*n_neighbors`.
+    ~~~
+    @params data           : shape=(n_samples, n_features)
+    @params n_neighbors    : (int) The number of neighbors. (Including the data itself.)
+    @params n_trees        : (int) The number of random projection trees.
+    @params leaf_size      : (int) The maximum number of points in each leaf.
+    @params n_iters        : (int) The maximum number of NN-descent iterations.
+    @params max_candidates : (int) The maximum number of candidates to be joined for each point.
+    @params delta          : (float) Early stopping threshold.
+    @params seed           : (int) Seed of the random number generator.
+    @params n_jobs         : (int) The number of OpenMP threads.
+    @return distances      : shape=(n_samples, n_neighbors) Each row is sorted in ascending order.
+    @return indices        : shape=(n_samples, n_neighbors)
+    """
+    cdef ITYPE n_samples = data.shape[0]
+    cdef ITYPE n_features = data.shape[1]
+    cdef ITYPE k = n_neighbors
+    if k < 1 or k > n_samples:
+        raise ValueError(f"`n_neighbors` must be in [1, n_samples={n_samples}], but got {k}.")
+    cdef ITYPE C = max_candidates
+    cdef ITYPE i, j, m, t, a, n_updates
+    cdef int it
+    cdef DOUBLE pri
+    cdef UINT64 state = seed
+    cdef DOUBLE* data_p = <DOUBLE*>data.data
+
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] distances = np.full((n_samples, k), INFINITY, dtype=np.float64)
+    cdef np.ndarray[ITYPE,  ndim=2, mode='c'] indices = np.full((n_samples, k), -1, dtype=np.intp)
+    cdef np.ndarray[UINT8,  ndim=2, mode='c'] flags = np.zeros((n_samples, k), dtype=np.uint8)
+    cdef DOUBLE* dist_p = <DOUBLE*>distances.data
+    cdef ITYPE* idx_p = <ITYPE*>indices.data
+    cdef UINT8* flag_p = <UINT8*>flags.data
+
+    # 1. Random projection forest.
+    cdef np.ndarray[ITYPE,  ndim=2, mode='c'] perms = np.empty((n_trees, n_samples), dtype=np.intp)
+    cdef np.ndarray[ITYPE,  ndim=2, mode='c'] leaf_starts = np.empty((n_trees, n_samples), dtype=np.intp)
+    cdef np.ndarray[ITYPE,  ndim=2, mode='c'] leaf_ends = np.empty((n_trees, n_samples), dtype=np.intp)
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] normals = np.empty((n_trees, n_features), dtype=np.float64)
+    cdef np.ndarray[UINT64, ndim=1, mode='c'] states = np.empty(n_trees, dtype=np.uint64)
+    for t in range(n_trees):
+        states[t] = rand_next(&state)
+    cdef ITYPE* perms_p = <ITYPE*>perms.data
+    cdef ITYPE* starts_p = <ITYPE*>leaf_starts.data
+    cdef ITYPE* ends_p = <ITYPE*>leaf_ends.data
+    cdef DOUBLE* normals_p = <DOUBLE*>normals.data
+    cdef UINT64* states_p = <UINT64*>states.data
+    for t in prange(n_trees, nogil=True, schedule='dynamic', num_threads=n_jobs):
+        build_rp_tree(data_p, n_samples, n_features, leaf_size, perms_p+t*n_samples,
+                      starts_p+t*n_samples, ends_p+t*n_samples, normals_p+t*n_features, states_p+t)
+
+    cdef UINT64 init_seed = rand_next(&state)
+    for i in prange(n_samples, nogil=True, schedule='dynamic', num_threads=n_jobs):
+        init_heap_row(data_p, n_samples, n_features, i, k, n_trees, perms_p, starts_p, ends_p,
+                      dist_p+i*k, idx_p+i*k, flag_p+i*k, init_seed)
+    del perms, leaf_starts, leaf_ends
+
+    # 2. NN-descent.
+    cdef np.ndarray[ITYPE,  ndim=2, mode='c'] new_cand = np.empty((n_samples, C), dtype=np.intp)
+    cdef np.ndarray[ITYPE,  ndim=2, mode='c'] old_cand = np.empty((n_samples, C), dtype=np.intp)
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] new_pri = np.empty((n_samples, C), dtype=np.float64)
+    cdef np.ndarray[DOUBLE, ndim=2, mode='c'] old_pri = np.empty((n_samples, C), dtype=np.float64)
+    cdef ITYPE* new_p = <ITYPE*>new_cand.data
+    cdef ITYPE* old_p = <ITYPE*>old_cand.data
+    cdef DOUBLE* new_pri_p = <DOUBLE*>new_pri.data
+    cdef DOUBLE* old_pri_p = <DOUBLE*>old_pri.data
+    for it in range(n_iters):
+        new_cand.fill(-1); old_cand.fill(-1)
+        new_pri.fill(INFINITY); old_pri.fill(INFINITY)
+        # Sample at most `max_candidates` (reverse) neighbors by the random priorities.
+        with nogil:
+            for i in range(n_samples):
+                for m in range(k):
+                    j = idx_p[i*k+m]
+                    if j < 0 or j == i: continue
+                    pri = rand_uniform(&state)
+                    if flag_p[i*k+m]:
+                        flagged_heap_push(new_pri_p+i*C, new_p+i*C, NULL, C, pri, j, 0)
+                        flagged_heap_push(new_pri_p+j*C, new_p+j*C, NULL, C, pri, i, 0)
+                    else:
+                        flagged_heap_push(old_pri_p+i*C, old_p+i*C, NULL, C, pri, j, 0)
+                        flagged_heap_push(old_pri_p+j*C, old_p+j*C, NULL, C, pri, i, 0)
+        # The sampled new neighbors become old.
+        for i in prange(n_samples, nogil=True, schedule='static', num_threads=n_jobs):
+            for m in range(k):
+                if flag_p[i*k+m]:
+                    for a in range(C):
+                        if new_p[i*C+a] == idx_p[i*k+m]:
+                            flag_p[i*k+m] = 0
+                            break
+        n_updates = 0
+        for i in prange(n_samples, nogil=True, schedule='dynamic', num_threads=n_jobs):
+            n_updates += local_join_row(data_p, n_features, i, k, C, new_p, old_p,
+                                        dist_p+i*k, idx_p+i*k, flag_p+i*k)
+        if verbose>0: print(f"NN-descent iteration {it+1:>{len(str(n_iters))}}/{n_iters}: {n_updates} updates.")
+        if n_updates <= delta*n_samples*k:
+            break
+
+    for i in prange(n_samples, nogil=True, schedule='static', num_threads=n_jobs):
+        heap_sort(dist_p+i*k, idx_p+i*k, k)
+        for m in range(k):
+            dist_p[i*k+m] = sqrt(dist_p[i*k+m])
+    return distances, indices
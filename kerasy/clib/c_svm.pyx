@@ -0,0 +1,317 @@
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+
+# Ref: R.E. Fan, P.H. Chen, C.J. Lin. Working Set Selection Using Second Order Information for Training Support Vector Machines. (JMLR 2005)
+#      C.C. Chang, C.J. Lin. LIBSVM: A Library for Support Vector Machines. https://github.com/cjlin1/libsvm/blob/master/svm.cpp
+import numpy as np
+cimport numpy as np
+from libc.math cimport INFINITY
+from libc.string cimport memcpy
+
+from ..utils import flush_progress_bar
+
+ctypedef np.float64_t DOUBLE
+ctypedef np.intp_t ITYPE
+
+cdef double TAU = 1e-12
+
+cdef class LRUKernelCache:
+    """ Least Recently Used cache of the kernel rows K[i,:]
+    Only `n_slots` rows (determined by `cache_size` [MB]) are kept, so the memory is
+    O(n_slots·N) instead of O(N^2). The missing rows are computed by `get_row(i)`.
+    """
+    cdef object get_row
+    cdef readonly ITYPE n_samples, n_slots, n_hits, n_misses
+    cdef np.ndarray buffer         # shape=(n_slots, n_samples)
+    cdef np.ndarray slot_of        # slot_of[i] = slot which has the ith row. (-1 if not cached)
+    cdef np.ndarray owner          # owner[s] = index of the row in the slot s. (-1 if empty)
+    cdef np.ndarray prev, next     # Doubly linked list of the slots. (head = most recently used)
+    cdef ITYPE head, tail
+
+    def __init__(self, get_row, ITYPE n_samples, double cache_size=200):
+        self.get_row = get_row
+        self.n_samples = n_samples
+        self.n_slots = max(2, min(n_samples, <ITYPE>(cache_size*(1<<20) / (8.*n_samples))))
+        self.buffer = np.empty((self.n_slots, n_samples), dtype=np.float64)
+        self.slot_of = np.full(n_samples, -1, dtype=np.intp)
+        self.owner = np.full(self.n_slots, -1, dtype=np.intp)
+        self.prev = np.arange(-1, self.n_slots-1, dtype=np.intp)
+        self.next = np.arange(1, self.n_slots+1, dtype=np.intp)
+        self.next[self.n_slots-1] = -1
+        self.head = 0
+        self.tail = self.n_slots-1
+        self.n_hits = 0
+        self.n_misses = 0
+
+    cdef void move_to_head(self, ITYPE s):
+        cdef ITYPE* prev = <ITYPE*>self.prev.data
+        cdef ITYPE* next = <ITYPE*>self.next.data
+        if s == self.head:
+            return
+        # Unlink.
+        next[prev[s]] = next[s]
+        if next[s] >= 0:
+            prev[next[s]] = prev[s]
+        else:
+            self.tail = prev[s]
+        # Link at the head.
+        prev[s] = -1
+        next[s] = self.head
+        prev[self.head] = s
+        self.head = s
+
+    cdef DOUBLE* get(self, ITYPE i) except NULL:
+        cdef ITYPE* slot_of = <ITYPE*>self.slot_of.data
+        cdef ITYPE* owner = <ITYPE*>self.owner.data
+        cdef ITYPE s = slot_of[i]
+        cdef np.ndarray[DOUBLE, ndim=1, mode='c'] row
+        if s >= 0:
+            self.n_hits += 1
+        else:
+            self.n_misses += 1
+            # Evict the least recently used row.
+            s = self.tail
+            if owner[s] >= 0:
+                slot_of[owner[s]] = -1
+            row = np.ascontiguousarray(self.get_row(i), dtype=np.float64)
+            memcpy(<DOUBLE*>self.buffer.data + s*self.n_samples, <DOUBLE*>row.data, self.n_samples*sizeof(DOUBLE))
+            owner[s] = i
+            slot_of[i] = s
+        self.move_to_head(s)
+        return <DOUBLE*>self.buffer.data + s*self.n_samples
+
+cdef inline bint is_upper_bound(double a, double C) nogil:
+    return a >= C
+
+cdef inline bint is_lower_bound(double a) nogil:
+    return a <= 0
+
+cdef ITYPE shrink_active(ITYPE* active, ITYPE n_active, DOUBLE* alpha, DOUBLE* y, DOUBLE* G, double C,
+                        double Gmax1, double Gmax2) noexcept nogil:
+    """ Remove the bounded variables which are unlikely to change from the active set. (inplace) """
+    cdef ITYPE p, t, n_new = 0
+    cdef bint be_shrunk
+    for p in range(n_active):
+        t = active[p]
+        be_shrunk = False
+        if is_upper_bound(alpha[t], C):
+            be_shrunk = (-G[t] > Gmax1) if y[t] > 0 else (-G[t] > Gmax2)
+        elif is_lower_bound(alpha[t]):
+            be_shrunk = (G[t] > Gmax2) if y[t] > 0 else (G[t] > Gmax1)
+        if not be_shrunk:
+            active[n_new] = t
+            n_new += 1
+    return n_new
+
+cdef int reconstruct_gradient(LRUKernelCache cache, DOUBLE* alpha, DOUBLE* y, DOUBLE* G, DOUBLE* G_bar,
+                              double C, ITYPE n_active, ITYPE n_samples, np.uint8_t* is_active) except -1:
+    """ Recompute the gradients of the shrunk variables with G_bar (the contribution of the upper bounded variables.)
+    G[t] = G_bar[t] - 1 + Σ_{j: free} alpha[j] Q[j,t]
+    """
+    cdef ITYPE j, t
+    cdef DOUBLE* K_j
+    if n_active == n_samples:
+        return 0
+    for t in range(n_samples):
+        if not is_active[t]:
+            G[t] = G_bar[t] - 1.
+    for j in range(n_samples):
+        if not is_upper_bound(alpha[j], C) and not is_lower_bound(alpha[j]):
+            K_j = cache.get(j)
+            for t in range(n_samples):
+                if not is_active[t]:
+                    G[t] += alpha[j] * y[j] * y[t] * K_j[t]
+    return 0
+
+def smo(get_row, np.ndarray[DOUBLE, ndim=1, mode='c'] y, np.ndarray[DOUBLE, ndim=1, mode='c'] K_diag,
+        double C, double tol=1e-3, ITYPE max_iter=10000000, bint shrinking=True, double cache_size=200, int verbose=1,
+        LRUKernelCache kernel_cache=None):
+    """ Sequential Minimal Optimization for the dual problem of C-SVC.
+    min_a 1/2 a^TQa - e^Ta  s.t. y^Ta = 0, 0 <= a_i <= C  where Q[i,j] = y_i y_j K[i,j]
+    ~~~
+    @params get_row    : (callable) get_row(i) returns the ith row of the kernel matrix. shape=(n_samples,)
+    @params y          : Labels (+1 or -1). shape=(n_samples,)
+    @params K_diag     : Diagonal elements of the kernel matrix. shape=(n_samples,)
+    @params C          : (float) Upper bound of the Lagrange multipliers. (np.inf means the hard margin.)
+    @params tol        : (float) Stop when the maximal violation of the KKT conditions is less than `tol`.
+    @params max_iter   : (int) The maximum number of pair updates.
+    @params shrinking  : (bool) Whether to use the shrinking heuristics.
+    @params cache_size : (float) The size of the kernel cache [MB].
+    @params kernel_cache : (LRUKernelCache) If given, it is used instead of a new cache (`get_row` and `cache_size`
+                           are ignored), so that the problems with the same kernel matrix share the kernel rows.
+    @return alpha      : Lagrange multipliers. shape=(n_samples,)
+    @return b          : Bias. f(x) = Σ alpha_i y_i K(x_i, x) + b
+    @return n_iter     : The number of pair updates.
+    """
+    cdef ITYPE n_samples = y.shape[0]
+    cdef LRUKernelCache cache
+    if kernel_cache is None:
+        cache = LRUKernelCache(get_row, n_samples, cache_size=cache_size)
+    elif kernel_cache.n_samples != n_samples:
+        raise ValueError(f"The kernel cache has {kernel_cache.n_samples} samples, but y has {n_samples}.")
+    else:
+        cache = kernel_cache
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] alpha = np.zeros(n_samples, dtype=np.float64)
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] G = np.full(n_samples, -1., dtype=np.float64) # Q@alpha - e
+    cdef np.ndarray[DOUBLE, ndim=1, mode='c'] G_bar = np.zeros(n_samples, dtype=np.float64)
+    cdef np.ndarray[ITYPE, ndim=1, mode='c'] active = np.arange(n_samples, dtype=np.intp)
+    cdef np.ndarray[np.uint8_t, ndim=1, mode='c'] is_active = np.ones(n_samples, dtype=np.uint8)
+    cdef DOUBLE* a = <DOUBLE*>alpha.data
+    cdef DOUBLE* g = <DOUBLE*>G.data
+    cdef DOUBLE* g_bar = <DOUBLE*>G_bar.data
+    cdef DOUBLE* yp = <DOUBLE*>y.data
+    cdef DOUBLE* QD = <DOUBLE*>K_diag.data
+    cdef ITYPE* act = <ITYPE*>active.data
+    cdef np.uint8_t* is_act = <np.uint8_t*>is_active.data
+    cdef ITYPE n_active = n_samples
+    cdef ITYPE it = 0, counter = min(n_samples, 1000)+1, sweep = 0
+    cdef ITYPE i, j, t, p
+    cdef double Gmax, Gmax2, Gmin_obj, grad_diff, quad_coef, obj_diff, delta, diff, s
+    cdef double old_ai, old_aj, delta_ai, delta_aj
+    cdef bint unshrink = False, ui, uj
+    cdef DOUBLE* K_i
+    cdef DOUBLE* K_j
+    cdef ITYPE max_sweeps = max(1, (max_iter-1)//max(1, n_samples)+1)
+
+    while it < max_iter:
+        #=== Shrinking ===
+        counter -= 1
+        if counter == 0:
+            counter = min(n_samples, 1000)
+            if shrinking:
+                Gmax = -INFINITY; Gmax2 = -INFINITY
+                for p in range(n_active):
+                    t = act[p]
+                    if yp[t] > 0:
+                        if not is_upper_bound(a[t], C): Gmax  = max(Gmax, -g[t])
+                        if not is_lower_bound(a[t]):    Gmax2 = max(Gmax2, g[t])
+                    else:
+                        if not is_upper_bound(a[t], C): Gmax2 = max(Gmax2, -g[t])
+                        if not is_lower_bound(a[t]):    Gmax  = max(Gmax, g[t])
+                if not unshrink and Gmax+Gmax2 <= tol*10:
+                    # Close to the optimum. Unshrink once and recompute all gradients.
+                    unshrink = True
+                    reconstruct_gradient(cache, a, yp, g, g_bar, C, n_active, n_samples, is_act)
+                    active[:] = np.arange(n_samples)
+                    n_active = n_samples
+                n_active = shrink_active(act, n_active, a, yp, g, C, Gmax, Gmax2)
+                is_active.fill(0)
+                is_active[active[:n_active]] = 1
+
+        #=== Working Set Selection (2nd order) ===
+        i = -1; j = -1
+        Gmax = -INFINITY; Gmax2 = -INFINITY; Gmin_obj = INFINITY
+        for p in range(n_active):
+            t = act[p]
+            if yp[t] > 0:
+                if not is_upper_bound(a[t], C) and -g[t] >= Gmax:
+                    Gmax = -g[t]; i = t
+            else:
+                if not is_lower_bound(a[t]) and g[t] >= Gmax:
+                    Gmax = g[t]; i = t
+        if i >= 0:
+            K_i = cache.get(i)
+            for p in range(n_active):
+                t = act[p]
+                if yp[t] > 0:
+                    if not is_lower_bound(a[t]):
+                        grad_diff = Gmax + g[t]
+                        if g[t] >= Gmax2: Gmax2 = g[t]
+                        if grad_diff > 0:
+                            quad_coef = QD[i] + QD[t] - 2.0*K_i[t]
+                            obj_diff = -(grad_diff*grad_diff) / (quad_coef if quad_coef > 0 else TAU)
+                            if obj_diff <= Gmin_obj:
+                                j = t; Gmin_obj = obj_diff
+                else:
+                    if not is_upper_bound(a[t], C):
+                        grad_diff = Gmax - g[t]
+                        if -g[t] >= Gmax2: Gmax2 = -g[t]
+                        if grad_diff > 0:
+                            quad_coef = QD[i] + QD[t] - 2.0*K_i[t]
+                            obj_diff = -(grad_diff*grad_diff) / (quad_coef if quad_coef > 0 else TAU)
+                            if obj_diff <= Gmin_obj:
+                                j = t; Gmin_obj = obj_diff
+
+        if i < 0 or j < 0 or Gmax + Gmax2 < tol:
+            if n_active == n_samples:
+                break
+            # Optimal in the active set. Check the whole problem before shrinking again.
+            reconstruct_gradient(cache, a, yp, g, g_bar, C, n_active, n_samples, is_act)
+            active[:] = np.arange(n_samples)
+            n_active = n_samples
+            is_active.fill(1)
+            counter = min(n_samples, 1000)+1
+            continue
+
+        #=== Update alpha[i] and alpha[j] (analytically, with clipping.) ===
+        it += 1
+        K_i = cache.get(i)
+        K_j = cache.get(j)
+        old_ai = a[i]; old_aj = a[j]
+        if yp[i] != yp[j]:
+            quad_coef = QD[i] + QD[j] + 2*yp[i]*yp[j]*K_i[j]
+            if quad_coef <= 0: quad_coef = TAU
+            delta = (-g[i]-g[j]) / quad_coef
+            diff = a[i] - a[j]
+            a[i] += delta; a[j] += delta
+            if diff > 0:
+                if a[j] < 0: a[j] = 0; a[i] = diff
+            else:
+                if a[i] < 0: a[i] = 0; a[j] = -diff
+            if diff > 0:
+                if a[i] > C: a[i] = C; a[j] = C - diff
+            else:
+                if a[j] > C: a[j] = C; a[i] = C + diff
+        else:
+            quad_coef = QD[i] + QD[j] - 2*yp[i]*yp[j]*K_i[j]
+            if quad_coef <= 0: quad_coef = TAU
+            delta = (g[i]-g[j]) / quad_coef
+            s = a[i] + a[j]
+            a[i] -= delta; a[j] += delta
+            if s > C:
+                if a[i] > C: a[i] = C; a[j] = s - C
+                if a[j] > C: a[j] = C; a[i] = s - C
+            else:
+                if a[j] < 0: a[j] = 0; a[i] = s
+                if a[i] < 0: a[i] = 0; a[j] = s
+
+        #=== Update the gradients. ===
+        delta_ai = a[i] - old_ai
+        delta_aj = a[j] - old_aj
+        for p in range(n_active):
+            t = act[p]
+            g[t] += yp[t] * (yp[i]*K_i[t]*delta_ai + yp[j]*K_j[t]*delta_aj)
+        ui = is_upper_bound(old_ai, C)
+        if ui != is_upper_bound(a[i], C):
+            for t in range(n_samples):
+                g_bar[t] += (-C if ui else C) * yp[i]*yp[t]*K_i[t]
+        uj = is_upper_bound(old_aj, C)
+        if uj != is_upper_bound(a[j], C):
+            for t in range(n_samples):
+                g_bar[t] += (-C if uj else C) * yp[j]*yp[t]*K_j[t]
+
+        if it % n_samples == 0:
+            flush_progress_bar(sweep, max_sweeps, metrics={"KKT violation": Gmax+Gmax2, "cache hit rate": <double>cache.n_hits/max(1, cache.n_hits+cache.n_misses)}, verbose=verbose)
+            sweep += 1
+
+    if n_active < n_samples:
+        reconstruct_gradient(cache, a, yp, g, g_bar, C, n_active, n_samples, is_act)
+    if verbose>0 and sweep>0: print()
+
+    #=== Bias ===
+    cdef double ub = INFINITY, lb = -INFINITY, sum_free = 0, yG
+    cdef ITYPE n_free = 0
+    for t in range(n_samples):
+        yG = yp[t]*g[t]
+        if is_upper_bound(a[t], C):
+            if yp[t] < 0: ub = min(ub, yG)
+            else:         lb = max(lb, yG)
+        elif is_lower_bound(a[t]):
+            if yp[t] > 0: ub = min(ub, yG)
+            else:         lb = max(lb, yG)
+        else:
+            n_free += 1
+            sum_free += yG
+    cdef double rho = sum_free/n_free if n_free > 0 else (ub+lb)/2
+    return alpha, -rho, it
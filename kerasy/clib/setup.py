@@ -1,6 +1,7 @@
 """ It is necessary to include numpy's C head files. """
 # codin: utf-8
 import os
+import sys
 from pathlib import Path
 import numpy as np
 
@@ -19,6 +20,13 @@ def configuration(parent_package='', top_path=None):
     if os.name == 'posix':
         npymath_info['libraries'].append('m')
 
+    # OpenMP is used by `prange` (e.g. c_neighbors). Without it, loops run serially.
+    openmp_flags = []
+    if os.name == 'posix' and sys.platform != 'darwin':
+        openmp_flags.append('-fopenmp')
+    elif os.name == 'nt':
+        openmp_flags.append('/openmp')
+
     from numpy.distutils.misc_util import Configuration
     config = Configuration(
         package_name='clib',
@@ -34,6 +42,8 @@ def configuration(parent_package='', top_path=None):
             name=name,
             sources=[fn],
             language="c++",
+            extra_compile_args=openmp_flags,
+            extra_link_args=openmp_flags if os.name == 'posix' else [],
             **npymath_info,
         )
         print(f"* \033[34m{fn}\033[0m is compiled by Cython to \033[34m{name}.cpp\033[0m file.")
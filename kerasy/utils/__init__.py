@@ -16,6 +16,7 @@ from . import hash_utils
 from . import metric_utils
 from . import model_select_utils
 from . import monitor_utils
+from . import neighbor_utils
 from . import np_utils
 from . import param_utils
 from . import prepro_utils
@@ -52,6 +53,7 @@ from .generic_utils import measure_complexity
 from .generic_utils import has_all_attrs
 from .generic_utils import has_not_attrs
 from .generic_utils import handleRandomState
+from .generic_utils import handleNJobs
 from .generic_utils import fout_args
 from .generic_utils import format_spec_create
 from .generic_utils import print_func_create
@@ -83,6 +85,11 @@ from .monitor_utils import ConvergenceMonitor
 from .monitor_utils import ProgressMonitor
 from .monitor_utils import ThresholdMonitor
 
+from .neighbor_utils import KDTree
+from .neighbor_utils import BallTree
+from .neighbor_utils import build_neighbor_tree
+from .neighbor_utils import nn_descent
+
 from .np_utils import CategoricalEncoder
 from .np_utils import findLowerUpper
 from .np_utils import inverse_arr
@@ -91,6 +98,8 @@ from .np_utils import normalize
 from .np_utils import standardize
 from .np_utils import log_normalize
 from .np_utils import log_mask_zero
+from .np_utils import svd_flip
+from .np_utils import randomized_svd
 from .np_utils import log_multivariate_normal_density
 from .np_utils import compress_based_on_covariance_type_from_tied_shape
 from .np_utils import decompress_based_on_covariance_type
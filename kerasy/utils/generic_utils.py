@@ -149,6 +149,17 @@ def handleRandomState(seed):
         return np.random.RandomState(seed)
     raise ValueError(f"Could not conver {seed} to numpy.random.RandomState instance.")
 
+def handleNJobs(n_jobs):
+    """ Turn `n_jobs` into the positive number of workers. (Negative values count back from the number of CPUs.) """
+    n_cpus = os.cpu_count() or 1
+    if n_jobs is None:
+        return 1
+    if not isinstance(n_jobs, (int, np.integer)) or n_jobs == 0:
+        raise ValueError(f"`n_jobs` must be a non-zero integer, but got {n_jobs}.")
+    if n_jobs < 0:
+        return max(1, n_cpus + 1 + n_jobs)
+    return int(n_jobs)
+
 def fout_args(*args, sep="\t"):
     return sep.join([str(e) for e in args])+"\n"
 
@@ -4,6 +4,7 @@ from scipy.sparse import issparse
 
 from .generic_utils import handleKeyError
 from .np_utils import CategoricalEncoder
+from .training_utils import make_batches
 
 def norm_vectors(*args, axis=-1, squared=True):
     if squared:
@@ -20,16 +21,29 @@ def mean_squared_error(y_true, y_pred, sample_weight=None):
 def root_mean_squared_error(y_true, y_pred, sample_weight=None):
     return np.sqrt(mean_squared_error(y_true, y_pred, sample_weight=sample_weight))
 
-def silhouette_samples(X, labels, metric='euclidean'):
+def silhouette_samples(X, labels, metric='euclidean', batch_size=1000):
+    """ Compute the Silhouette Coefficient for each sample.
+    Distances are computed for `batch_size` rows at a time, so the memory is O(batch_size*N)
+    instead of the O(N^2) all-pairs distance matrix.
+    @params X          : shape=(N,D)
+    @params labels     : shape=(N,)
+    @params batch_size : (int) The number of rows of the distance matrix computed at once.
+    """
     encoder = CategoricalEncoder()
     labels = encoder.to_categorical(labels)
-    all_dists = pairwise_euclidean_distances(X)
-    cluster_mean_dists = np.asarray([np.mean(all_dists[labels==label], axis=0) for label in np.unique(labels)]).T
-    silhouette_scores = np.zeros(shape=(len(X)))
-    for i,(dists,cls) in enumerate(zip(cluster_mean_dists,labels)):
-        intra_dists = dists[cls]
-        extra_dists = np.delete(dists, cls).min()
-        silhouette_scores[i] = (extra_dists-intra_dists)/max(intra_dists,extra_dists)
+    n_samples = len(X)
+    # onehot[j,k] = 1/|C_k| if labels[j]==k else 0. → (dists@onehot)[i,k] = mean distances from i to C_k.
+    onehot = np.zeros(shape=(n_samples, labels.max()+1))
+    onehot[np.arange(n_samples), labels] = 1
+    onehot /= onehot.sum(axis=0, keepdims=True)
+    silhouette_scores = np.zeros(shape=(n_samples))
+    for start,end in make_batches(n_samples, batch_size):
+        cluster_mean_dists = pairwise_euclidean_distances(X[start:end], X).dot(onehot) # shape=(batch_size, n_clusters)
+        rows, cls = np.arange(end-start), labels[start:end]
+        intra_dists = np.copy(cluster_mean_dists[rows, cls])
+        cluster_mean_dists[rows, cls] = np.inf
+        extra_dists = cluster_mean_dists.min(axis=1)
+        silhouette_scores[start:end] = (extra_dists-intra_dists)/np.maximum(intra_dists,extra_dists)
 
     return silhouette_scores
 
@@ -0,0 +1,119 @@
+# coding: utf-8
+import numpy as np
+
+from .generic_utils import handleKeyError
+from .generic_utils import handleNJobs
+from .generic_utils import handleRandomState
+from ..clib import c_neighbors
+
+class BaseTree():
+    """ Spatial index for the euclidean nearest neighbor search.
+    Build: O(N log N), Query: roughly O(log N) per point for low dimensional data,
+    and no N×N distance matrix is created.
+    ~~~
+    @params X         : Data to be indexed. shape=(n_samples, n_features)
+    @params leaf_size : (int) Number of points at which to switch to brute-force.
+    """
+    kind = None
+    def __init__(self, X, leaf_size=40):
+        self.data = np.ascontiguousarray(X, dtype=np.float64)
+        if self.data.ndim != 2:
+            raise ValueError(f"X must be 2-dimensional array, but got X.shape={self.data.shape}")
+        self.leaf_size = leaf_size
+        self._tree = c_neighbors.BinaryTree(self.data, leaf_size=leaf_size, kind=self.kind)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def _check_query(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim == 1: X = X.reshape(1,-1)
+        return X
+
+    def query(self, X, k=1, return_distance=True, n_jobs=1):
+        """ Query the tree for the k nearest neighbors.
+        @params X               : Query points. shape=(n_queries, n_features)
+        @params k               : (int) The number of nearest neighbors. (If X is the indexed data itself, the first neighbor is the point itself.)
+        @params return_distance : (bool) Whether return the distances or not.
+        @params n_jobs          : (int) The number of threads. -1 means using all processors.
+        @return distances       : shape=(n_queries, k) Each row is sorted in ascending order.
+        @return indices         : shape=(n_queries, k)
+        """
+        distances, indices = self._tree.query(self._check_query(X), k=k, n_jobs=handleNJobs(n_jobs))
+        return (distances, indices) if return_distance else indices
+
+    def query_radius(self, X, r, return_distance=False, sort_results=False, n_jobs=1):
+        """ Query the tree for neighbors within a radius `r`.
+        The results are returned in the CSR format: neighbors of X[i] are indices[indptr[i]:indptr[i+1]]
+        @params X               : Query points. shape=(n_queries, n_features)
+        @params r               : (float) Distance within which neighbors are returned.
+        @params return_distance : (bool) Whether return the distances or not.
+        @params sort_results    : (bool) Whether sort the neighbors of each point by the distances or not.
+        @params n_jobs          : (int) The number of threads. -1 means using all processors.
+        @return indptr          : shape=(n_queries+1,)
+        @return indices         : shape=(indptr[-1],)
+        @return distances       : shape=(indptr[-1],)
+        """
+        indptr, indices, distances = self._tree.query_radius(
+            self._check_query(X), r=float(r), return_distance=return_distance or sort_results, n_jobs=handleNJobs(n_jobs)
+        )
+        if sort_results:
+            rows = np.repeat(np.arange(len(indptr)-1), np.diff(indptr))
+            order = np.lexsort((distances, rows))
+            indices, distances = indices[order], distances[order]
+        return (indptr, indices, distances) if return_distance else (indptr, indices)
+
+class KDTree(BaseTree):
+    """ KD-tree: each node is bounded by the axis-aligned bounding box. """
+    kind = "kd_tree"
+
+class BallTree(BaseTree):
+    """ Ball tree: each node is bounded by the hyper-sphere. (Better for higher dimensional data.) """
+    kind = "ball_tree"
+
+NEIGHBOR_TREES = {
+    "kd_tree"   : KDTree,
+    "ball_tree" : BallTree,
+}
+
+def build_neighbor_tree(X, algorithm="kd_tree", leaf_size=40):
+    """ Build the spatial index specified by `algorithm`. """
+    handleKeyError(list(NEIGHBOR_TREES.keys()), algorithm=algorithm)
+    return NEIGHBOR_TREES[algorithm](X, leaf_size=leaf_size)
+
+def nn_descent(X, n_neighbors, n_trees=None, leaf_size=None, n_iters=None, max_candidates=None, delta=0.001,
+               random_state=None, n_jobs=1, verbose=0):
+    """ Approximate k nearest neighbor graph by random projection forest + NN-descent.
+    Roughly O(N log N) and no N×N distance matrix is created, so this is the choice
+    for the large (or high dimensional) data, where the spatial indexes degrade to brute-force.
+    ~~~
+    @params X              : Data. shape=(n_samples, n_features)
+    @params n_neighbors    : (int) The number of neighbors. (Including the data itself, like `BaseTree.query(X)`)
+    @params n_trees        : (int) The number of random projection trees for the initialization.
+    @params leaf_size      : (int) The maximum number of points in each leaf.
+    @params n_iters        : (int) The maximum number of NN-descent iterations.
+    @params max_candidates : (int) The maximum number of candidates to be joined for each point.
+    @params delta          : (float) Stop when fewer than `delta*n_samples*n_neighbors` edges are updated.
+    ~~~ The larger `n_trees`, `n_iters`, `max_candidates` and the smaller `delta`, the higher recall (and the slower.)
+    @params random_state   : (int, RandomState)
+    @params n_jobs         : (int) The number of threads. -1 means using all processors.
+    @return distances      : shape=(n_samples, n_neighbors) Each row is sorted in ascending order.
+    @return indices        : shape=(n_samples, n_neighbors)
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    if X.ndim != 2:
+        raise ValueError(f"X must be 2-dimensional array, but got X.shape={X.shape}")
+    n_samples = X.shape[0]
+    if n_trees is None:
+        n_trees = min(16, 4 + int(round(np.sqrt(n_samples)/50)))
+    if leaf_size is None:
+        leaf_size = max(10, n_neighbors)
+    if n_iters is None:
+        n_iters = max(5, int(round(np.log2(n_samples))))
+    if max_candidates is None:
+        max_candidates = min(60, n_neighbors)
+    seed = handleRandomState(random_state).randint(np.iinfo(np.int32).max)
+    return c_neighbors.nn_descent(
+        X, n_neighbors=n_neighbors, n_trees=n_trees, leaf_size=leaf_size, n_iters=n_iters,
+        max_candidates=max_candidates, delta=delta, seed=seed, n_jobs=handleNJobs(n_jobs), verbose=verbose
+    )
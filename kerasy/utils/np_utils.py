@@ -4,6 +4,7 @@ from scipy import linalg
 from scipy.special import logsumexp
 
 from .generic_utils import handleKeyError
+from .generic_utils import handleRandomState
 
 class CategoricalEncoder():
     def __init__(self):
@@ -115,6 +116,49 @@ def log_mask_zero(arr):
     with np.errstate(divide="ignore"):
         return np.log(arr)
 
+def svd_flip(U, Vt):
+    """ Inplace Method
+    Flip the signs of the singular vectors so that the largest absolute value of each row of `Vt` is positive.
+    (The singular vectors are only determined up to the sign, so this makes the results deterministic.)
+    @params U  : shape=(M,K)
+    @params Vt : shape=(K,N)
+    """
+    signs = np.sign(Vt[np.arange(Vt.shape[0]), np.argmax(np.abs(Vt), axis=1)])
+    signs[signs==0] = 1
+    U *= signs
+    Vt *= signs[:,None]
+
+def randomized_svd(M, n_components, n_oversamples=10, n_iter="auto", random_state=None):
+    """ Truncated SVD by the randomized range finder. O(MN(k+p)) instead of O(MN min(M,N))
+    Ref: N. Halko, P.G. Martinsson, J.A. Tropp. Finding structure with randomness:
+         Probabilistic algorithms for constructing approximate matrix decompositions. (2011)
+    @params M             : shape=(n_rows, n_cols)
+    @params n_components  : (int) The number of singular values and vectors to extract. (k)
+    @params n_oversamples : (int) Additional random vectors to ensure the proper conditioning. (p)
+    @params n_iter        : (int) The number of power iterations. 'auto' means 7 if k < 0.1*min(M.shape) else 4.
+    @params random_state  : (int, RandomState)
+    @return U             : shape=(n_rows, n_components)
+    @return S             : shape=(n_components,) Sorted in descending order.
+    @return Vt            : shape=(n_components, n_cols)
+    """
+    rnd = handleRandomState(random_state)
+    n_random = n_components + n_oversamples
+    if n_iter == "auto":
+        n_iter = 7 if n_components < 0.1*min(M.shape) else 4
+    # Find the orthonormal matrix Q whose range approximates the range of M.
+    Q = M.dot(rnd.normal(size=(M.shape[1], n_random)))
+    for _ in range(n_iter):
+        # Normalize by QR at each step to keep the small singular values. (power iteration)
+        Q, _ = linalg.qr(Q, mode="economic")
+        Q, _ = linalg.qr(M.T.dot(Q), mode="economic")
+        Q = M.dot(Q)
+    Q, _ = linalg.qr(Q, mode="economic")
+    # SVD of the small matrix B = Q.T@M (shape=(k+p, n_cols))
+    Uhat, S, Vt = linalg.svd(Q.T.dot(M), full_matrices=False)
+    U = Q.dot(Uhat)
+    svd_flip(U, Vt)
+    return U[:,:n_components], S[:n_components], Vt[:n_components]
+
 # ref: https://github.com/hmmlearn/hmmlearn/blob/0e9274cb138427919c13ef79f11a7358c4e2b4a9/lib/hmmlearn/stats.py#L5
 def log_multivariate_normal_density(X, means, covars, covariance_type='diag', *args, **kwargs):
     """ Compute the log probability under a multivariate Gaussian distribution.
@@ -1,6 +1,8 @@
 # coding: utf-8
 
 # coding: utf-8
+import pytest
+import numpy as np
 from kerasy.ML.EM import KMeans, ElkanKMeans, HamerlyKMeans, MixedGaussian
 from kerasy.utils import generateWholeCakes
 from kerasy.utils import cluster_accuracy
@@ -44,3 +46,50 @@ def test_hamerly_kmeans():
 def test_mixed_gaussian():
     model = MixedGaussian(n_clusters=num_clusters, random_state=0)
     _test_EM(model)
+
+def test_mixed_gaussian_covariance_types():
+    for covariance_type in ["spherical", "diag", "tied", "full"]:
+        model = MixedGaussian(n_clusters=num_clusters, covariance_type=covariance_type, random_state=0)
+        _test_EM(model)
+
+def test_mixed_gaussian_partial_fit(batch_size=50, n_epochs=5):
+    x_train, y_train = get_test_data()
+    model = MixedGaussian(n_clusters=num_clusters, random_state=0)
+    rnd = np.random.RandomState(0)
+    for epoch in range(n_epochs):
+        idx = rnd.permutation(len(x_train))
+        for start in range(0, len(x_train), batch_size):
+            model.partial_fit(x_train[idx[start:start+batch_size]])
+    y_pred = model.predict(x_train)
+
+    assert cluster_accuracy(y_train, y_pred) > 0.75
+
+def test_mixed_gaussian_offset_data():
+    # Small variances on top of a large offset. (Raw moments lose all precision.)
+    rnd = np.random.RandomState(0)
+    X = 1e7 + 1e-2*rnd.randn(500, 2)
+    for covariance_type in ["spherical", "diag", "tied", "full"]:
+        model = MixedGaussian(n_clusters=1, covariance_type=covariance_type, min_covariances=0, random_state=0)
+        model.fit(X, max_iter=5, verbose=-1)
+        assert np.allclose(np.diagonal(model.S[0]), 1e-4, rtol=0.2)
+        model = MixedGaussian(n_clusters=1, covariance_type=covariance_type, min_covariances=0, random_state=0)
+        for start in range(0, len(X), 50):
+            model.partial_fit(X[start:start+50])
+        assert np.allclose(np.diagonal(model.S[0]), 1e-4, rtol=0.2)
+
+def test_mixed_gaussian_partial_fit_after_fit():
+    x_train, y_train = get_test_data()
+    model = MixedGaussian(n_clusters=num_clusters, random_state=0)
+    model.fit(x_train, max_iter=max_iter, verbose=-1)
+    centroids = model.centroids.copy()
+    model.partial_fit(x_train[:50])
+    # Continue from the fitted parameters instead of re-initializing.
+    assert np.allclose(model.centroids, centroids, atol=0.5)
+    assert cluster_accuracy(y_train, model.predict(x_train)) > 0.75
+
+def test_mixed_gaussian_partial_fit_small_first_batch():
+    x_train, _ = get_test_data()
+    model = MixedGaussian(n_clusters=num_clusters, random_state=0)
+    with pytest.raises(ValueError, match="at least n_clusters"):
+        model.partial_fit(x_train[:num_clusters-1])
+    model.partial_fit(x_train[:num_clusters])
@@ -13,6 +13,13 @@ def _test_kernel(kernel):
     val = kernel(x,y)
     assert isinstance(val, int) or isinstance(val, float)
 
+    X = np.random.RandomState(123).rand(7, 10)
+    K = kernel.gram(X, block_size=3)
+    assert K.shape == (7, 7)
+    assert np.allclose(K, [[kernel(xi,xj) for xj in X] for xi in X])
+    assert np.allclose(kernel.gram(X, x, n_jobs=2)[:,0], [kernel(xi,x) for xi in X])
+    assert np.allclose(kernel.diag(X), np.diag(K))
+
 def test_linear():
     Linear = _kernel.get("linear", c=0)
     _test_kernel(Linear)
@@ -52,3 +59,18 @@ def test_inverse_multiquadric():
 def test_log():
     Log = _kernel.get("log", d=3)
     _test_kernel(Log)
+
+def _test_kernel_approximation(approximation, kernel, atol):
+    X = np.random.RandomState(123).rand(50, 3)
+    approx = _kernel.get_approximation(approximation, kernel=kernel, n_components=1000, random_state=0)
+    Phi = approx.fit_transform(X)
+    assert Phi.shape[0] == 50
+    assert np.allclose(approx.diag(X), np.diag(approx.gram(X)))
+    assert np.allclose(approx.gram(X), kernel.gram(X), atol=atol)
+
+def test_nystroem():
+    _test_kernel_approximation("nystroem", _kernel.get("gaussian", sigma=1), atol=1e-6)
+
+def test_random_fourier_features():
+    _test_kernel_approximation("fourier", _kernel.get("gaussian", sigma=1), atol=0.2)
+    _test_kernel_approximation("fourier", _kernel.get("laplacian", sigma=1), atol=0.2)
@@ -1,6 +1,6 @@
 # coding: utf-8
 import numpy as np
-from kerasy.ML.boosting import L2Boosting
+from kerasy.ML.boosting import L2Boosting, HistGradientBoostingRegressor, HistGradientBoostingClassifier
 from kerasy.models import Sequential
 from kerasy.layers import Input, Dense
 from kerasy import metrics
@@ -84,3 +84,59 @@ def test_l2boosting():
     boosting_loss = metric.loss(y_boosting_pred, y_train)
 
     assert boosting_loss <= min(weak_model_losses)
+
+def test_hist_gradient_boosting():
+    rnd = np.random.RandomState(0)
+    x_train = rnd.randn(2000, 5)
+    y_train = np.sin(x_train[:,0]) + x_train[:,1]**2 + 0.1*rnd.randn(2000)
+    model = HistGradientBoostingRegressor(max_iter=50, max_leaf_nodes=15, max_bins=64)
+    model.fit(x_train, y_train, verbose=-1)
+    assert np.mean(np.square(model.predict(x_train) - y_train)) < 0.1*np.var(y_train)
+
+    y_train = (x_train[:,0] + x_train[:,1]**2 > 1).astype(int)
+    model = HistGradientBoostingClassifier(max_iter=50, max_leaf_nodes=15, max_bins=64)
+    model.fit(x_train, y_train, verbose=-1)
+    assert np.mean(model.predict(x_train) == y_train) >= 0.95
+    assert np.allclose(np.sum(model.predict_proba(x_train), axis=1), 1)
+
+class _ConstantModel():
+    """ Weak learner which counts the number of calls. """
+    def __init__(self, w):
+        self.w = w
+        self.num_calls = 0
+    def predict(self, X):
+        self.num_calls += 1
+        return X.dot(self.w)[:,None]
+
+def test_l2boosting_cached_H():
+    rnd = np.random.RandomState(0)
+    x_train = rnd.randn(200, 4)
+    y_train = x_train.dot([1.,2.,0.,0.])[:,None]
+    Models = [_ConstantModel(np.eye(4)[i]) for i in range(4)]
+    Masks = [Ellipsis, Ellipsis, Ellipsis, Ellipsis]
+    boosting = L2Boosting(Models, Masks)
+    boosting.fit(x_train, y_train, max_iter=1, n_jobs=2, verbose=-1)
+    boosting.fit(x_train, y_train, max_iter=20, verbose=-1)
+    # H is computed only once.
+    assert all(model.num_calls == 1 for model in Models)
+    assert np.allclose(boosting.predict(x_train, n_jobs=2), y_train, atol=0.1)
+    # The models with zero alpha are skipped.
+    assert boosting.alpha[2] == 0 and Models[2].num_calls == 1
+    assert Models[0].num_calls == 2
+
+def test_l2boosting_memmap_H(tmpdir):
+    rnd = np.random.RandomState(0)
+    x_train = rnd.randn(200, 4)
+    y_train = x_train.dot([1.,2.,0.,0.])[:,None]
+    memmap_path = str(tmpdir.join("H.npy"))
+    Models = [_ConstantModel(np.eye(4)[i]) for i in range(4)]
+    L2Boosting(Models, [Ellipsis]*4).fit(x_train, y_train, max_iter=20, memmap_path=memmap_path, verbose=-1)
+    # Another instance (e.g. another process) reuses the file.
+    boosting = L2Boosting(Models, [Ellipsis]*4)
+    boosting.fit(x_train, y_train, max_iter=20, memmap_path=memmap_path, verbose=-1)
+    H = boosting.compute_H(x_train, memmap_path=memmap_path)
+    assert isinstance(H, np.memmap) and H.mode == "r"
+    assert all(model.num_calls == 1 for model in Models)
+    # Different data overwrite the file.
+    boosting.fit(x_train+1, y_train, max_iter=20, memmap_path=memmap_path, verbose=-1)
+    assert all(model.num_calls == 2 for model in Models)
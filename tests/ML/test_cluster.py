@@ -1,5 +1,6 @@
 # coding: utf-8
-from kerasy.ML.cluster import DBSCAN
+import numpy as np
+from kerasy.ML.cluster import DBSCAN, dbscan_inner
 from kerasy.utils import generateWholeCakes
 from kerasy.utils import cluster_accuracy
 
@@ -24,3 +25,18 @@ def test_dbscan(target=0.75):
     model = DBSCAN(eps=1)
     y_pred = model.fit_predict(x_train, verbose=-1)
     assert cluster_accuracy(y_train, y_pred) > target
+
+def test_dbscan_ball_tree(target=0.75):
+    x_train, y_train = get_test_data()
+    model = DBSCAN(eps=1, algorithm="ball_tree", n_jobs=2)
+    y_pred = model.fit_predict(x_train, verbose=-1)
+    assert cluster_accuracy(y_train, y_pred) > target
+
+def test_dbscan_inner():
+    x_train, _ = get_test_data()
+    model = DBSCAN(eps=1)
+    model.fit(x_train, verbose=-1)
+    indptr, indices = model.neighborhoods(x_train, verbose=-1)
+    is_core = np.diff(indptr) >= model.min_samples
+    labels = dbscan_inner(is_core, np.split(indices, indptr[1:-1]), np.full(len(x_train), -1), verbose=-1)
+    assert np.all(labels == model.labels_)
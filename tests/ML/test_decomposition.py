@@ -1,6 +1,6 @@
 # coding: utf-8
 import numpy as np
-from kerasy.ML.decomposition import PCA, UMAP, tSNE
+from kerasy.ML.decomposition import PCA, IncrementalPCA, UMAP, tSNE
 from kerasy.datasets import mnist
 from kerasy.utils import cluster_accuracy
 
@@ -35,6 +35,28 @@ def test_pca():
     model = PCA(n_components=n_components)
     _test_decomposition(model)
 
+def test_pca_randomized():
+    model = PCA(n_components=n_components, svd_solver="randomized", random_state=seed)
+    _test_decomposition(model)
+
+def test_incremental_pca():
+    x_train, _ = get_test_data()
+    x_train = x_train.astype(float)
+    model = PCA(n_components=n_components)
+    model.fit(x_train)
+    incremental_model = IncrementalPCA(n_components=n_components, batch_size=num_mnist//3)
+    incremental_model.fit(x_train)
+    assert np.allclose(incremental_model.mean, model.mean)
+    assert np.allclose(incremental_model.explained_variance_[0], model.explained_variance_[0], rtol=1e-2)
+
+def test_incremental_pca_short_last_batch():
+    # n_samples % batch_size < n_components
+    x_train = np.random.RandomState(seed).randn(1005, 20)
+    incremental_model = IncrementalPCA(n_components=10, batch_size=100)
+    incremental_model.fit(x_train)
+    assert incremental_model.n_samples_seen_ == 1005
+    assert np.allclose(incremental_model.mean.ravel(), x_train.mean(axis=0))
+
 def test_tsne():
     model = tSNE(
         initial_momentum=0.5,
@@ -52,6 +74,25 @@ def test_tsne():
         verbose=1
     )
 
+def test_tsne_barnes_hut():
+    model = tSNE(
+        initial_momentum=0.5,
+        final_momoentum=0.8,
+        eta=500,
+        min_gain=0.1,
+        tol=1e-05,
+        prec_max_iter=50,
+        random_state=seed,
+        method="barnes_hut",
+        angle=0.5,
+    )
+    _test_decomposition(
+        model,
+        n_components=2,
+        epochs=epochs,
+        verbose=1
+    )
+
 def test_umap():
     model = UMAP(
         min_dist=0.1,
@@ -70,3 +111,47 @@ def test_umap():
         init_lr=1,
         verbose=-1
     )
+
+def test_tsne_perplexity_calibration():
+    perplexity = 10.
+    x_train, _ = get_test_data()
+    model = tSNE(tol=1e-05, prec_max_iter=100)
+    Pnn, neighbors = model.adjustPrecisionsNN(x_train.astype(float), perplexity)
+    assert np.allclose(np.sum(Pnn, axis=1), 1.)
+    logPerp = -np.sum(Pnn*np.log(np.maximum(Pnn, 1e-300)), axis=1)
+    assert np.allclose(logPerp, np.log(perplexity), atol=1e-4)
+
+def test_tsne_dense_perplexity_calibration():
+    perplexity = 10.
+    x_train = np.random.RandomState(seed).randn(200, 5)
+    P = tSNE(tol=1e-05, prec_max_iter=100).adjustPrecisions(x_train, perplexity)
+    assert np.all(np.diag(P) == 0)
+    assert np.allclose(np.sum(P, axis=1), 1.)
+    logPerp = -np.sum(P*np.log(np.maximum(P, 1e-300)), axis=1)
+    assert np.allclose(logPerp, np.log(perplexity), atol=1e-4)
+    # All pairs are taken into account. (Not only the 3*perplexity nearest neighbors.)
+    assert np.all(np.count_nonzero(P, axis=1) > 3*perplexity+1)
+
+def test_umap_nn_descent():
+    n_neighbors = 15
+    x_train, _ = get_test_data()
+    x_train = x_train.astype(float)
+    knn_dists, knn_indices = UMAP(algorithm="kd_tree")._nearest_neighbors(x_train, n_neighbors)
+    model = UMAP(algorithm="nn_descent", random_state=seed)
+    approx_dists, approx_indices = model._nearest_neighbors(x_train, n_neighbors)
+    recall = np.mean([len(np.intersect1d(e, a))/n_neighbors for e,a in zip(knn_indices, approx_indices)])
+    assert recall > 0.9
+    assert np.all(approx_indices[:,0] == np.arange(len(x_train)))
+
+def test_umap_transform():
+    x_train, y_train = get_test_data()
+    x_train = x_train.astype(float)
+    n_train = num_mnist*2//3
+    model = UMAP(random_state=seed)
+    x_embedded = model.fit_transform(x_train[:n_train], n_components=2, epochs=epochs, verbose=-1)
+    x_embedded_copied = x_embedded.copy()
+    x_transformed = model.transform(x_train[n_train:], verbose=-1)
+    assert x_transformed.shape == (num_mnist-n_train, 2)
+    assert np.all(np.isfinite(x_transformed))
+    # The training embedding is held fixed.
+    assert np.array_equal(model.embedding_, x_embedded_copied)
@@ -1,5 +1,8 @@
 # coding: utf-8
+import numpy as np
 from kerasy.ML.linear import LinearRegression, LinearRegressionRidge, LinearRegressionLASSO
+from kerasy.ML.linear import BayesianLinearRegression, EvidenceApproxBayesianRegression, KernelRegression
+from kerasy.ML import _kernel
 from kerasy.utils import generateSin
 from kerasy.utils import root_mean_squared_error
 
@@ -34,3 +37,106 @@ def test_linear_ridge():
 
 def test_linear_lasss():
     _test_linear_polynomial(LinearRegressionLASSO)
+
+def test_lasso_path():
+    rnd = np.random.RandomState(0)
+    x_train = rnd.randn(100, 20)
+    y_train = x_train[:,:3].dot([3.,-2.,1.]) + 0.1*rnd.randn(100)
+    model = LinearRegressionLASSO(lamda=1.0)
+    lamdas, coefs = model.path(x_train, y_train, n_lamdas=30, verbose=-1)
+    assert np.all(coefs[0] == 0)
+    # The number of non-zero coefficients increases as lamda decreases (roughly.)
+    assert np.count_nonzero(coefs[-1]) > np.count_nonzero(coefs[len(lamdas)//2])
+    # The warm-started path agrees with the individual fits.
+    for lamda,coef in zip(lamdas[::10], coefs[::10]):
+        assert np.allclose(LinearRegressionLASSO(lamda=lamda).fit(x_train, y_train).w, coef, atol=1e-5)
+    # KKT conditions: |Φ^T(y-Φw)| <= lamda (equality for the non-zero coefficients.)
+    Phi = model.basis_transform(x_train)
+    w = model.fit(x_train, y_train).w
+    grad = Phi.T.dot(y_train - Phi.dot(w))
+    assert np.all(np.abs(grad) <= model.lamda + 1e-4)
+    assert np.allclose(grad[w!=0], model.lamda*np.sign(w[w!=0]), atol=1e-4)
+
+def test_linear_partial_fit():
+    x_train, y_train = get_test_data()
+    for Model in [LinearRegression, LinearRegressionRidge, LinearRegressionLASSO]:
+        model = Model(basis="polynomial", exponent=range(1,5))
+        w = model.fit(x_train, y_train).w
+        model.reset_statistics()
+        for start in range(0, num_samples, 7):
+            model.partial_fit(x_train[start:start+7], y_train[start:start+7], batch_size=3)
+        assert model.n_samples_seen == num_samples
+        assert np.allclose(model.solve().w, w, atol=1e-6)
+
+    # Ridge: Change the regularization without reading the data again.
+    model = LinearRegressionRidge(lamda=1.0, basis="polynomial", exponent=range(1,5))
+    model.fit(x_train, y_train)
+    assert np.allclose(model.solve(lamda=1e-3).w, LinearRegressionRidge(lamda=1e-3, basis="polynomial", exponent=range(1,5)).fit(x_train, y_train).w)
+
+def test_bayesian_partial_fit():
+    x_train, y_train = get_test_data()
+    kwargs = dict(alpha=5e-3, beta=11.1, basis="gaussian", mu=np.linspace(0,1,9), sigma=0.1)
+    batch = BayesianLinearRegression(**kwargs).fit(x_train, y_train)
+    # Single observations (Sherman–Morrison) and mini-batches (Woodbury) give the batch posterior.
+    online = BayesianLinearRegression(**kwargs)
+    for i in range(10):
+        online.partial_fit(x_train[i:i+1], y_train[i:i+1])
+    for start in range(10, num_samples, 6):
+        online.partial_fit(x_train[start:start+6], y_train[start:start+6])
+    assert np.allclose(online.mN, batch.mN)
+    assert np.allclose(online.SN, batch.SN)
+
+    x_test = np.linspace(0,1,50)
+    mu, std = online.predict(x_test)
+    Phi = online.basis_transform(x_test)
+    assert np.allclose(mu, Phi.dot(batch.mN))
+    assert np.allclose(std, [np.sqrt(1/batch.beta + phi.dot(batch.SN).dot(phi)) for phi in Phi])
+
+    model = EvidenceApproxBayesianRegression(basis="gaussian", mu=np.linspace(0,1,9), sigma=0.1)
+    model.fit(x_train, y_train, verbose=-1)
+    assert model.predict(x_test)[1].shape == (50,)
+
+def test_kernel_regression_solvers():
+    x_train, y_train = get_test_data()
+    x_train = x_train.reshape(-1,1); y_train = y_train.reshape(-1,1)
+    x_test = np.linspace(0,1,50).reshape(-1,1)
+    kwargs = dict(lamda=1e-2, kernel="gaussian", sigma=0.1)
+    K = KernelRegression(**kwargs).kernel.gram(x_train)
+    theta = np.linalg.solve(K.T.dot(K)+1e-2*np.identity(num_samples), K.T.dot(y_train))
+
+    chol = KernelRegression(**kwargs).fit(x_train, y_train)
+    cg = KernelRegression(solver="cg", tol=1e-10, block_size=7, **kwargs).fit(x_train, y_train)
+    assert np.allclose(chol.theta, theta)
+    assert np.allclose(cg.theta, theta, atol=1e-6)
+    assert np.allclose(chol.predict(x_test), cg.predict(x_test), atol=1e-6)
+
+    # New targets and a used lamda reuse the cached factorization.
+    chol.fit(x_train, 2*y_train)
+    assert len(chol.cache["factors"]) == 1
+    assert np.allclose(chol.theta, 2*theta)
+    chol.lamda = 1e-1
+    chol.fit(x_train, y_train)
+    assert len(chol.cache["factors"]) == 2
+    # CG is warm-started from the previous solution.
+    n_iter = cg.n_iter
+    cg.fit(x_train, y_train)
+    assert cg.n_iter < n_iter
+
+def test_kernel_regression_cache():
+    x_train, y_train = get_test_data()
+    x_train = x_train.reshape(-1,1); y_train = y_train.reshape(-1,1)
+    # Changing the kernel must invalidate the cached gram matrix and factors.
+    model = KernelRegression(lamda=1e-2, kernel="gaussian", sigma=0.1).fit(x_train, y_train)
+    model.kernel = _kernel.get("linear")
+    model.fit(x_train, y_train)
+    expected = KernelRegression(lamda=1e-2, kernel="linear").fit(x_train, y_train)
+    assert np.allclose(model.predict(x_train), expected.predict(x_train))
+    model.kernel.c = 1
+    model.fit(x_train, y_train)
+    assert np.allclose(model.predict(x_train), KernelRegression(lamda=1e-2, kernel="linear", c=1).fit(x_train, y_train).predict(x_train))
+    # The number of cached factors is bounded.
+    model = KernelRegression(lamda=1e-2, kernel="gaussian", sigma=0.1, n_cached_factors=3)
+    for lamda in np.logspace(-3, 1, 20):
+        model.lamda = lamda
+        model.fit(x_train, y_train)
+    assert list(model.cache["factors"].keys()) == list(np.logspace(-3, 1, 20)[-3:])
@@ -1,5 +1,8 @@
 # coding: utf-8
-from kerasy.ML.svm import hardSVC, SVC
+import numpy as np
+from kerasy.ML.svm import hardSVC, SVC, MultipleSVM, RVM
+from kerasy.ML._kernel import KernelApproximation, Nystroem
+from kerasy.clib import c_svm
 from kerasy.utils import generateWhirlpool
 
 num_samples = 150
@@ -24,3 +27,102 @@ def test_hard_svc():
 def test_soft_svc():
     model = SVC(kernel="gaussian", sigma=1.0, C=10)
     _test_svm(model, target=0.75)
+
+def test_soft_svc_nystroem():
+    model = SVC(kernel="gaussian", sigma=1.0, C=10, approximation="nystroem", approx_components=150, random_state=0)
+    _test_svm(model, target=0.75)
+
+def test_svc_kernel_cache():
+    """ The solution must not depend on the cache size or the shrinking heuristics. """
+    x_train, y_train = get_test_data()
+    models = [
+        SVC(kernel="gaussian", sigma=1.0, C=10).fit(x_train, y_train, shrinking=shrinking, cache_size=cache_size, sparse_memorize=False, verbose=-1)
+        for shrinking,cache_size in [(True, 200), (False, 1e-3)]
+    ]
+    assert np.allclose(models[0].a, models[1].a, atol=1e-2)
+    assert abs(models[0].b - models[1].b) < 1e-2
+
+def test_svc_decision_function():
+    x_train, y_train = get_test_data()
+    model = SVC(kernel="gaussian", sigma=1.0, C=10).fit(x_train, y_train, sparse_memorize=True, verbose=-1)
+    assert np.allclose(model.decision_function(x_train, batch_size=7), [model.y(x) for x in x_train])
+
+def test_multiple_svm():
+    x_train, y_train = get_test_data()
+    x_train = np.r_[x_train, x_train+[5,0]]
+    y_train = np.r_[y_train, np.full_like(y_train, 2)]
+    model = MultipleSVM(kernel="gaussian", sigma=1.0, C=10)
+    model.fit(x_train, y_train, max_iter=max_iter)
+    decision = model.decision_function(x_train, batch_size=7)
+    assert np.allclose(decision, np.column_stack([svm.decision_function(x_train) for svm in model.weekSVMs]))
+    assert model.accuracy(x_train, y_train) >= 0.75
+
+def test_multiple_svm_n_jobs():
+    x_train, y_train = get_test_data()
+    x_train = np.r_[x_train, x_train+[5,0]]
+    y_train = np.r_[y_train, np.full_like(y_train, 2)]
+    models = [
+        MultipleSVM(kernel="gaussian", sigma=1.0, C=10).fit(x_train, y_train, max_iter=max_iter, n_jobs=n_jobs, verbose=-1)
+        for n_jobs in [1, 2]
+    ]
+    assert np.allclose(models[0].decision_function(x_train), models[1].decision_function(x_train))
+
+def test_multiple_svm_approximation():
+    x_train, y_train = get_test_data()
+    x_train = np.r_[x_train, x_train+[5,0]]
+    y_train = np.r_[y_train, np.full_like(y_train, 2)]
+    models = [
+        MultipleSVM(kernel="gaussian", sigma=1.0, C=10, approximation="nystroem", approx_components=150, random_state=0)
+        .fit(x_train, y_train, max_iter=max_iter, n_jobs=n_jobs, verbose=-1)
+        for n_jobs in [1, 2]
+    ]
+    assert all(isinstance(svm.kernel, KernelApproximation) for svm in models[0].weekSVMs)
+    # The gram matrix is precomputed for n_jobs>1, so the solutions agree up to the tolerance of the KKT conditions.
+    assert np.allclose(models[0].decision_function(x_train), models[1].decision_function(x_train), atol=1e-2)
+    assert models[0].accuracy(x_train, y_train) >= 0.75
+
+def test_rvm():
+    rnd = np.random.RandomState(0)
+    x_train = np.sort(rnd.uniform(-5, 5, size=200))[:,None]
+    y_train = np.sinc(x_train[:,0]/np.pi) + rnd.normal(scale=0.1, size=200)
+    model = RVM(kernel="gaussian", sigma=1.0).fit(x_train, y_train, verbose=-1)
+    mu, std = model.predict(x_train)
+    assert len(model.relevance_vectors) < 20
+    assert np.sqrt(np.mean((mu - np.sinc(x_train[:,0]/np.pi))**2)) < 0.05
+    # The rank-one updates must agree with the posterior computed directly.
+    Phi = model.design_matrix(x_train)
+    SN = np.linalg.inv(np.diag(model.alpha) + model.beta*Phi.T.dot(Phi))
+    assert np.allclose(model.SN, SN, atol=1e-6)
+
+def test_svc_approximation_transform_once(monkeypatch):
+    x_train, y_train = get_test_data()
+    n_calls = []
+    transform = Nystroem.transform
+    def counting_transform(self, X):
+        n_calls.append(len(X))
+        return transform(self, X)
+    monkeypatch.setattr(Nystroem, "transform", counting_transform)
+    model = SVC(kernel="gaussian", sigma=1.0, C=10, approximation="nystroem", approx_components=50, random_state=0)
+    model.fit(x_train, y_train, max_iter=max_iter, verbose=-1)
+    # The full training set is transformed only once. (Not on every cache miss of the kernel rows.)
+    assert n_calls.count(len(x_train)) == 1
+    assert len(n_calls) == 1
+
+def test_smo_shared_kernel_cache():
+    x_train, y_train = get_test_data()
+    x_train = np.ascontiguousarray(x_train, dtype=float)
+    N = len(x_train)
+    kernel = SVC(kernel="gaussian", sigma=1.0).kernel
+    n_calls = []
+    def get_row(i):
+        n_calls.append(i)
+        return kernel.gram(x_train[i], x_train)[0]
+    K_diag = kernel.diag(x_train)
+    kernel_cache = c_svm.LRUKernelCache(get_row, N, cache_size=200)
+    Y = [np.where(y_train==cls, 1., -1.) for cls in np.unique(y_train)] * 3
+    for y in Y:
+        a, b, n_iter = c_svm.smo(None, y, K_diag, C=10, verbose=-1, kernel_cache=kernel_cache)
+        a_, b_, _ = c_svm.smo(get_row, y, K_diag, C=10, verbose=-1)
+        assert np.allclose(a, a_) and np.isclose(b, b_)
+    # Each kernel row is computed at most once across the problems sharing the cache.
+    assert kernel_cache.n_misses <= N
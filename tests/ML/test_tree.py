@@ -1,6 +1,7 @@
 # coding: utf-8
 import os
-from kerasy.ML.tree import DecisionTreeClassifier
+import numpy as np
+from kerasy.ML.tree import DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier
 from kerasy.utils import cluster_accuracy
 from kerasy.utils import generateWholeCakes
 
@@ -36,3 +37,43 @@ def test_decision_tree(target=0.75, path="decision_tree.png"):
         os.remove(path)
 
     assert score >= target
+
+def test_decision_tree_histogram():
+    x_train, y_train = get_test_data()
+    for criterion in ["gini", "entropy"]:
+        exact = DecisionTreeClassifier(criterion=criterion, max_depth=8, random_state=0)
+        exact.fit(x_train, y_train)
+        # If the number of unique values is less than max_bins, the histogram mode is exact.
+        hist = DecisionTreeClassifier(criterion=criterion, max_depth=8, random_state=0, max_bins=256)
+        hist.fit(x_train, y_train)
+        assert np.all(exact.predict(x_train) == hist.predict(x_train))
+        assert np.allclose(exact.feature_importances_, hist.feature_importances_)
+
+        coarse = DecisionTreeClassifier(criterion=criterion, max_depth=8, random_state=0, max_bins=16)
+        coarse.fit(x_train, y_train)
+        assert coarse.score(x_train, y_train) >= 0.9
+
+def test_compact_tree(path="decision_tree.npz"):
+    x_train, y_train = get_test_data()
+    model = DecisionTreeClassifier(criterion="gini", max_depth=4, random_state=0)
+    model.fit(x_train, y_train)
+    # Vectorized prediction must agree with the recursion over the linked nodes.
+    assert np.all(model.predict(x_train) == [model.root.predict(x) for x in x_train])
+    assert np.allclose(np.sum(model.predict_proba(x_train), axis=1), 1)
+
+    model.save_tree(path)
+    loaded = DecisionTreeClassifier().load_tree(path)
+    os.remove(path)
+    assert np.all(loaded.predict(x_train) == model.predict(x_train))
+    assert np.allclose(loaded.feature_importances_, model.feature_importances_)
+
+def test_random_forest():
+    x_train, y_train = get_test_data()
+    for Ensemble in [RandomForestClassifier, ExtraTreesClassifier]:
+        models = [
+            Ensemble(n_estimators=10, max_depth=8, random_state=0, n_jobs=n_jobs).fit(x_train, y_train)
+            for n_jobs in [1, 2]
+        ]
+        assert models[0].score(x_train, y_train) >= 0.9
+        assert np.allclose(models[0].predict_proba(x_train), models[1].predict_proba(x_train, batch_size=64))
+        assert np.isclose(np.sum(models[0].feature_importances_), 1)